@@ -85,6 +85,7 @@ parser.add_argument('--paired', action='store_true', help='if set, <infile> shou
 parser.add_argument('--extra-columns', help='colon-separated list of additional partis output columns (beyond sequences), to write to the output file. If writing to a fasta file, the column values are appended after the sequence name, separated by --fasta-info-separator. If writing to csv/tsv, they\'re written as proper, labeled columns.')
 parser.add_argument('--partition-index', type=int, help='if set, use the partition at this index in the cluster path, rather than the default of using the best partition')
 parser.add_argument('--seed-unique-id', help='if set, take sequences only from the cluster containing this seed sequence, rather than the default of taking all sequences from all clusters')
+parser.add_argument('--queries', help='if set, take sequences only from clusters containing at least one of the sequence ids in this colon-separated list (like --seed-unique-id, but for any number of ids)')
 parser.add_argument('--cluster-index', type=int, help='if set, take sequences only from the cluster at this index in the partition, rather than the default of taking all sequences from all clusters. This index is with respect to the cluster order found in the file (which, in contrast to plots made by --plotdir, is *not* sorted by size)')
 parser.add_argument('--sort-by-size', action='store_true', help='if set, sort clusters in partition by decreasing size before applying --cluster-index')
 parser.add_argument('--indel-reversed-seqs', action='store_true', help='if set, take sequences that have had any shm indels "reversed" (i.e. insertions are reversed, and deletions are replaced with the germline bases) rather than the default of using sequences from the original input file. Indel-reversed sequences can be convenient because they are by definition the same length as and aligned to the naive sequence.')
@@ -121,6 +122,7 @@ if 'extract-fasta.py' in sys.argv[0]:  # if they're trying to run this old scrip
 
 args = parser.parse_args()
 args.extra_columns = utils.get_arg_list(args.extra_columns)
+args.queries = utils.get_arg_list(args.queries)
 args.meta_emph_formats = utils.get_arg_list(args.meta_emph_formats, key_val_pairs=True)
 utils.meta_emph_arg_process(args)
 if args.paired:
@@ -148,6 +150,15 @@ else:
             # glutils.write_glfo(args.glfo_dir + '-parsed', glfo, debug=True)
             glfd = None
         glfo, annotation_list, cpath = utils.read_airr_output(args.infile, locus=args.locus, glfo=glfo, glfo_dir=glfd, skip_other_locus=args.skip_other_locus)
+    elif utils.getsuffix(args.infile) == '.yaml' and args.plotdir is None and any(a is not None for a in [args.cluster_index, args.seed_unique_id, args.queries]):  # if we only need a few clusters, read just the partitions now, then below read only the annotations we need (using the index file, if it's there)
+        glfo, annotation_list, cpath = utils.read_yaml_output(args.infile, skip_annotations=True)
+        if cpath.i_best is None:  # no partition in the file, so we have to go by the annotations
+            if args.cluster_index is None:  # we only need the annotations containing the uids we were given (which the index, if it's there, can find without reading the whole file)
+                annotation_list = utils.read_yaml_annotations_for_uids(args.infile, [args.seed_unique_id] if args.seed_unique_id is not None else args.queries, glfo=glfo)
+                if args.seed_unique_id is not None and args.queries is not None:
+                    annotation_list = [l for l in annotation_list if len(set(args.queries) & set(l['unique_ids'])) > 0]
+            else:
+                glfo, annotation_list, cpath = utils.read_output(args.infile, glfo_dir=args.glfo_dir, locus=args.locus)
     else:
         glfo, annotation_list, cpath = utils.read_output(args.infile, glfo_dir=args.glfo_dir, locus=args.locus)
 
@@ -204,9 +215,16 @@ else:
         clusters_to_use = [c for c in clusters_to_use if args.seed_unique_id in c]  # NOTE can result in more than one cluster with the seed sequence (e.g. if this file contains intermediate annotations from seed partitioning))
         modified = True
         print('    removing clusters not containing sequence \'%s\' (leaving %d)' % (args.seed_unique_id, len(clusters_to_use)))
+    if args.queries is not None:
+        clusters_to_use = [c for c in clusters_to_use if len(set(args.queries) & set(c)) > 0]
+        modified = True
+        print('    removing clusters not containing any of the %d --queries (leaving %d)' % (len(args.queries), len(clusters_to_use)))
     if modified:
         cpath = ClusterPath(partition=clusters_to_use, seed_unique_id=args.seed_unique_id)
-        antn_dict = utils.get_annotation_dict(annotation_list)
+        if annotation_list is None:
+            antn_dict = utils.read_yaml_annotations_for_clusters(args.infile, clusters_to_use, glfo=glfo)
+        else:
+            antn_dict = utils.get_annotation_dict(annotation_list)
         annotation_list = [antn_dict[':'.join(c)] for c in clusters_to_use if ':'.join(c) in antn_dict]
 
 if not os.path.exists(os.path.dirname(os.path.abspath(args.outfile))):
@@ -8,7 +8,6 @@ import sys
 import os
 import operator
 from subprocess import check_call
-import scipy
 import glob
 import numpy
 
@@ -43,8 +42,6 @@ class AlleleFinder(object):
         self.args = args
         self.itry = itry
 
-        self.param_order = ['slope', 'y_icpt']
-
         self.fraction_of_seqs_to_exclude = 0.01  # exclude the fraction of sequences with largest v_{5,3}p deletions whose counts add up to this fraction of total sequences NOTE you don't want to make this too big, because although you'll be removing all the seqs with large 4p deletions, this number also gets used when you're deciding whether your new allele is in the default glfo
         self.n_bases_to_exclude = {'5p' : {}, '3p' : {}}  # i.e. on all the seqs we keep, we exclude this many bases; and any sequences that have larger deletions than this are not kept
         self.genes_to_exclude = set()  # genes that, with the above restrictions, are entirely excluded
@@ -81,7 +78,8 @@ class AlleleFinder(object):
 
         self.seq_info = {}
 
-        self.counts, self.fitfos = {}, {}
+        self.count_keys = ['muted', 'total'] + utils.nukes
+        self.counts, self.fitfos = {}, {}  # counts: for each gene, for each of <self.count_keys>, an array of shape (gl position, n_mutes)
         self.inferred_allele_info = []  # new alleles with respect to the template genes from which we actually inferred them, for usage internal to allelefinder
         self.new_allele_info = []  #  new alleles with respect to original template genes, for external use (distinction is important if we infer a new allele from another previously-inferred new allele)
         self.positions_to_plot = {}
@@ -123,11 +121,8 @@ class AlleleFinder(object):
 
     # ----------------------------------------------------------------------------------------
     def init_gene(self, gene):
-        self.counts[gene] = {}
-        for igl in range(len(self.glfo['seqs'][utils.get_region(gene)][gene])):
-            self.counts[gene][igl] = {}
-            for istart in range(self.args.n_max_mutations_per_segment + 1):  # istart and n_mutes are equivalent
-                self.counts[gene][igl][istart] = {n : 0 for n in ['muted', 'total'] + utils.nukes}
+        n_positions = len(self.glfo['seqs'][utils.get_region(gene)][gene])
+        self.counts[gene] = {k : numpy.zeros((n_positions, self.args.n_max_mutations_per_segment + 1), dtype=numpy.int64) for k in self.count_keys}  # istart and n_mutes are equivalent
         self.gene_obs_counts[gene] = 0
         self.per_gene_mute_counts[gene] = Hist(self.args.n_max_mutations_per_segment - 1, 0.5, self.args.n_max_mutations_per_segment - 0.5)  # i.e. 0th (underflow) bin corresponds to zero mutations
         for side in self.n_big_del_skipped:
@@ -308,33 +303,33 @@ class AlleleFinder(object):
         return False
 
     # ----------------------------------------------------------------------------------------
-    def increment_query(self, uid, gene):
-        self.gene_obs_counts[gene] += 1
-
-        n_mutes, germline_seq, query_seq = [self.seq_info[uid][tn] for tn in ['n_mutes', 'gl_seq', 'qr_seq']]  # historical...
-        self.overall_mute_counts.fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
-        self.per_gene_mute_counts[gene].fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
-
-        assert len(germline_seq) == len(self.glfo['seqs'][self.region][gene]) - self.n_bases_to_exclude['5p'][gene] - self.n_bases_to_exclude['3p'][gene]
-        for ipos in range(len(germline_seq)):
-            igl = ipos + self.n_bases_to_exclude['5p'][gene]  # position in original (i.e. complete) germline gene
-
-            if germline_seq[ipos] == utils.ambig_base or query_seq[ipos] == utils.ambig_base:  # skip if either germline or query sequence is ambiguous at this position
-                continue
-
-            self.counts[gene][igl][n_mutes]['total'] += 1
-            if query_seq[ipos] != germline_seq[ipos]:  # if this position is mutated
-                self.counts[gene][igl][n_mutes]['muted'] += 1  # mark that we saw this germline position mutated once in a sequence with <n_mutes> regional mutation frequency
-            self.counts[gene][igl][n_mutes][query_seq[ipos]] += 1  # if there's a new allele, we need this to work out what the snp'd base is
-
-    # ----------------------------------------------------------------------------------------
-    def get_residual_sum(self, xvals, yvals, errs, slope, intercept, debug=False):
-        def expected(x):
-            return slope * x + intercept
-        residuals = [(y - expected(x))**2 / err**2 for x, y, err in zip(xvals, yvals, errs)]
-        if debug:
-            print('resid: ' + ' '.join(['%5.3f' % r for r in residuals]))
-        return sum(residuals)
+    def increment_queries(self, gene, uids):  # increment counts for all of <uids> (which must all have <gene>) at once
+        if len(uids) == 0:
+            return
+        self.gene_obs_counts[gene] += len(uids)
+        for uid in uids:
+            self.overall_mute_counts.fill(self.seq_info[uid]['n_mutes'])  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
+            self.per_gene_mute_counts[gene].fill(self.seq_info[uid]['n_mutes'])  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
+
+        seq_len = len(self.glfo['seqs'][self.region][gene]) - self.n_bases_to_exclude['5p'][gene] - self.n_bases_to_exclude['3p'][gene]
+        assert all(len(self.seq_info[u]['gl_seq']) == seq_len for u in uids)
+        def seqarr(skey): return numpy.frombuffer(''.join(self.seq_info[u][skey] for u in uids).encode(), dtype=numpy.uint8).reshape(len(uids), seq_len)
+        gl_arr, qr_arr = seqarr('gl_seq'), seqarr('qr_seq')
+        n_mutes = numpy.array([self.seq_info[u]['n_mutes'] for u in uids], dtype=numpy.int64)
+        n_bins = self.args.n_max_mutations_per_segment + 1
+        ambig = ord(utils.ambig_base)
+        use = (gl_arr != ambig) & (qr_arr != ambig)  # skip if either germline or query sequence is ambiguous at a position
+        is_nuke = {n : qr_arr == ord(n) for n in utils.nukes}
+        if (use & ~numpy.logical_or.reduce(list(is_nuke.values()))).any():
+            raise Exception('unexpected char[s] in qr seqs for %s (expected only %s)' % (gene, ' '.join(utils.nukes + [utils.ambig_base])))
+        flat_indices = numpy.arange(seq_len)[None, :] * n_bins + n_mutes[:, None]  # index into flattened (position, n_mutes) array for each query/position
+        def bincount(mask): return numpy.bincount(flat_indices[mask], minlength=seq_len * n_bins).reshape(seq_len, n_bins)
+        istart = self.n_bases_to_exclude['5p'][gene]  # position in original (i.e. complete) germline gene
+        gcts = self.counts[gene]  # shorthand name
+        gcts['total'][istart : istart + seq_len] += bincount(use)
+        gcts['muted'][istart : istart + seq_len] += bincount(use & (qr_arr != gl_arr))  # mark that we saw each germline position mutated in sequences with <n_mutes> regional mutation frequency
+        for nuke in utils.nukes:
+            gcts[nuke][istart : istart + seq_len] += bincount(use & is_nuke[nuke])  # if there's a new allele, we need this to work out what the snp'd base is
 
     # ----------------------------------------------------------------------------------------
     def dbgstr(self, fitfo, extra_str='', pvals=None):
@@ -384,57 +379,83 @@ class AlleleFinder(object):
         return True
 
     # ----------------------------------------------------------------------------------------
-    def get_scipy_results(self, fixed_y_icpt, linefunc, n_mutelist, freqs, errs, bounds, fitfo):
-        params, cov = scipy.optimize.curve_fit(linefunc, n_mutelist, freqs, sigma=errs, bounds=bounds)
-        self.n_fits += 1
-
-        def retrieve(param):
-            iparam = self.param_order.index(param)
-            cov_err = math.sqrt(cov[iparam][iparam])
-            if self.cov_err_ok(cov_err, errs):
-                err = cov_err
-            else:
-                err = self.hack_err(param, errs, n_mutelist)
-            return params[iparam], err
-
-        fitfo['slope'], fitfo['slope_err'] = retrieve('slope')
-        if not fixed_y_icpt:
-            fitfo['y_icpt'], fitfo['y_icpt_err'] = retrieve('y_icpt')
+    def fit_lines(self, xvals, yvals, errs, y_icpt_bounds):
+        """
+        Weighted least squares line fits to each row of the (n fits, n points) arrays <xvals>, <yvals>, <errs>, with slope bounded by self.default_slope_bounds and y-icpt by the corresponding row of <y_icpt_bounds> (y-icpt is fixed for rows where the two bounds are equal).
+        These are the same fits that scipy.optimize.curve_fit() would do, but since they're linear we can do them all at once in closed form.
+        Returns arrays of slope, y-icpt, their (covariance) uncertainties, and residual sums.
+        """
+        xvals, yvals, errs, y_icpt_bounds = [numpy.array(v, dtype=float) for v in [xvals, yvals, errs, y_icpt_bounds]]
+        fixed = y_icpt_bounds[:, 0] == y_icpt_bounds[:, 1]
+        ylo, yhi = y_icpt_bounds[:, 0], y_icpt_bounds[:, 1]
+        weights = 1. / errs**2
+        sw, swx, swxx, swy, swxy = [numpy.sum(weights * v, axis=1) for v in [1., xvals, xvals * xvals, yvals, xvals * yvals]]
+        def resids(slope, y_icpt): return numpy.sum(weights * (yvals - slope[:, None] * xvals - y_icpt[:, None])**2, axis=1)
+        def best_slope(y_icpt): return numpy.clip((swxy - y_icpt * swx) / swxx, *self.default_slope_bounds)  # best slope for fixed y-icpt (it's a 1d quadratic, so clipping to the bounds gives the constrained minimum)
+        def best_y_icpt(slope): return numpy.clip((swy - slope * swx) / sw, ylo, yhi)
+
+        # if the unconstrained minimum is outside the bounds, the constrained minimum is on one of the four edges of the bounds (and for fixed y-icpt, it's on the ylo = yhi edge)
+        with numpy.errstate(divide='ignore', invalid='ignore'):  # (det is zero for fixed-y-icpt rows with only two points, but we don't use those values)
+            det = swxx * sw - swx**2
+            free_slope, free_y_icpt = (sw * swxy - swx * swy) / det, (swxx * swy - swx * swxy) / det
+        in_bounds = ~fixed & (free_slope >= self.default_slope_bounds[0]) & (free_slope <= self.default_slope_bounds[1]) & (free_y_icpt >= ylo) & (free_y_icpt <= yhi)
+        slo, shi = [numpy.full(len(fixed), b) for b in self.default_slope_bounds]
+        cands = [(best_slope(ylo), ylo), (best_slope(yhi), yhi), (slo, best_y_icpt(slo)), (shi, best_y_icpt(shi))]
+        cand_resids = numpy.array([numpy.where(fixed & (ic > 1), numpy.inf, resids(sl, yi)) for ic, (sl, yi) in enumerate(cands)])
+        ibest = numpy.argmin(cand_resids, axis=0)
+        slopes = numpy.choose(ibest, [c[0] for c in cands])
+        y_icpts = numpy.choose(ibest, [c[1] for c in cands])
+        slopes, y_icpts = numpy.where(in_bounds, free_slope, slopes), numpy.where(in_bounds, free_y_icpt, y_icpts)
+        residual_sums = resids(slopes, y_icpts)
+
+        # uncertainties from the covariance matrix (scaled by reduced chi square, as in curve_fit())
+        ndofs = xvals.shape[1] - numpy.where(fixed, 1, 2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            slope_errs = numpy.sqrt(numpy.where(fixed, 1. / swxx, sw / det) * residual_sums / ndofs)
+            y_icpt_errs = numpy.where(fixed, float('inf'), numpy.sqrt(swxx / det * residual_sums / ndofs))
+        return slopes, y_icpts, slope_errs, y_icpt_errs, residual_sums
 
     # ----------------------------------------------------------------------------------------
-    def get_curvefit(self, pvals, y_icpt_bounds, debug=False):
-        n_mutelist, freqs, errs = self.get_tmp_fitvals(pvals)  # this is probably kind of slow
-        if y_icpt_bounds[0] == y_icpt_bounds[1]:  # fixed y-icpt
-            fitfo = self.default_fitfo(n_mutelist, freqs, errs, ndof=len(n_mutelist) - 1, y_icpt_bounds=y_icpt_bounds)
-            fitfo['y_icpt'] = y_icpt_bounds[0]
-            if fitfo['ndof'] > 0:
-                def linefunc(x, slope):
-                    return slope*x + fitfo['y_icpt']
-                bounds = self.default_slope_bounds
-                self.get_scipy_results(True, linefunc, n_mutelist, freqs, errs, bounds, fitfo)  # modifies <fitfo>
-            elif fitfo['ndof'] == 0:
-                fitfo = self.approx_fit_vals(pvals, fixed_y_icpt=fitfo['y_icpt'], debug=debug)
-        else:  # floating y-icpt
-            fitfo = self.default_fitfo(n_mutelist, freqs, errs, ndof=len(n_mutelist) - 2, y_icpt_bounds=y_icpt_bounds)
+    def get_curvefits(self, pvals_list, y_icpt_bounds_list, dbgs=None):  # fit all of <pvals_list> at once (they must all have the same number of points)
+        if dbgs is None:
+            dbgs = [False for _ in pvals_list]
+        fitvals = [self.get_tmp_fitvals(pvals) for pvals in pvals_list]  # this is probably kind of slow
+        fitfos = []
+        for (n_mutelist, freqs, errs), pvals, y_icpt_bounds, dbg in zip(fitvals, pvals_list, y_icpt_bounds_list, dbgs):
+            fixed_y_icpt = y_icpt_bounds[0] == y_icpt_bounds[1]
+            fitfo = self.default_fitfo(n_mutelist, freqs, errs, ndof=len(n_mutelist) - (1 if fixed_y_icpt else 2), y_icpt_bounds=y_icpt_bounds)
+            if fixed_y_icpt:
+                fitfo['y_icpt'] = y_icpt_bounds[0]
+            if fitfo['ndof'] == 0:
+                fitfo = self.approx_fit_vals(pvals, fixed_y_icpt=fitfo['y_icpt'] if fixed_y_icpt else None, debug=dbg)
+            fitfos.append(fitfo)
+
+        ifits = [i for i, f in enumerate(fitfos) if f['ndof'] > 0]
+        if len(ifits) > 0:
+            assert len(set(len(fitvals[i][0]) for i in ifits)) == 1
+            fit_results = self.fit_lines(*[[fitvals[i][iv] for i in ifits] for iv in range(3)], y_icpt_bounds=[y_icpt_bounds_list[i] for i in ifits])
+            self.n_fits += len(ifits)
+            iresults = {ifit : ir for ir, ifit in enumerate(ifits)}
+        for ifit, (fitfo, (n_mutelist, freqs, errs), dbg) in enumerate(zip(fitfos, fitvals, dbgs)):
             if fitfo['ndof'] > 0:
-                def linefunc(x, slope, y_icpt):
-                    return slope*x + y_icpt
-                bounds = [[s, y] for s, y in zip(self.default_slope_bounds, y_icpt_bounds)]
-                self.get_scipy_results(False, linefunc, n_mutelist, freqs, errs, bounds, fitfo)  # modifies <fitfo>
-            elif fitfo['ndof'] == 0:
-                fitfo = self.approx_fit_vals(pvals, fixed_y_icpt=None, debug=debug)
-
-        if fitfo['ndof'] > 0:
-            fitfo['residual_sum'] = self.get_residual_sum(n_mutelist, freqs, errs, fitfo['slope'], fitfo['y_icpt'])
-            fitfo['residuals_over_ndof'] = float(fitfo['residual_sum']) / fitfo['ndof']
-        else:
-            fitfo['residual_sum'] = 1.
-            fitfo['residuals_over_ndof'] = 0.
+                slope, y_icpt, slope_err, y_icpt_err, residual_sum = [float(v[iresults[ifit]]) for v in fit_results]
+                fitfo['slope'], fitfo['slope_err'] = slope, slope_err if self.cov_err_ok(slope_err, errs) else self.hack_err('slope', errs, n_mutelist)
+                if fitfo['y_icpt_bounds'][0] != fitfo['y_icpt_bounds'][1]:
+                    fitfo['y_icpt'], fitfo['y_icpt_err'] = y_icpt, y_icpt_err if self.cov_err_ok(y_icpt_err, errs) else self.hack_err('y_icpt', errs, n_mutelist)
+                fitfo['residual_sum'] = residual_sum
+                fitfo['residuals_over_ndof'] = float(fitfo['residual_sum']) / fitfo['ndof']
+            else:
+                fitfo['residual_sum'] = 1.
+                fitfo['residuals_over_ndof'] = 0.
 
-        if debug:
-            print(self.dbgstr(fitfo, extra_str='fit', pvals={'n_mutelist' : n_mutelist, 'freqs' : freqs, 'errs': errs}))  # not necessarily the same as <pvals>
+            if dbg:
+                print(self.dbgstr(fitfo, extra_str='fit', pvals={'n_mutelist' : n_mutelist, 'freqs' : freqs, 'errs': errs}))  # not necessarily the same as <pvals>
 
-        return fitfo
+        return fitfos
+
+    # ----------------------------------------------------------------------------------------
+    def get_curvefit(self, pvals, y_icpt_bounds, debug=False):
+        return self.get_curvefits([pvals], [y_icpt_bounds], dbgs=[debug])[0]
 
     # ----------------------------------------------------------------------------------------
     def get_reweights(self, gene, position, debug=False):
@@ -444,61 +465,60 @@ class AlleleFinder(object):
         I don't think it's right yet, although it kind of works.
         In any case, shit works fine without reweighting, so I don't feel like dealing with the complication a.t.m. (especially don't want to deal with correcting the uncertainties for reweighting).
         """
-        gcts = self.counts[gene][position]  # shorthand name
-        overall_nuke_totals = {n : 0 for n in utils.nukes}
-        per_bin_nuke_totals = {n_muted : {n : 0 for n in utils.nukes} for n_muted in gcts}
-        for n_muted in gcts:
-            for nuke in utils.nukes:
-                overall_nuke_totals[nuke] += gcts[n_muted][nuke]
-                per_bin_nuke_totals[n_muted][nuke] += gcts[n_muted][nuke]
-        freqs = [float(d['muted']) / d['total'] if d['total'] > 0 else 0. for d in gcts.values()]
+        gcts = {k : self.counts[gene][k][position] for k in self.count_keys}  # shorthand name (arrays over n_muted)
+        n_mutelist = list(range(len(gcts['total'])))
+        overall_nuke_totals = {n : int(gcts[n].sum()) for n in utils.nukes}
+        per_bin_nuke_totals = {n_muted : {n : int(gcts[n][n_muted]) for n in utils.nukes} for n_muted in n_mutelist}
+        freqs = [float(gcts['muted'][n]) / gcts['total'][n] if gcts['total'][n] > 0 else 0. for n in n_mutelist]
         if debug:
-            print(' ', ' '.join(['%5d' % n for n in gcts]))
+            print(' ', ' '.join(['%5d' % n for n in n_mutelist]))
             for nuke in utils.nukes:
-                print(nuke, ' '.join(['%5d' % gcts[n][nuke] for n in gcts]), overall_nuke_totals[nuke])
+                print(nuke, ' '.join(['%5d' % gcts[nuke][n] for n in n_mutelist]), overall_nuke_totals[nuke])
             print(' ', ' '.join(['%5.3f' % f for f in freqs]))
 
         reweighted_freqs = []
-        for n_muted in gcts:
+        for n_muted in n_mutelist:
             freq, total = 0., 0.
             for nuke in utils.nukes:
                 reweight = 0.
                 if per_bin_nuke_totals[n_muted][nuke] > 0:
                     reweight = float(overall_nuke_totals[nuke]) / per_bin_nuke_totals[n_muted][nuke]
-                total += reweight * gcts[n_muted][nuke]
+                total += reweight * gcts[nuke][n_muted]
                 if nuke != self.glfo['seqs'][self.region][gene][position]:
-                    freq += reweight * gcts[n_muted][nuke]
+                    freq += reweight * gcts[nuke][n_muted]
             reweighted_freqs.append(freq / total if total > 0. else 0.)
         if debug:
             print(' ', ' '.join(['%5.3f' % f for f in reweighted_freqs]))
         return reweighted_freqs
 
     # ----------------------------------------------------------------------------------------
-    def get_allele_finding_xyvals(self, gene, position):
+    def get_allele_finding_xyvals(self, gene):  # arrays of shape (position, n_mutes) for all positions in <gene>
         from . import fraction_uncertainty
-        gcts = self.counts[gene][position]  # shorthand name
-
-        obs = [d['muted'] for d in gcts.values()]
-
-        lohis = [fraction_uncertainty.err(d['muted'], d['total']) if d['total'] > 0. else (0., 1.) for d in gcts.values()]  # set uncertainty bounds to (0., 1.) for zero-denominator bins
-        errs = [(hi - lo) / 2 for lo, hi in lohis]
-        weights = [1./(e*e) for e in errs]
+        obs, total = self.counts[gene]['muted'], self.counts[gene]['total']
 
-        freqs = [float(d['muted']) / d['total'] if d['total'] > 0 else 0. for d in gcts.values()]
-        total = [d['total'] for d in gcts.values()]
+        lohis = {}  # only calculate the uncertainty once for each unique (obs, total) pair, since it's slow
+        for tobs, ttot in set(zip(obs[total > 0].tolist(), total[total > 0].tolist())):
+            lohis[(tobs, ttot)] = fraction_uncertainty.err(tobs, ttot)
+        errs = numpy.array([[(lohis[(o, t)][1] - lohis[(o, t)][0]) / 2 if t > 0 else 0.5 for o, t in zip(orow, trow)] for orow, trow in zip(obs.tolist(), total.tolist())])  # set uncertainty bounds to (0., 1.) for zero-denominator bins
+        weights = 1. / (errs * errs)
 
-        n_mutelist = list(gcts.keys())
+        freqs = numpy.where(total > 0, obs / numpy.maximum(total, 1), 0.)
+        n_mutelist = numpy.tile(numpy.arange(obs.shape[1]), (obs.shape[0], 1))
 
         return {'obs' : obs, 'total' : total, 'n_mutelist' : n_mutelist, 'freqs' : freqs, 'errs' : errs, 'weights' : weights}
 
+    # ----------------------------------------------------------------------------------------
+    def get_xyvals_for_position(self, gene, pos, min_ibin=None, max_ibin=None):  # lists (over n_mutes) for <pos> from the per-gene arrays in self.xyarrays, optionally restricted to bins [min_ibin, max_ibin)
+        return {k : v[pos, min_ibin : max_ibin].tolist() for k, v in self.xyarrays[gene].items()}
+
     # ----------------------------------------------------------------------------------------
     def get_both_pre_post_vals(self, gene, istart, positions_to_try_to_fit):
         # NOTE I'm including the zero bin here -- do I really want to do that? UPDATE yes, I think so -- we know there will be zero mutations in that bin, but the number of sequences in it still contains information (uh, I think)
         min_ibin = max(0, istart - self.max_fit_length)
         max_ibin = min(self.args.n_max_mutations_per_segment, istart + self.max_fit_length)
-        bothxyvals = {pos : {k : v[min_ibin : max_ibin] for k, v in self.xyvals[gene][pos].items()} for pos in positions_to_try_to_fit}
-        prexyvals = {pos : {k : v[min_ibin : istart] for k, v in self.xyvals[gene][pos].items()} for pos in positions_to_try_to_fit}  # arrays up to, but not including, <istart>
-        postxyvals = {pos : {k : v[istart : max_ibin] for k, v in self.xyvals[gene][pos].items()} for pos in positions_to_try_to_fit}  # arrays from <istart> onwards
+        bothxyvals = {pos : self.get_xyvals_for_position(gene, pos, min_ibin, max_ibin) for pos in positions_to_try_to_fit}
+        prexyvals = {pos : self.get_xyvals_for_position(gene, pos, min_ibin, istart) for pos in positions_to_try_to_fit}  # arrays up to, but not including, <istart>
+        postxyvals = {pos : self.get_xyvals_for_position(gene, pos, istart, max_ibin) for pos in positions_to_try_to_fit}  # arrays from <istart> onwards
         return bothxyvals, prexyvals, postxyvals
 
     # ----------------------------------------------------------------------------------------
@@ -661,8 +681,8 @@ class AlleleFinder(object):
     # ----------------------------------------------------------------------------------------
     def empty_pre_bins(self, gene, istart, positions_to_try_to_fit, debug=False):
         """ return true if fewer than <istart> positions have enough entries in the bins before <istart> """
-        prexyvals = {pos : {k : v[:istart] for k, v in self.xyvals[gene][pos].items()} for pos in positions_to_try_to_fit}  # arrays up to, but not including, <istart>
-        good_positions = [pos for pos in positions_to_try_to_fit if sum(prexyvals[pos]['total']) > self.n_total_min]  # almost the same as the line where we get <positions_to_try_to_fit>, except now it's only the bins before <istart>
+        pre_totals = self.xyarrays[gene]['total'][:, :istart].sum(axis=1)  # bins up to, but not including, <istart>
+        good_positions = [pos for pos in positions_to_try_to_fit if pre_totals[pos] > self.n_total_min]  # almost the same as the line where we get <positions_to_try_to_fit>, except now it's only the bins before <istart>
         return len(good_positions) < istart
 
     # ----------------------------------------------------------------------------------------
@@ -705,68 +725,64 @@ class AlleleFinder(object):
         return istart_freq - last_freq > self.big_discontinuity_factor(istart) * joint_freq_err
 
     # ----------------------------------------------------------------------------------------
-    def fit_position(self, gene, istart, pos, prevals, postvals, bothvals, candidate_ratios, residfo, debug=False):
+    def returnfcn(self, dbg, label):
+        if dbg:
+            print(label)
+            return False  # keep going (don't skip it) if it's a dbg pos/istart
+        else:
+            return True
+
+    # ----------------------------------------------------------------------------------------
+    def skip_position(self, gene, istart, pos, prevals, postvals, bothvals, big_y_icpt_bounds):  # checks that don't need the full fits (returns True if we should skip <pos>)
         dbg = self.dbgfcn(pos, istart)
         if dbg:
             print('pos %d' % pos)
         big_y_icpt, big_y_icpt_err = self.get_big_y(postvals)
-        big_y_icpt_bounds = self.get_big_y_icpt_bounds(big_y_icpt, big_y_icpt_err)  # (big_y_icpt - 1.5*big_y_icpt_err, big_y_icpt + 1.5*big_y_icpt_err)  # we want the bounds to be lenient enough to accomodate non-zero slopes (in the future, we could do something cleverer like extrapolating with the slope of the line to x=0)
-
-        def returnfcn(label):
-            if dbg:
-                print(label)
-                return False  # keep going (don't skip it) if it's a dbg pos/istart
-            else:
-                return True
 
         # need to have enough mutated counts in the <istart>th bin (this is particularly important (partly) because it's the handle that tells us it's *this* <istart> that's correct, rather than <istart> + 1)
-        if self.counts[gene][pos][istart]['muted'] < self.n_muted_min_per_bin:
-            if returnfcn('only %d muted in <istart>th bin' % self.counts[gene][pos][istart]['muted']):
-                return
+        if self.counts[gene]['muted'][pos, istart] < self.n_muted_min_per_bin:
+            if self.returnfcn(dbg, 'only %d muted in <istart>th bin' % self.counts[gene]['muted'][pos, istart]):
+                return True
 
         if sum(postvals['obs']) < self.n_muted_min or sum(postvals['total']) < self.n_total_min:
-            if returnfcn('too few overall post-counts'):
-                return
+            if self.returnfcn(dbg, 'too few overall post-counts'):
+                return True
 
         # skip if the discontinuity is less than <factor> sigma, or if hardly any entries at i-1 and the bin totals are closer than <factor> sigma (not actualy OR, but basically)
         if not self.big_discontinuity(bothvals, istart, debug=dbg):
-            if returnfcn('no big dicontinuity'):
-                return
+            if self.returnfcn(dbg, 'no big dicontinuity'):
+                return True
 
         if istart <= self.hard_code_three:
             # if the bounds include zero, there won't be much difference between the two fits
             if big_y_icpt_bounds[0] <= 0.:
-                if returnfcn('big-y-icpt lower bound %f <= 0.' % big_y_icpt_bounds[0]):
-                    return
+                if self.returnfcn(dbg, 'big-y-icpt lower bound %f <= 0.' % big_y_icpt_bounds[0]):
+                    return True
 
             # if a rough estimate of the y-icpt is less than zero, the zero-icpt fit is probably going to be pretty good
             approx_fitfo = self.approx_fit_vals(postvals)
             if approx_fitfo['y_icpt'] < 0.:
-                if returnfcn('approx post fit y-icpt %f < 0' % approx_fitfo['y_icpt']):
-                    return
+                if self.returnfcn(dbg, 'approx post fit y-icpt %f < 0' % approx_fitfo['y_icpt']):
+                    return True
 
         # if there's only two points in <prevals>, we can't use the bad fit there to tell us this isn't a candidate, so we check and skip if the <istart - 1>th freq isn't really low
         if istart == 2 and bothvals['freqs'][istart - 1] > big_y_icpt - 1.5 * big_y_icpt_err:  # TODO wait isn't this the same as lower bound?
-            if returnfcn('complicated istart = 2 special case'):
-                return
+            if self.returnfcn(dbg, 'complicated istart = 2 special case'):
+                return True
 
         # approximate pre-slope should be smaller than approximate post-slope (for smaller <istart>s, post-slope tends to be flat, so you can't require this)
         if istart >= self.hard_code_five:
             pre_approx = self.approx_fit_vals(prevals)
             post_approx = self.approx_fit_vals(postvals)
             if not self.consistent(pre_approx['slope'], pre_approx['slope_err'], post_approx['slope'], post_approx['slope_err'], dbgstr='slope', debug=dbg) and pre_approx['slope'] > post_approx['slope']:
-                if returnfcn('pre approx slope bigger than post approx slope'):
-                    return
-
-        onefit = self.get_curvefit(bothvals, y_icpt_bounds=(0., 0.), debug=dbg)
+                if self.returnfcn(dbg, 'pre approx slope bigger than post approx slope'):
+                    return True
 
-        # don't bother with the two-piece fit if the one-piece fit is pretty good
-        if onefit['residuals_over_ndof'] < self.min_bad_fit_residual:
-            if returnfcn('one-piece fit is pretty good %f' % onefit['residuals_over_ndof']):
-                return
+        return False
 
-        prefit = self.get_curvefit(prevals, y_icpt_bounds=(0., 0.), debug=dbg)
-        postfit = self.get_curvefit(postvals, y_icpt_bounds=big_y_icpt_bounds, debug=dbg)
+    # ----------------------------------------------------------------------------------------
+    def fit_position(self, gene, istart, pos, bothvals, onefit, prefit, postfit, candidate_ratios, residfo):
+        dbg = self.dbgfcn(pos, istart)
         twofit_residuals = prefit['residuals_over_ndof'] * prefit['ndof'] + postfit['residuals_over_ndof'] * postfit['ndof']
         twofit_ndof = prefit['ndof'] + postfit['ndof']
         twofit_residuals_over_ndof = twofit_residuals / twofit_ndof
@@ -774,7 +790,7 @@ class AlleleFinder(object):
         # pre-slope should be smaller than post-slope also for the full fits (for smaller <istart>s, post-slope tends to be flat, so you can't require this)
         if istart >= self.hard_code_five:
             if not self.consistent(prefit['slope'], prefit['slope_err'], postfit['slope'], postfit['slope_err'], dbgstr='slope', debug=dbg) and prefit['slope'] > postfit['slope']:
-                if returnfcn('pre slope %f bigger than post slope %f' % (prefit['slope'], postfit['slope'])):
+                if self.returnfcn(dbg, 'pre slope %f bigger than post slope %f' % (prefit['slope'], postfit['slope'])):
                     return
 
         ratio = onefit['residuals_over_ndof'] / twofit_residuals_over_ndof if twofit_residuals_over_ndof > 0. else float('inf')
@@ -783,7 +799,7 @@ class AlleleFinder(object):
 
         # make sure two-piece fit is at least ok (unless the residual ratio is incredibly convincing)
         if ratio < self.large_residual_ratio and twofit_residuals_over_ndof > self.max_good_fit_residual:
-            if returnfcn('two-piece fit not good enough %f' % twofit_residuals_over_ndof):
+            if self.returnfcn(dbg, 'two-piece fit not good enough %f' % twofit_residuals_over_ndof):
                 return
 
         # the slope at the discontinuity should be much larger than on either side
@@ -792,11 +808,11 @@ class AlleleFinder(object):
             if sideslope == 0. or sideslopeerr == float('inf'):  # the slope error should be set to inf if there's only one point
                 continue
             if discontinuity_slope < sideslope:  # shouldn't really happen, but if I do this I don't have to worry about signs in the bit below
-                if returnfcn('disc. slope less that %-4s slope %5.3f < %5.3f' % (side, discontinuity_slope, sideslope)):
+                if self.returnfcn(dbg, 'disc. slope less that %-4s slope %5.3f < %5.3f' % (side, discontinuity_slope, sideslope)):
                     return
             frac_diff = abs((discontinuity_slope - sideslope) / sideslope)
             if frac_diff < self.min_discontinuity_slope_ratio:
-                if returnfcn('disc. slope not enough bigger than %-4s slope: abs((%5.3f - %5.3f) / %5.3f) = %4.2f < %3.1f' % (side, discontinuity_slope, sideslope, sideslope, frac_diff, self.min_discontinuity_slope_ratio)):
+                if self.returnfcn(dbg, 'disc. slope not enough bigger than %-4s slope: abs((%5.3f - %5.3f) / %5.3f) = %4.2f < %3.1f' % (side, discontinuity_slope, sideslope, sideslope, frac_diff, self.min_discontinuity_slope_ratio)):
                     return
 
         # add it as a candidate
@@ -834,8 +850,18 @@ class AlleleFinder(object):
     def fit_istart(self, gene, istart, positions_to_try_to_fit, debug=False):
         bothxyvals, prexyvals, postxyvals = self.get_both_pre_post_vals(gene, istart, positions_to_try_to_fit)
         ratios, residfo = {}, {}
-        for pos in positions_to_try_to_fit:
-            self.fit_position(gene, istart, pos, prexyvals[pos], postxyvals[pos], bothxyvals[pos], ratios, residfo, debug=debug)
+        big_y_icpt_bounds = {pos : self.get_big_y_icpt_bounds(*self.get_big_y(postxyvals[pos])) for pos in positions_to_try_to_fit}  # we want the bounds to be lenient enough to accomodate non-zero slopes (in the future, we could do something cleverer like extrapolating with the slope of the line to x=0)
+        fit_positions = [pos for pos in positions_to_try_to_fit if not self.skip_position(gene, istart, pos, prexyvals[pos], postxyvals[pos], bothxyvals[pos], big_y_icpt_bounds[pos])]
+
+        # do all the one-piece fits for this <istart> at once, then the two-piece fits (pre and post) for any positions where the one-piece fit is bad
+        onefits = self.get_curvefits([bothxyvals[p] for p in fit_positions], [(0., 0.) for _ in fit_positions], dbgs=[self.dbgfcn(p, istart) for p in fit_positions])
+        onefits = {p : f for p, f in zip(fit_positions, onefits)}
+        fit_positions = [p for p in fit_positions if onefits[p]['residuals_over_ndof'] >= self.min_bad_fit_residual or not self.returnfcn(self.dbgfcn(p, istart), 'one-piece fit is pretty good %f' % onefits[p]['residuals_over_ndof'])]  # don't bother with the two-piece fit if the one-piece fit is pretty good
+        dbgs = [self.dbgfcn(p, istart) for p in fit_positions]
+        prefits = self.get_curvefits([prexyvals[p] for p in fit_positions], [(0., 0.) for _ in fit_positions], dbgs=dbgs)
+        postfits = self.get_curvefits([postxyvals[p] for p in fit_positions], [big_y_icpt_bounds[p] for p in fit_positions], dbgs=dbgs)
+        for pos, prefit, postfit in zip(fit_positions, prefits, postfits):
+            self.fit_position(gene, istart, pos, bothxyvals[pos], onefits[pos], prefit, postfit, ratios, residfo)
         sorted_positions = sorted(ratios, key=lambda p: ratios[p], reverse=True)  # sort the candidate positions in decreasing order of residual ratio
         sorted_positions = sorted_positions[ : len(sorted_positions) - len(sorted_positions) % istart]  # remove any extra positions
         if len(sorted_positions) >= 2 * istart:  # if there's more than one candidate allele, sorted such that similar positions are together, and maybe we'll get the combinations right
@@ -865,7 +891,7 @@ class AlleleFinder(object):
         new_seq = old_seq
         mutfo = {}
         for pos in sorted(candidfo['positions']):
-            obs_counts = {nuke : self.counts[template_gene][pos][n_candidate_snps][nuke] for nuke in utils.nukes}  # NOTE it's super important to only use the counts from sequences with <n_candidate_snps> total mutations
+            obs_counts = {nuke : int(self.counts[template_gene][nuke][pos, n_candidate_snps]) for nuke in utils.nukes}  # NOTE it's super important to only use the counts from sequences with <n_candidate_snps> total mutations
             sorted_obs_counts = sorted(list(obs_counts.items()), key=operator.itemgetter(1), reverse=True)
             original_nuke = self.glfo['seqs'][self.region][template_gene][pos]
             new_nuke = None
@@ -1010,12 +1036,11 @@ class AlleleFinder(object):
         for gene, gene_queries in itertools.groupby(sorted(queries_to_use, key=keyfunc), key=keyfunc):
             gene_queries = list(gene_queries)  # otherwise i can't print the length down there...
             clusters = utils.collapse_naive_seqs(swfo, queries=gene_queries)
-            n_representatives = 0
+            chosen_queries = []
             for cluster in clusters:
-                cluster_representatives = self.choose_cluster_representatives(swfo, cluster)
-                for qchosen in cluster_representatives:
-                    self.increment_query(qchosen, swfo[qchosen][self.region + '_gene'])
-                n_representatives += len(cluster_representatives)
+                chosen_queries += self.choose_cluster_representatives(swfo, cluster)
+            self.increment_queries(gene, chosen_queries)
+            n_representatives = len(chosen_queries)
             n_total_clusters += len(clusters)
             if debug:
                 print('      %s %6d  %6d    %6d' % (utils.color_gene(gene, width=15), len(gene_queries), len(clusters), n_representatives))
@@ -1035,14 +1060,16 @@ class AlleleFinder(object):
         #             self.finalized = True
         #             return
 
-        self.xyvals = {}
+        self.xyarrays, self.xyvals = {}, {}  # per-gene arrays of shape (position, n_mutes), and the same info as per-position lists (for fitting + plotting)
         self.positions_to_plot = {gene : set() for gene in self.counts}
         for gene in genes_to_use:
             if debug:
                 print(' %s %3d count%s' % (utils.color_gene(gene, width=21), self.gene_obs_counts[gene], utils.plural(self.gene_obs_counts[gene])))
-            positions = sorted(self.counts[gene])
-            self.xyvals[gene] = {pos : self.get_allele_finding_xyvals(gene, pos) for pos in positions}
-            positions_to_try_to_fit = [pos for pos in positions if sum(self.xyvals[gene][pos]['obs']) > self.n_muted_min or sum(self.xyvals[gene][pos]['total']) > self.n_total_min]  # ignore positions with neither enough mutations nor total observations
+            self.xyarrays[gene] = self.get_allele_finding_xyvals(gene)
+            positions = list(range(self.counts[gene]['total'].shape[0]))
+            self.xyvals[gene] = {pos : self.get_xyvals_for_position(gene, pos) for pos in positions}
+            enough_counts = (self.xyarrays[gene]['obs'].sum(axis=1) > self.n_muted_min) | (self.xyarrays[gene]['total'].sum(axis=1) > self.n_total_min)
+            positions_to_try_to_fit = [pos for pos in positions if enough_counts[pos]]  # ignore positions with neither enough mutations nor total observations
 
             # if debug and len(positions) > len(positions_to_try_to_fit):
             #     self.print_skip_debug(gene, positions, positions_to_try_to_fit)
@@ -1146,7 +1173,7 @@ class AlleleFinder(object):
                     plotting.make_allele_finding_plot(plotdir + '/' + utils.sanitize_name(gene), gene, position, self.xyvals[gene][position], xmax=self.args.n_max_mutations_per_segment, fitfos=fitfos, new_gene=new_gene)
         else:
             for gene in self.counts:  # we can make plots for the positions we didn't fit, but there's a *lot* of them and they're slow
-                for position in sorted(self.counts[gene]):
+                for position in range(self.counts[gene]['total'].shape[0]):
                     both, pre, post = self.get_both_pre_post_vals(gene, istart=self.args.plot_and_fit_absolutely_everything, positions_to_try_to_fit=[position])
                     big_y_icpt, big_y_icpt_err = self.get_big_y(post[position])
                     big_y_icpt_bounds = self.get_big_y_icpt_bounds(big_y_icpt, big_y_icpt_err)
@@ -610,7 +610,7 @@ class ClusterPath(object):
             del node.seq
             del node.n_descendent_leaves
 
-        old_dtree = dtree  # this is copied from treeutils.get_tree_with_dummy_branches()
+        old_dtree = dtree  # add the naive seq as a new root above the existing one
         naive_taxon = dendropy.Taxon(naive_seq_name)
         old_dtree.taxon_namespace.add_taxon(naive_taxon)
         naive_node = dendropy.Node(taxon=naive_taxon)
@@ -1,6 +1,6 @@
 from __future__ import absolute_import, division, unicode_literals
 from __future__ import print_function
-import itertools
+import numpy
 import os
 import sys
 import math
@@ -22,57 +22,76 @@ class Glomerator(object):
     # ----------------------------------------------------------------------------------------
     def naive_seq_glomerate(self, naive_seqs, n_clusters, debug=False):
         """ Perform hierarchical agglomeration (with naive hamming distance as the distance), stopping at <n_clusters> """
+        # single linkage, where each step merges the closest pair of clusters whose merged size isn't bigger than <max_per_cluster> (until there aren't any, and then we merge whatever's closest). Ties go to the first pair in cluster creation order
+        # rather than searching all cluster pairs after each merge, we keep each cluster's nearest (allowed) neighbor, and after a merge only update the ones that it could have changed
         start = time.time()
-        clusters = [[names,] for names in naive_seqs.keys()]
-
-        seqs_per_cluster = float(len(clusters)) / n_clusters
+        n_seqs = len(naive_seqs)
+        seqs_per_cluster = float(n_seqs) / n_clusters
         max_per_cluster = int(math.ceil(seqs_per_cluster))
         if debug:
             print('  max %d per cluster' % max_per_cluster)
 
-        distances = {}  # cache the calculated fractional hamming distances
+        distances = utils.hamming_fraction_matrix(list(naive_seqs.values()))  # starts as the fractional hamming distance between seqs, then each merged cluster's row/column is replaced with the min of its two constituents' (single linkage)
+        slot_clusters = [[names,] for names in naive_seqs.keys()]  # each merged cluster goes in the "slot" (matrix row/column) of its first constituent
+        slot_ids = numpy.arange(n_seqs)  # creation order of the cluster in each slot (for tie breaking)
+        sizes = numpy.ones(n_seqs, dtype=int)
+        active = numpy.ones(n_seqs, dtype=bool)
+        nn_slots, nn_dists = numpy.full(n_seqs, -1), numpy.full(n_seqs, numpy.inf)  # nearest allowed neighbor of each slot (-1 if there isn't one), and the distance to it
+
+        # ----------------------------------------------------------------------------------------
+        def allowed(islot):  # slots that the cluster in <islot> could merge with (i.e. that're active, and wouldn't make a merged cluster that's too big)
+            tmask = active.copy()
+            tmask[islot] = False
+            if not merge_whatever_you_got:
+                tmask &= sizes + sizes[islot] <= max_per_cluster
+            return tmask
+
+        # ----------------------------------------------------------------------------------------
+        def update_nn(islot):
+            cslots = numpy.flatnonzero(allowed(islot))
+            if len(cslots) == 0:
+                nn_slots[islot], nn_dists[islot] = -1, numpy.inf
+                return
+            cdists = distances[islot, cslots]
+            closest = cslots[cdists == cdists.min()]
+            nn_slots[islot] = closest[numpy.argmin(slot_ids[closest])]
+            nn_dists[islot] = distances[islot, nn_slots[islot]]
 
         # ----------------------------------------------------------------------------------------
-        def get_clusters_to_merge():
-            smallest_min_distance, clusters_to_merge = None, None
-            n_skipped = 0
-            for clust_a, clust_b in itertools.combinations(clusters, 2):  # find the two clusters which contain the pair of sequences which are closest in hamming fraction (skipping cluster pairs that would make a cluster that's too big)
-                if len(clust_a) + len(clust_b) > max_per_cluster and not glomerate.merge_whatever_you_got:  # merged cluster would be too big, so look for smaller (albeit further-apart) things to merge
-                    n_skipped += 1
-                    continue
-                min_distance = None  # find the smallest hamming distance between any two sequences in the two clusters
-                for query_a in clust_a:
-                    for query_b in clust_b:
-                        joint_key = query_a + ';' + query_b  #';'.join([query_a, query_b])
-                        if joint_key not in distances:
-                            distances[joint_key] = utils.hamming_fraction(naive_seqs[query_a], naive_seqs[query_b])
-                            distances[query_b + ';' + query_a] = distances[joint_key]  # also add with key in reverse order, in case we run into the pair that way later on
-                        if min_distance is None or distances[joint_key] < min_distance:
-                            min_distance = distances[joint_key]
-                if smallest_min_distance is None or min_distance < smallest_min_distance:
-                    smallest_min_distance = min_distance
-                    clusters_to_merge = (clust_a, clust_b)
-
-            if debug and n_skipped > 0:
-                print('      skipped: %d ' % n_skipped)
-
-            return clusters_to_merge
+        def get_slots_to_merge():  # closest pair over all the nearest neighbors, with ties going to the pair whose (lower id, higher id) is smallest
+            islots = numpy.flatnonzero(active & (nn_slots >= 0))
+            if len(islots) == 0:
+                return None
+            islots = islots[nn_dists[islots] == nn_dists[islots].min()]
+            lo_ids, hi_ids = [tfcn(slot_ids[islots], slot_ids[nn_slots[islots]]) for tfcn in (numpy.minimum, numpy.maximum)]
+            ibest = numpy.lexsort((hi_ids, lo_ids))[0]
+            return sorted([islots[ibest], nn_slots[islots[ibest]]], key=lambda s: slot_ids[s])
 
         # ----------------------------------------------------------------------------------------
         def glomerate():
             if debug:
-                print('    current ', ' '.join([str(len(cl)) for cl in clusters]))
-            clusters_to_merge = get_clusters_to_merge()
-            if clusters_to_merge is None:  # if we didn't find a suitable pair
+                print('    current ', ' '.join([str(len(slot_clusters[s])) for s in sorted(numpy.flatnonzero(active), key=lambda s: slot_ids[s])]))
+            slots_to_merge = get_slots_to_merge()
+            if slots_to_merge is None:  # if we didn't find a suitable pair
                 if debug:
                     print('    didn\'t find shiznitz')
-                glomerate.merge_whatever_you_got = True  # next time through, merge whatever's best regardless of size
-            else:
-                if debug:
-                    print('    merging', len(clusters_to_merge[0]), len(clusters_to_merge[1]))
-                clusters.append(clusters_to_merge[0] + clusters_to_merge[1])
-                clusters.remove(clusters_to_merge[0])
-                clusters.remove(clusters_to_merge[1])
+                return False
+            sa, sb = slots_to_merge
+            if debug:
+                print('    merging', len(slot_clusters[sa]), len(slot_clusters[sb]))
+            slot_clusters[sa] = slot_clusters[sa] + slot_clusters[sb]
+            slot_clusters[sb] = None
+            slot_ids[sa] = slot_ids.max() + 1
+            sizes[sa] += sizes[sb]
+            active[sb] = False
+            distances[sa, :] = numpy.minimum(distances[sa, :], distances[sb, :])
+            distances[:, sa] = distances[sa, :]
+            update_nn(sa)
+            for islot in numpy.flatnonzero(active & ((nn_slots == sa) | (nn_slots == sb))):  # nearest neighbor was one of the merged clusters, so have to recalculate
+                update_nn(islot)
+            closer = allowed(sa) & (distances[:, sa] < nn_dists)  # the merged cluster has the highest id, so it only replaces nearest neighbors that are strictly further away
+            nn_slots[closer], nn_dists[closer] = sa, distances[closer, sa]
+            return True
 
         # ----------------------------------------------------------------------------------------
         def homogenize():
@@ -93,11 +112,16 @@ class Glomerator(object):
 
         # ----------------------------------------------------------------------------------------
         # da bizniz
-        glomerate.merge_whatever_you_got = False  # merge the best pair, even if together they'll be to big
-
-        while len(clusters) > n_clusters:
-            glomerate()
-        
+        merge_whatever_you_got = False  # merge the best pair, even if together they'll be to big
+        for islot in range(n_seqs):
+            update_nn(islot)
+        while active.sum() > n_clusters:
+            if not glomerate():
+                merge_whatever_you_got = True  # next time through, merge whatever's best regardless of size
+                for islot in numpy.flatnonzero(active):
+                    update_nn(islot)
+
+        clusters = [slot_clusters[s] for s in sorted(numpy.flatnonzero(active), key=lambda s: slot_ids[s])]
         if len(clusters) > 1:  # homogenize if partition is non-trivial
             clusters.sort(key=len)
 
@@ -6,7 +6,6 @@ import re
 import math
 import collections
 from scipy.stats import norm
-import csv
 import time
 import copy
 import numpy
@@ -20,7 +19,6 @@ except ImportError:
 from . import utils
 from . import glutils
 from . import paramutils
-from .hist import Hist
 
 # ----------------------------------------------------------------------------------------
 def get_bin_list(values, bin_type):
@@ -227,13 +225,14 @@ class HMM(object):
 
 # ----------------------------------------------------------------------------------------
 class HmmWriter(object):
-    def __init__(self, base_indir, outdir, gene_name, glfo, args, debug=False):
+    def __init__(self, base_indir, outdir, gene_name, glfo, args, ptables=None, debug=False):  # <ptables>: paramutils.ParameterTables for <base_indir> (pass it in if you're writing lots of genes, so we only read each file once)
         # debug = gene_name in ['IGHD3-10*01', 'IGHJ2*01']  # True
         self.region = utils.get_region(gene_name)
         self.raw_name = gene_name  # i.e. unsanitized
         self.germline_seqs = glfo['seqs']  # all germline alleles
         self.germline_seq = self.germline_seqs[self.region][gene_name]  # germline sequence for this hmm
         self.indir = base_indir
+        self.ptables = ptables if ptables is not None else paramutils.get_parameter_tables(self.indir)
         self.args = args
         self.debug = debug
         self.codon_positions = {r : glfo[c + '-positions'] for r, c in utils.conserved_codons[args.locus].items()}
@@ -271,7 +270,7 @@ class HmmWriter(object):
             print('  reading info from %s' % self.indir)
 
         approved_genes = [gene_name]
-        self.n_occurences = utils.read_single_gene_count(self.indir, gene_name, debug=self.debug)  # how many times did we observe this gene in data?
+        self.n_occurences = utils.read_single_gene_count(self.indir, gene_name, ptables=self.ptables, debug=self.debug)  # how many times did we observe this gene in data?
         # turned off for now (switched to an approach that relies more on smooth priors rather than averaging over many genes)
         # if self.n_occurences < self.args.min_observations_per_gene:  # if we didn't see it enough, average also over all the genes that find_replacement_genes() gives us
         #     if self.debug:
@@ -280,16 +279,16 @@ class HmmWriter(object):
 
         self.erosion_probs = self.read_erosion_info(approved_genes)
         self.insertion_probs, self.insertion_content_probs = self.read_insertion_info(approved_genes)
-        self.mute_freqs = paramutils.read_mute_freqs_with_weights(self.indir, approved_genes, debug=self.debug)  # weighted averages over genes
-        self.mute_counts = paramutils.read_mute_counts(self.indir, gene_name, self.args.locus, debug=self.debug)  # raw per-{ACGT} counts NOTE do *not* set <approved_genes> here (see note in paramutils)
+        self.mute_freqs = paramutils.read_mute_freqs_with_weights(self.indir, approved_genes, ptables=self.ptables, debug=self.debug)  # weighted averages over genes
+        self.mute_counts = paramutils.read_mute_counts(self.indir, gene_name, self.args.locus, ptables=self.ptables, debug=self.debug)  # raw per-{ACGT} counts NOTE do *not* set <approved_genes> here (see note in paramutils)
         self.process_mutation_info()  # smooth/interpolation/whatnot for <self.mute_freqs> and <self.mute_counts>
         # NOTE i'm using a hybrid approach with mute_freqs and mute_counts -- the only thing I get from mute_counts is the ratios of the different bases, whereas the actual freq comes from mute_freqs (which has all the corrections/smooth/bullshit)
 
         self.track = Track('nukes', utils.nukes)
         self.saniname = utils.sanitize_name(gene_name)
         self.hmm = HMM(self.saniname, self.track.getdict())  # pass the track as a dict rather than a Track object to keep the yaml file a bit more readable
-        self.hmm.extras['gene_prob'] = max(self.eps, utils.read_overall_gene_probs(self.indir, only_gene=gene_name))  # if we really didn't see this gene at all, take pity on it and kick it an eps
-        tmp_mean_freq_hist = Hist(fname=self.indir + '/all-mean-mute-freqs.csv')
+        self.hmm.extras['gene_prob'] = max(self.eps, utils.read_overall_gene_probs(self.indir, only_gene=gene_name, ptables=self.ptables))  # if we really didn't see this gene at all, take pity on it and kick it an eps
+        tmp_mean_freq_hist = self.ptables.get_hist('all-mean-mute-freqs.csv')
         self.hmm.extras['overall_mute_freq'] = tmp_mean_freq_hist.get_mean()
         self.hmm.extras['per_gene_mute_freq'] = self.mute_freqs['unweighted_overall_mean']  # the other (weighted) one might be technically more accurate, depending on what you want, but it's probably not what anyone is expecting, so we write the unweighted one
 
@@ -423,29 +422,27 @@ class HmmWriter(object):
                 eprobs[erosion][0] = 1.  # always erode zero bases
                 continue
             deps = utils.column_dependencies[erosion + '_del']
-            dfn = self.indir + '/' + utils.get_parameter_fname(column=erosion + '_del', deps=deps)
-            with open(dfn, 'r') as infile:
-                reader = csv.DictReader(infile)
-                n_lines_read = 0
-                for line in reader:
-                    # first see if we want to use this line (if <region>_gene isn't in the line, this erosion doesn't depend on gene version)
-                    if self.region + '_gene' in line and line[self.region + '_gene'] not in approved_genes:  # NOTE you'll need to change this if you want it to depend on another region's genes
-                        continue
-                    n_eroded = int(line[erosion + '_del'])
-                    # then skip nonsense erosions that're too long for this gene, but were ok for another
-                    if n_eroded >= len(self.germline_seq):
-                        continue
-
-                    # then add in this erosion's counts
-                    if n_eroded not in eprobs[erosion]:
-                        eprobs[erosion][n_eroded] = 0.0
-                    eprobs[erosion][n_eroded] += float(line['count'])
-
-                    if self.region + '_gene' in line:
-                        genes_used.add(line[self.region + '_gene'])
-                    n_lines_read += 1
+            dfn = utils.get_parameter_fname(column=erosion + '_del', deps=deps)
+            n_lines_read = 0
+            for line in self.ptables.get_rows(dfn):
+                # first see if we want to use this line (if <region>_gene isn't in the line, this erosion doesn't depend on gene version)
+                if self.region + '_gene' in line and line[self.region + '_gene'] not in approved_genes:  # NOTE you'll need to change this if you want it to depend on another region's genes
+                    continue
+                n_eroded = int(line[erosion + '_del'])
+                # then skip nonsense erosions that're too long for this gene, but were ok for another
+                if n_eroded >= len(self.germline_seq):
+                    continue
+
+                # then add in this erosion's counts
+                if n_eroded not in eprobs[erosion]:
+                    eprobs[erosion][n_eroded] = 0.0
+                eprobs[erosion][n_eroded] += float(line['count'])
+
+                if self.region + '_gene' in line:
+                    genes_used.add(line[self.region + '_gene'])
+                n_lines_read += 1
             if self.debug:
-                print('      read %d deletion lines from %s' % (n_lines_read, dfn))
+                print('      read %d deletion lines from %s' % (n_lines_read, self.indir + '/' + dfn))
 
             if len(eprobs[erosion]) == 0:
                 raise Exception('didn\'t read any %s erosion probs from %s' % (erosion, self.indir + '/' + utils.get_parameter_fname(column=erosion + '_del', deps=deps)))
@@ -504,22 +501,20 @@ class HmmWriter(object):
                 icontentprobs[insertion] = {n : 0.25 for n in utils.nukes}
                 continue
             deps = utils.column_dependencies[insertion + '_insertion']
-            with open(self.indir + '/' + utils.get_parameter_fname(column=insertion + '_insertion', deps=deps), 'r') as infile:
-                reader = csv.DictReader(infile)
-                for line in reader:
-                    # first see if we want to use this line (if <region>_gene isn't in the line, this erosion doesn't depend on gene version)
-                    if self.region + '_gene' in line and line[self.region + '_gene'] not in approved_genes:  # NOTE you'll need to change this if you want it to depend on another region's genes
-                        continue
-
-                    # then add in this insertion's counts
-                    n_inserted = 0
-                    n_inserted = int(line[insertion + '_insertion'])
-                    if n_inserted not in iprobs[insertion]:
-                        iprobs[insertion][n_inserted] = 0.0
-                    iprobs[insertion][n_inserted] += float(line['count'])
-
-                    if self.region + '_gene' in line:
-                        genes_used.add(line[self.region + '_gene'])
+            for line in self.ptables.get_rows(utils.get_parameter_fname(column=insertion + '_insertion', deps=deps)):
+                # first see if we want to use this line (if <region>_gene isn't in the line, this erosion doesn't depend on gene version)
+                if self.region + '_gene' in line and line[self.region + '_gene'] not in approved_genes:  # NOTE you'll need to change this if you want it to depend on another region's genes
+                    continue
+
+                # then add in this insertion's counts
+                n_inserted = 0
+                n_inserted = int(line[insertion + '_insertion'])
+                if n_inserted not in iprobs[insertion]:
+                    iprobs[insertion][n_inserted] = 0.0
+                iprobs[insertion][n_inserted] += float(line['count'])
+
+                if self.region + '_gene' in line:
+                    genes_used.add(line[self.region + '_gene'])
 
             if len(iprobs[insertion]) == 0:
                 raise Exception('didn\'t read any %s insertion probs from %s' % (insertion, self.indir + '/' + utils.get_parameter_fname(column=insertion + '_insertion', deps=deps)))
@@ -572,23 +567,21 @@ class HmmWriter(object):
     def read_insertion_content(self, insertion):
         icontentprobs = {}  # NOTE this is only the probs for <insertion>, even though name is the same as in the previous function
         if insertion in utils.boundaries:  # i.e. if it's a real insertion
-            with open(self.indir + '/' + insertion + '_insertion_content.csv', 'r') as icfile:
-                reader = csv.DictReader(icfile)
-                total = 0
-                for line in reader:
-                    icontentprobs[line[insertion + '_insertion_content']] = int(line['count'])
-                    total += int(line['count'])
-
-                if total == 0. and self.debug:
-                    print('\n    WARNING zero insertion content probs read from %s, so setting to uniform distribution' % self.indir + '/' + insertion + '_insertion_content.csv')
-                for nuke in utils.nukes:
-                    if total == 0.:
-                        icontentprobs[nuke] = 1. / len(utils.nukes)
-                    else:
-                        if nuke not in icontentprobs:
-                            print('    %s not in insertion content probs, adding with zero' % nuke)
-                            icontentprobs[nuke] = 0
-                        icontentprobs[nuke] /= float(total)
+            total = 0
+            for line in self.ptables.get_rows(insertion + '_insertion_content.csv'):
+                icontentprobs[line[insertion + '_insertion_content']] = int(line['count'])
+                total += int(line['count'])
+
+            if total == 0. and self.debug:
+                print('\n    WARNING zero insertion content probs read from %s, so setting to uniform distribution' % self.indir + '/' + insertion + '_insertion_content.csv')
+            for nuke in utils.nukes:
+                if total == 0.:
+                    icontentprobs[nuke] = 1. / len(utils.nukes)
+                else:
+                    if nuke not in icontentprobs:
+                        print('    %s not in insertion content probs, adding with zero' % nuke)
+                        icontentprobs[nuke] = 0
+                    icontentprobs[nuke] /= float(total)
         else:  # just return uniform probs for effective (fv and jf) insertions
             icontentprobs = {n : 0.25 for n in utils.nukes}
 
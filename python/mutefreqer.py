@@ -4,6 +4,7 @@ import sys
 import multiprocessing
 import csv
 import os
+import numpy
 
 from .hist import Hist
 from . import utils
@@ -21,7 +22,10 @@ class MuteFreqer(object):
         self.calculate_uncertainty = calculate_uncertainty
         self.args = args
 
-        self.counts, self.freqs = {}, {}  # per-gene, per-position counts/rates
+        self.counts, self.gl_nukes, self.freqs = {}, {}, {}  # per-gene counts (array of shape [gl position][nuke index]), germline base at each position (uint8 array, 0 if never observed), and per-position rates
+        self.nuke_indices = numpy.full(256, -1, dtype=numpy.int64)  # map from (ascii) char to index in utils.nukes (-1 if it isn't one)
+        for inuke, nuke in enumerate(utils.nukes):
+            self.nuke_indices[ord(nuke)] = inuke
         tkeys = ['all', 'cdr3'] + utils.regions
         self.n_bins, self.xmin, self.xmax = 40, 0., 0.4  # NOTE this bin width is wider than one mutation (at least for v and all), e.g. the zero N mutations get smeared out together with 1 and 2 etc, which can cause issues for super naive samples (i.e., if you really care about the distribution, you need to use the mean_n_muted hists)
         self.mean_rates = {n : Hist(self.n_bins, self.xmin, self.xmax, xtitle='mut freq', ytitle='freq', title='full seq' if n == 'all' else n.upper())
@@ -43,7 +47,16 @@ class MuteFreqer(object):
         self.subplotdirs = ['overall', ] + ['per-gene/' + r for r in utils.regions] + ['per-gene-per-position/' + r for r in utils.regions]  # + ['per-gene-per-position-per-base/' + r for r in utils.regions]
 
     # ----------------------------------------------------------------------------------------
-    def increment(self, info, iseq):
+    def increment(self, info, iseqs=None):  # increment for each sequence in <iseqs> (default all of them)
+        if iseqs is None:
+            iseqs = list(range(len(info['seqs'])))
+        for iseq in iseqs:
+            self.increment_mean_rates(info, iseq)
+        for region in utils.regions:
+            self.increment_per_position(info, region, iseqs)
+
+    # ----------------------------------------------------------------------------------------
+    def increment_mean_rates(self, info, iseq):
         freq, n_muted = utils.get_mutation_rate_and_n_muted(info, iseq)
         self.mean_rates['all'].fill(freq)  # mean freq over whole sequence (excluding insertions)
         self.mean_n_muted['all'].fill(n_muted)
@@ -64,33 +77,51 @@ class MuteFreqer(object):
             self.mean_rates[region].fill(regional_freq)  # per-region mean freq
             self.mean_n_muted[region].fill(regional_n_muted)
 
-            # then do per-gene and per-gene-per-position freqs
+            # then per-gene freqs
             gene = info[region + '_gene']
-            if gene not in self.counts:
-                self.counts[gene] = {}
+            if gene not in self.per_gene_mean_rates:
                 self.per_gene_mean_rates[gene] = Hist(self.n_bins, self.xmin, self.xmax, xtitle='mut freq', ytitle='freq', title=gene)
             self.per_gene_mean_rates[gene].fill(regional_freq)
 
-            gcts = self.counts[gene]  # shorthand name
-
-            germline_seq = info[region + '_gl_seq']
-            query_seq = info[region + '_qr_seqs'][iseq]
-            assert len(germline_seq) == len(query_seq)
-
-            istart = self.exclusions[region][0]
-            istop = len(germline_seq) - self.exclusions[region][1]
-            for ipos in range(istart, istop):  # NOTE this is similar to the stuff in allelefinder, except in allelefinder we need every single sequence to be the same length (so they go in the correct [comparable?] bin), whereas here we do not
-                igl = ipos + int(info[region + '_5p_del'])  # account for left-side deletions in the indexing
-
-                if germline_seq[ipos] == utils.ambig_base or query_seq[ipos] == utils.ambig_base:  # skip if either germline or query sequence is ambiguous at this position
-                    continue
-
-                if igl not in gcts:  # if we have not yet observed this position in a query sequence, initialize it
-                    gcts[igl] = {n : 0 for n in utils.nukes + ['total', ]}
-                    gcts[igl]['gl_nuke'] = germline_seq[ipos]
+    # ----------------------------------------------------------------------------------------
+    def increment_per_position(self, info, region, iseqs):  # per-gene-per-position counts for all of <iseqs> at once
+        gene = info[region + '_gene']
+        if gene not in self.counts:
+            self.counts[gene] = numpy.zeros((0, len(utils.nukes)), dtype=numpy.int64)
+            self.gl_nukes[gene] = numpy.zeros(0, dtype=numpy.uint8)
+        germline_seq = info[region + '_gl_seq']
+        query_seqs = [info[region + '_qr_seqs'][iseq] for iseq in iseqs]
+        assert all(len(germline_seq) == len(q) for q in query_seqs)
+
+        istart = self.exclusions[region][0]
+        istop = len(germline_seq) - self.exclusions[region][1]
+        if istop <= istart or len(query_seqs) == 0:
+            return
+        # NOTE this is similar to the stuff in allelefinder, except in allelefinder we need every single sequence to be the same length (so they go in the correct [comparable?] bin), whereas here we do not
+        gl_arr = numpy.frombuffer(germline_seq[istart : istop].encode(), dtype=numpy.uint8)
+        qr_arr = numpy.frombuffer(''.join(q[istart : istop] for q in query_seqs).encode(), dtype=numpy.uint8).reshape(len(query_seqs), len(gl_arr))
+        ambig = ord(utils.ambig_base)
+        use = (qr_arr != ambig) & (gl_arr != ambig)[None, :]  # skip if either germline or query sequence is ambiguous at a position
+        inukes = self.nuke_indices[qr_arr]
+        if (use & (inukes < 0)).any():
+            bad_chars = set(chr(c) for c in qr_arr[use & (inukes < 0)])
+            raise Exception('unexpected char[s] %s in %s qr seq[s] for %s (expected only %s)' % (' '.join(sorted(bad_chars)), region, ' '.join(info['unique_ids'][i] for i in iseqs), ' '.join(utils.nukes + [utils.ambig_base])))
+
+        igl_start = istart + int(info[region + '_5p_del'])  # account for left-side deletions in the indexing
+        igl_stop = igl_start + len(gl_arr)
+        if igl_stop > len(self.gl_nukes[gene]):  # extend arrays to cover this gl position
+            n_extra = igl_stop - len(self.gl_nukes[gene])
+            self.counts[gene] = numpy.concatenate([self.counts[gene], numpy.zeros((n_extra, len(utils.nukes)), dtype=numpy.int64)])
+            self.gl_nukes[gene] = numpy.concatenate([self.gl_nukes[gene], numpy.zeros(n_extra, dtype=numpy.uint8)])
+        _, iposs = numpy.nonzero(use)
+        self.counts[gene][igl_start : igl_stop] += numpy.bincount(iposs * len(utils.nukes) + inukes[use], minlength=len(gl_arr) * len(utils.nukes)).reshape(len(gl_arr), len(utils.nukes))
+        gl_slice = self.gl_nukes[gene][igl_start : igl_stop]  # (view)
+        new_obs = (gl_slice == 0) & use.any(axis=0)  # record germline base the first time we observe each position
+        gl_slice[new_obs] = gl_arr[new_obs]
 
-                gcts[igl]['total'] += 1
-                gcts[igl][query_seq[ipos]] += 1  # note that if <query_seq[ipos]> isn't among <utils.nukes>, this will toss a key error
+    # ----------------------------------------------------------------------------------------
+    def observed_positions(self, gene):  # positions at which we've observed at least one (non-ambiguous) query base
+        return [int(p) for p in numpy.flatnonzero(self.counts[gene].sum(axis=1) > 0)]
 
     # ----------------------------------------------------------------------------------------
     def get_uncertainty(self, obs, total):
@@ -113,17 +144,18 @@ class MuteFreqer(object):
         assert not self.finalized
 
         for gene in self.counts:
-            freqs = {position : {} for position in self.counts[gene]}
-            for position in sorted(self.counts[gene].keys()):
-                n_conserved, n_mutated = 0, 0
-                for nuke in utils.nukes:
-                    ncount, total = self.counts[gene][position][nuke], self.counts[gene][position]['total']
+            totals = self.counts[gene].sum(axis=1)
+            freqs = {}
+            for position in self.observed_positions(gene):
+                freqs[position] = {}
+                gl_nuke, total = chr(self.gl_nukes[gene][position]), int(totals[position])
+                n_mutated = 0
+                for inuke, nuke in enumerate(utils.nukes):
+                    ncount = int(self.counts[gene][position][inuke])
                     nuke_freq = float(ncount) / total
                     freqs[position][nuke] = nuke_freq
                     freqs[position][nuke + '_lo_err'], freqs[position][nuke + '_hi_err'] = self.get_uncertainty(ncount, total)
-                    if nuke == self.counts[gene][position]['gl_nuke']:
-                        n_conserved += ncount
-                    else:
+                    if nuke != gl_nuke:
                         n_mutated += ncount  # sum over A,C,G,T
                 freqs[position]['freq'] = float(n_mutated) / total
                 freqs[position]['freq_lo_err'], freqs[position]['freq_hi_err'] = self.get_uncertainty(n_mutated, total)
@@ -213,14 +245,14 @@ class MuteFreqer(object):
             nuke_header = [n + xtra for n in utils.nukes for xtra in ('', '_obs', '_lo_err', '_hi_err')]
             writer = csv.DictWriter(outfile, ('position', 'mute_freq', 'lo_err', 'hi_err') + tuple(nuke_header))
             writer.writeheader()
-            for position in sorted(gcounts.keys()):
+            for position in self.observed_positions(gene):
                 row = {'position':position,
                        'mute_freq':freqs[position]['freq'],
                        'lo_err':freqs[position]['freq_lo_err'],
                        'hi_err':freqs[position]['freq_hi_err']}
-                for nuke in utils.nukes:
+                for inuke, nuke in enumerate(utils.nukes):
                     row[nuke] = freqs[position][nuke]
-                    row[nuke + '_obs'] = gcounts[position][nuke]
+                    row[nuke + '_obs'] = int(gcounts[position][inuke])
                     row[nuke + '_lo_err'] = freqs[position][nuke + '_lo_err']
                     row[nuke + '_hi_err'] = freqs[position][nuke + '_hi_err']
                 writer.writerow(row)
@@ -218,6 +218,18 @@ def concat_heavy_chain(lpairs, lp_infos, dont_deep_copy=False):  # yeah yeah thi
                     joint_cpaths[ltmp] = dfn(glpf(lpair, 'cpaths', ltmp))
     return glfos, antn_lists, joint_cpaths
 
+# ----------------------------------------------------------------------------------------
+# inverted index {uid : [(locus, iclust, iseq), ...]} over all loci in <clust_lists> (dict keyed by locus of lists of either clusters or annotations), so we can go from a paired uid to its cluster/annotation without scanning every cluster in the other locus
+def get_uid_index(clust_lists):
+    uid_index = {}
+    for ltmp, clist in clust_lists.items():
+        for iclust, clust in enumerate(clist):
+            for iseq, uid in enumerate(clust['unique_ids'] if isinstance(clust, dict) else clust):
+                if uid not in uid_index:
+                    uid_index[uid] = []
+                uid_index[uid].append((ltmp, iclust, iseq))  # almost always length one, but there can be duplicates (e.g. from seed unique id)
+    return uid_index
+
 # ----------------------------------------------------------------------------------------
 # somewhat similar to get_antn_pairs() and find_cluster_pairs() below, but operates on single sequences
 def find_seq_pairs(antn_lists, ig_or_tr='ig'):
@@ -229,10 +241,11 @@ def find_seq_pairs(antn_lists, ig_or_tr='ig'):
                 ofo = {'%s_id'%tstr : tid, '%s_locus'%tstr : ltmp, '%s_seq'%tstr : iseq, '%s_id'%ostr : '', '%s_locus'%ostr : '', '%s_seq'%ostr : ''}
                 ofo['l_antn'] = None
             elif len(pids) == 1 and tstr == 'h':  # write h/l pairs when <ltmp> is the h locus
-                if pids[0] in all_seqs:
-                    lfo = all_seqs[pids[0]]
-                    ofo = {'h_id' : tid, 'h_locus' : ltmp, 'h_seq' : iseq, 'l_id' : pids[0], 'l_locus' : lfo['locus'], 'l_seq' : lfo['seq']}
-                    ofo['l_antn'] = all_antns[ofo['l_id']]
+                if pids[0] in uid_index:
+                    l_locus, l_iclust, l_iseq = uid_index[pids[0]][-1]
+                    l_antn = antn_lists[l_locus][l_iclust]
+                    ofo = {'h_id' : tid, 'h_locus' : ltmp, 'h_seq' : iseq, 'l_id' : pids[0], 'l_locus' : l_locus, 'l_seq' : l_antn['input_seqs'][l_iseq]}
+                    ofo['l_antn'] = l_antn
                 else:
                     print('  missing %s' % pids[0])
                     continue
@@ -241,8 +254,7 @@ def find_seq_pairs(antn_lists, ig_or_tr='ig'):
             ofo['h_antn'] = antn
             outfos.append(ofo)
     # ----------------------------------------------------------------------------------------
-    all_seqs = {u : {'seq' : s, 'locus' : l} for l, alist in antn_lists.items() for a in alist for u, s in zip(a['unique_ids'], a['input_seqs'])}
-    all_antns = {u : l for llist in antn_lists.values() for l in llist for u in l['unique_ids']}
+    uid_index = get_uid_index(antn_lists)
     outfos = []
     for ltmp in sorted(antn_lists):
         for antn in antn_lists[ltmp]:
@@ -310,7 +322,8 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
         print('          sizes')
         print('          h   l    l index')
     n_skipped = {k : 0 for k in required_keys + ['zero-len-paired-uids', 'too-small']}
-    unpaired_l_clusts = [c for c in l_part]
+    uid_index = get_uid_index({lpair[1] : l_part})  # only need to look up light clusters from heavy pids
+    unpaired_l_iclusts = set(range(len(l_part)))
     for h_clust in h_part:
         h_atn = h_atn_dict[':'.join(h_clust)]
         h_pids = getpids(h_atn)
@@ -323,7 +336,8 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
             n_skipped['zero-len-paired-uids'] += 1
             continue
 
-        l_clusts = [c for c in l_part if len(h_pids & set(c)) > 0]
+        l_iclusts = sorted(set(il for p in h_pids for _, il, _ in uid_index.get(p, [])))
+        l_clusts = [l_part[il] for il in l_iclusts]
         if len(l_clusts) != 1:
             if not quiet:
                 l_overlaps = [h_pids & set(c) for c in l_clusts]
@@ -335,7 +349,7 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
         assert len(l_clusts) == 1
         if ':'.join(l_clusts[0]) not in l_atn_dict:
             print('      %s missing annotation for light chain (size %d, paired with size %d) when finding cluster pairs%s%s' % (utils.color('yellow', 'warning'), len(l_clusts[0]), len(h_clust), ' '+':'.join(l_clusts[0]) if len(l_clusts[0])<30 else '', ' '+':'.join(h_clust) if len(h_clust) < 30 else ''))
-            unpaired_l_clusts.remove(l_clusts[0])  # i guess i want to remove it from here? i guess we know who it's paired with, but there's no annotation so we can't do anything with it
+            unpaired_l_iclusts.remove(l_iclusts[0])  # i guess i want to remove it from here? i guess we know who it's paired with, but there's no annotation so we can't do anything with it
             continue
         l_atn = l_atn_dict[':'.join(l_clusts[0])]
         if min_cluster_size is not None and any(len(l['unique_ids']) < min_cluster_size for l in [h_atn, l_atn]):
@@ -344,11 +358,11 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
         h_atn['loci'] = [lpair[0] for _ in h_atn['unique_ids']]  # this kind of sucks, but it seems like the best option a.t.m. (see note in event.py)
         l_atn['loci'] = [lpair[1] for _ in l_atn['unique_ids']]
         lp_antn_pairs.append((h_atn, l_atn))
-        unpaired_l_clusts.remove(l_clusts[0])
+        unpaired_l_iclusts.remove(l_iclusts[0])
         if debug:
-            print('        %3d %3d   %3d' % (len(h_clust), len(l_clusts[0]), l_part.index(l_clusts[0])))
-    if len(unpaired_l_clusts) > 0:
-        print('    %s: %d unpaired light cluster%s after finding h/l cluster pairs' % ('+'.join(lpair), len(unpaired_l_clusts), utils.plural(len(unpaired_l_clusts))))
+            print('        %3d %3d   %3d' % (len(h_clust), len(l_clusts[0]), l_iclusts[0]))
+    if len(unpaired_l_iclusts) > 0:
+        print('    %s: %d unpaired light cluster%s after finding h/l cluster pairs' % ('+'.join(lpair), len(unpaired_l_iclusts), utils.plural(len(unpaired_l_iclusts))))
         # this is just too verbose atm (and hopefully not necessary?)
         # for lc in unpaired_l_clusts:
         #     if ':'.join(lc) not in l_atn_dict:
@@ -71,6 +71,7 @@ class ParameterCounter(object):
     # ----------------------------------------------------------------------------------------
     def increment(self, info):
         self.increment_per_family_params(info)
+        self.mfreqer.increment(info)  # does all the seqs at once
         for iseq in range(len(info['seqs'])):
             self.increment_per_sequence_params(info, iseq)
 
@@ -84,7 +85,6 @@ class ParameterCounter(object):
     def increment_per_sequence_params(self, info, iseq):
         """ increment parameters that differ for each sequence within the clonal family """
         self.mute_total += 1
-        self.mfreqer.increment(info, iseq)
         for nuke in utils.nukes:
             self.counts['seq_content'][nuke] += info['seqs'][iseq].count(nuke)
 
@@ -2,6 +2,8 @@ from __future__ import absolute_import, division, unicode_literals
 from __future__ import print_function
 import os
 import csv
+import glob
+import pickle
 import operator
 import sys
 
@@ -21,22 +23,187 @@ def simplify_state_name(state_name):
         return state_name
 
 # ----------------------------------------------------------------------------------------
-def read_mute_counts(indir, gene, locus, extra_genes=None, debug=False):  # NOTE I'm adding the <extra_genes> arg in a hackish way because i need this to not crash in one specific instance (running bin/test-germline-inference.py) where the file for <gene> doesn't exist, but I don't remember/understand how this fcn and the following function work well enough to do this more sensibly
+def file_signature(fname):  # None if it doesn't exist, so we notice if the file gets deleted or rewritten
+    if not os.path.exists(fname):
+        return None
+    fstat = os.stat(fname)
+    return (fstat.st_size, fstat.st_mtime)
+
+# ----------------------------------------------------------------------------------------
+snapshot_version = 1  # increment this if you change ParameterTables in a way that'd break (or silently change) pickled snapshots written by older code
+
+# ----------------------------------------------------------------------------------------
+class ParameterTables(object):  # rows from the csv files in a parameter dir, each of which is read at most once and then kept in memory, so e.g. each hmm writer doesn't re-read (and re-parse) the same files as all the other ones
+    # NOTE treat the rows as read-only (they're shared among all the callers, and, if read before forking, among all the subprocesses)
+    # NOTE files are re-read if their size or modification time changes, since we sometimes rewrite parameter dirs within the same process (e.g. sw, then hmm, parameters during parameter caching)
+    def __init__(self, indir):
+        self.snapshot_version = snapshot_version  # has to be an instance attribute so it gets pickled
+        self.indir = indir
+        self.tables = {'rows' : {}, 'hists' : {}}  # map from file name (relative to <indir>) to list of rows (dicts, as from csv.DictReader), or to Hist objects for files that we read into hists
+        self.signatures = {'rows' : {}, 'hists' : {}}  # file signature for each file in <self.tables> when we read it
+
+    # ----------------------------------------------------------------------------------------
+    def is_current(self, fname, ttype='rows'):
+        return fname in self.signatures[ttype] and self.signatures[ttype][fname] == file_signature(self.indir + '/' + fname)
+
+    # ----------------------------------------------------------------------------------------
+    def read_table(self, fname, ttype):
+        from .hist import Hist
+        self.signatures[ttype][fname] = file_signature(self.indir + '/' + fname)  # get signature *before* reading, so if it's modified while we're reading, we'll re-read next time
+        if ttype == 'rows':
+            with open(self.indir + '/' + fname, 'r') as pfile:
+                self.tables[ttype][fname] = list(csv.DictReader(pfile))
+        elif ttype == 'hists':
+            self.tables[ttype][fname] = Hist(fname=self.indir + '/' + fname)
+        else:
+            assert False
+
+    # ----------------------------------------------------------------------------------------
+    def get_rows(self, fname, allow_missing=False):  # <fname> is relative to <self.indir>
+        if not self.is_current(fname):
+            if allow_missing and not os.path.exists(self.indir + '/' + fname):
+                return None
+            self.read_table(fname, 'rows')
+        return self.tables['rows'][fname]
+
+    # ----------------------------------------------------------------------------------------
+    def get_hist(self, fname):
+        if not self.is_current(fname, ttype='hists'):
+            self.read_table(fname, 'hists')
+        return self.tables['hists'][fname]
+
+    # ----------------------------------------------------------------------------------------
+    def all_fnames(self):  # all csv files in the dir (relative to <self.indir>)
+        return sorted(os.path.relpath(fn, self.indir) for fn in glob.glob(self.indir + '/*.csv') + glob.glob(self.indir + '/mute-freqs/*.csv'))
+
+    # ----------------------------------------------------------------------------------------
+    def read_all(self):
+        for ttype in self.tables:  # forget about any files that've been removed since we read them
+            for fname in [fn for fn in self.signatures[ttype] if not os.path.exists(self.indir + '/' + fn)]:
+                del self.tables[ttype][fname]
+                del self.signatures[ttype][fname]
+        for fname in self.all_fnames():
+            self.get_rows(fname)
+        if os.path.exists(self.indir + '/all-mean-mute-freqs.csv'):
+            self.get_hist('all-mean-mute-freqs.csv')
+
+    # ----------------------------------------------------------------------------------------
+    def read_hmm_tables(self, genes):  # read everything that HmmWriter will need for <genes> (so you can do it once in the parent process before forking the writers)
+        fnames = [r + '_gene-probs.csv' for r in utils.regions]
+        fnames += [utils.get_parameter_fname(column=c, deps=utils.column_dependencies[c]) for c in [e + '_del' for e in utils.all_erosions] + [b + '_insertion' for b in utils.all_boundaries]]
+        fnames += [b + '_insertion_content.csv' for b in utils.boundaries]
+        fnames += ['mute-freqs/' + utils.sanitize_name(g) + '.csv' for g in genes]
+        for fname in fnames:
+            self.get_rows(fname, allow_missing=True)  # missing files will crash later on if anybody actually needs them
+        self.get_hist('all-mean-mute-freqs.csv')
+
+    # ----------------------------------------------------------------------------------------
+    def validate(self):  # check that the files that everybody needs are there, and that the ones we've read have the columns we expect
+        def check_columns(fname, columns):
+            rows = self.tables['rows'][fname]
+            missing_columns = [c for c in columns if len(rows) > 0 and c not in rows[0]]
+            if len(missing_columns) > 0:
+                raise Exception('parameter file %s missing column%s: %s' % (self.indir + '/' + fname, utils.plural(len(missing_columns)), ' '.join(missing_columns)))
+        for region in utils.regions:
+            if not os.path.exists(self.indir + '/' + region + '_gene-probs.csv'):
+                raise Exception('parameter dir %s missing %s gene probs file' % (self.indir, region))
+        for fname, rows in self.tables['rows'].items():
+            if fname.find('mute-freqs/') == 0:
+                check_columns(fname, ['position', 'mute_freq', 'lo_err', 'hi_err'] + [n + '_obs' for n in utils.nukes])
+            elif fname.endswith('-probs.csv'):
+                check_columns(fname, ['count'])
+                if any(int(line['count']) < 0 for line in rows):
+                    raise Exception('negative count in parameter file %s' % self.indir + '/' + fname)
+
+    # ----------------------------------------------------------------------------------------
+    def snapshot_is_current(self):  # have we read all the files in the dir, and are they all unchanged since we read them?
+        return all(self.is_current(fn, ttype=tt) for tt in self.signatures for fn in self.signatures[tt]) and set(self.all_fnames()) <= set(self.tables['rows'])
+
+    # ----------------------------------------------------------------------------------------
+    def write_snapshot(self, fname):
+        utils.prep_dir(None, fname=fname, allow_other_files=True)
+        tmpfname = '%s.%d' % (fname, os.getpid())  # write to a temporary file and then move it, so other procs that're reading/writing the same snapshot don't see a partial file
+        with open(tmpfname, 'wb') as pfile:
+            pickle.dump(self, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfname, fname)
+
+# ----------------------------------------------------------------------------------------
+parameter_tables = {}  # ParameterTables for each parameter dir that's been read by this process (keyed by absolute path)
+
+# ----------------------------------------------------------------------------------------
+def snapshot_fname(snapshot_dir, indir):
+    return '%s/parameter-tables-%s.pickle' % (snapshot_dir, utils.uidhashstr(os.path.abspath(indir)))
+
+# ----------------------------------------------------------------------------------------
+def read_snapshot(snapshot_dir, indir, debug=False):  # return ParameterTables for <indir> from the snapshot in <snapshot_dir>, or None if it's missing or out of date
+    sfname = snapshot_fname(snapshot_dir, indir)
+    if not os.path.exists(sfname):
+        return None
+    try:
+        with open(sfname, 'rb') as pfile:
+            ptables = pickle.load(pfile)
+    except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, OSError) as ex:  # corrupt or unreadable, or written by code with different classes
+        print('    %s couldn\'t read parameter snapshot %s (%s: %s), so re-reading %s' % (utils.color('yellow', 'note'), sfname, type(ex).__name__, ex, indir))
+        return None
+    if getattr(ptables, 'snapshot_version', None) != snapshot_version:
+        print('    %s parameter snapshot %s has version %s (current version %d), so re-reading %s' % (utils.color('yellow', 'note'), sfname, getattr(ptables, 'snapshot_version', None), snapshot_version, indir))
+        return None
+    ptables.indir = indir
+    if not ptables.snapshot_is_current():
+        if debug:
+            print('    parameter snapshot %s is out of date, so re-reading %s' % (sfname, indir))
+        return None
+    if debug:
+        print('    read parameter snapshot for %s from %s' % (indir, sfname))
+    return ptables
+
+# ----------------------------------------------------------------------------------------
+def get_parameter_tables(indir, read_all=False, snapshot_dir=None, debug=False):  # return the ParameterTables for <indir>, creating it if this is the first time anyone in this process has asked for it
+    # if <read_all> is set, read (and validate) the whole dir now, rather than reading each file when someone asks for it
+    # if <snapshot_dir> is set, we first look there for a pickled snapshot of the whole dir (e.g. from a previous run), and write one there if it's missing or out of date (i.e. <snapshot_dir> implies <read_all>)
+    key = os.path.abspath(indir)
+    if key not in parameter_tables and snapshot_dir is not None:
+        ptables = read_snapshot(snapshot_dir, indir, debug=debug)
+        if ptables is not None:
+            parameter_tables[key] = ptables
+    if key not in parameter_tables:
+        parameter_tables[key] = ParameterTables(indir)
+    ptables = parameter_tables[key]
+
+    if read_all or snapshot_dir is not None:
+        modified = False
+        if not ptables.snapshot_is_current():
+            ptables.read_all()
+            ptables.validate()
+            modified = True
+        if snapshot_dir is not None and (modified or not os.path.exists(snapshot_fname(snapshot_dir, indir))):
+            ptables.write_snapshot(snapshot_fname(snapshot_dir, indir))
+            if debug:
+                print('    wrote parameter snapshot for %s to %s' % (indir, snapshot_fname(snapshot_dir, indir)))
+    return ptables
+
+# ----------------------------------------------------------------------------------------
+def read_csv_rows(indir, fname, ptables=None, allow_missing=False):  # return the rows in csv file <indir>/<fname> (None if <allow_missing> and the file isn't there), using the (cached) ParameterTables for <indir> if <ptables> isn't set
+    if ptables is None:
+        ptables = get_parameter_tables(indir)
+    return ptables.get_rows(fname, allow_missing=allow_missing)
+
+# ----------------------------------------------------------------------------------------
+def read_mute_counts(indir, gene, locus, extra_genes=None, ptables=None, debug=False):  # NOTE I'm adding the <extra_genes> arg in a hackish way because i need this to not crash in one specific instance (running bin/test-germline-inference.py) where the file for <gene> doesn't exist, but I don't remember/understand how this fcn and the following function work well enough to do this more sensibly
     # NOTE also that this new hack that allows a different gene's counts to be used might break something later on if the genes have different lengths? I have no idea
     # ----------------------------------------------------------------------------------------
     def read_single_file(gtmp):
-        mfname = indir + '/mute-freqs/' + utils.sanitize_name(gtmp) + '.csv'
-        if not os.path.exists(mfname):
+        mfname = 'mute-freqs/' + utils.sanitize_name(gtmp) + '.csv'
+        rows = read_csv_rows(indir, mfname, ptables=ptables, allow_missing=True)
+        if rows is None:
             return None
         observed_counts = {}
-        with open(mfname, 'r') as mutefile:
-            reader = csv.DictReader(mutefile)
-            for line in reader:
-                pos = int(line['position'])
-                assert pos not in observed_counts
-                observed_counts[pos] = {n : int(line[n + '_obs']) for n in utils.nukes}
+        for line in rows:
+            pos = int(line['position'])
+            assert pos not in observed_counts
+            observed_counts[pos] = {n : int(line[n + '_obs']) for n in utils.nukes}
         if debug:
-            print('    read %d per-base mute counts from %s' % (len(observed_counts), mfname))
+            print('    read %d per-base mute counts from %s' % (len(observed_counts), indir + '/' + mfname))
         return observed_counts
 
     # ----------------------------------------------------------------------------------------
@@ -60,7 +227,7 @@ def read_mute_counts(indir, gene, locus, extra_genes=None, debug=False):  # NOTE
     return observed_counts  # raw per-{ACGT} counts for each position, summed over genes ("raw" as in not a weighted average over a bunch of genes as in read_mute_freqs_with_weights())
 
 # ----------------------------------------------------------------------------------------
-def read_mute_freqs_with_weights(indir, approved_genes, debug=False):  # it would be nice to eventually align the genes before combining
+def read_mute_freqs_with_weights(indir, approved_genes, ptables=None, debug=False):  # it would be nice to eventually align the genes before combining
     # returns:
     #  - mute_freqs: inverse error-weighted average mute freq over all genes for each position
     #     - also includes weighted and unweigthed means over positions
@@ -77,25 +244,23 @@ def read_mute_freqs_with_weights(indir, approved_genes, debug=False):  # it woul
     # add an observation for each position, for each gene where we observed that position NOTE this would be more sensible if they were aligned first
     observed_freqs = {}
     for gene in approved_genes:
-        mutefname = indir + '/mute-freqs/' + utils.sanitize_name(gene) + '.csv'
-        if not os.path.exists(mutefname):
+        rows = read_csv_rows(indir, 'mute-freqs/' + utils.sanitize_name(gene) + '.csv', ptables=ptables, allow_missing=True)
+        if rows is None:
             continue
-        with open(mutefname, 'r') as mutefile:
-            reader = csv.DictReader(mutefile)
-            for line in reader:
-                pos = int(line['position'])
-                freq = float(line['mute_freq'])
-                lo_err = float(line['lo_err'])  # NOTE lo_err in the file is really the lower *bound*
-                hi_err = float(line['hi_err'])  #   same deal
-                assert freq >= 0.0 and lo_err >= 0.0 and hi_err >= 0.0  # you just can't be too careful
-
-                if freq < utils.eps or abs(1.0 - freq) < utils.eps:  # if <freq> too close to 0 or 1, replace it with the midpoint of its uncertainty band
-                    freq = 0.5 * (lo_err + hi_err)
-
-                if pos not in observed_freqs:
-                    observed_freqs[pos] = []
-
-                observed_freqs[pos].append({'freq' : freq, 'err' : max(abs(freq-lo_err), abs(freq-hi_err))})  # append one for each gene
+        for line in rows:
+            pos = int(line['position'])
+            freq = float(line['mute_freq'])
+            lo_err = float(line['lo_err'])  # NOTE lo_err in the file is really the lower *bound*
+            hi_err = float(line['hi_err'])  #   same deal
+            assert freq >= 0.0 and lo_err >= 0.0 and hi_err >= 0.0  # you just can't be too careful
+
+            if freq < utils.eps or abs(1.0 - freq) < utils.eps:  # if <freq> too close to 0 or 1, replace it with the midpoint of its uncertainty band
+                freq = 0.5 * (lo_err + hi_err)
+
+            if pos not in observed_freqs:
+                observed_freqs[pos] = []
+
+            observed_freqs[pos].append({'freq' : freq, 'err' : max(abs(freq-lo_err), abs(freq-hi_err))})  # append one for each gene
 
     # set final mute_freqs[pos] to the (inverse error-weighted) average over all the observations [i.e. genes] for each position
     mute_freqs = {}
@@ -12,8 +12,9 @@ import csv
 from io import open
 csv.field_size_limit(sys.maxsize)  # make sure we can write very large csv fields
 import random
-from collections import OrderedDict
-from subprocess import check_call, CalledProcessError
+from collections import OrderedDict, Counter
+import heapq
+from subprocess import check_call
 import copy
 import multiprocessing
 import operator
@@ -51,8 +52,10 @@ class PartitionDriver(object):
 
         self.vs_info, self.sw_info, self.msa_vs_info = None, None, None
         self.duplicates = {}
+        self.input_duplicates = None  # exactly identical input seqs {first uid : [other uids]} (set in run_waterer()), so vsearch and sw only need to run on unique seqs
         self.bcrham_proc_info = None
         self.timing_info = []  # it would be really nice to clean up both this and bcrham_proc_info
+        self.step_cost_info = []  # measured cost info for each clustering step (see record_step_cost()), used to decide how many procs to use for the next step
         self.istep = None  # stupid hack to get around network file system issues (see self.subworkidr()
         self.subworkdirs = []  # arg. same stupid hack
 
@@ -64,7 +67,9 @@ class PartitionDriver(object):
         self.final_multi_paramdir = utils.non_none([self.args.parameter_out_dir, self.multi_hmm_param_dir])  # ick
 
         self.hmm_infname = self.args.workdir + '/hmm_input.csv'
-        self.hmm_cachefname = self.args.workdir + '/hmm_cached_info.csv'
+        self.hmm_cachefname = self.args.workdir + '/hmm_cached_info.csv'  # NOTE this is append-only during a run (bcrham only writes newly-calculated vals, which we then tack onto the end), so we can keep an index of it in memory and only read the new bits each step (see update_hmm_cache())
+        self.new_hmm_cachefname = self.args.workdir + '/hmm_cached_info-new.csv'  # where bcrham writes its newly-calculated cache vals when running with one proc (with more than one they go in each proc's subdir)
+        self.hmm_cache, self.hmm_cache_pos = None, None  # in-memory index of lines in self.hmm_cachefname {joined uid str : line}, and info about how far we've read it
         self.hmm_outfname = self.args.workdir + '/hmm_output.csv'
         self.cpath_progress_dir = '%s/cluster-path-progress' % self.args.workdir  # write the cluster paths for each clustering step to separate files in this dir
 
@@ -155,8 +160,9 @@ class PartitionDriver(object):
             self.merge_files(infnames=[self.args.persistent_cachefname, self.hmm_cachefname], outfname=self.args.persistent_cachefname, dereplicate=True)
             lockfile.close()
             os.remove(lockfname)
-        if os.path.exists(self.hmm_cachefname):
-            os.remove(self.hmm_cachefname)
+        for fn in [self.hmm_cachefname, self.new_hmm_cachefname]:
+            if os.path.exists(fn):
+                os.remove(fn)
 
         for subd in self.subworkdirs:
             if os.path.exists(subd):  # if there was only one proc for this step, it'll have already been removed
@@ -202,6 +208,8 @@ class PartitionDriver(object):
         sys.stdout.flush()
 
         self.vs_info = None  # should already be None, but we want to make sure (if --no-sw-vsearch is set we need it to be None, and if we just removed unlikely alleles we need to rerun vsearch with the likely alleles)
+        if self.args.collapse_duplicate_sequences:  # recalculate each time, since <self.input_info> can get replaced (and it's just hashing the seqs, so it's fast)
+            self.input_duplicates = seqfileopener.get_identical_input_uids(self.input_info)
         if not self.args.no_sw_vsearch:
             self.set_vsearch_info(get_annotations=True)
         if self.args.simultaneous_true_clonal_seqs:  # it might be better to just copy over the true indel info in this case? it depends what you're trying to test, and honestly really if you're using this option you just shouldn't be putting indels in your simulation to start with
@@ -216,7 +224,8 @@ class PartitionDriver(object):
                           count_parameters=count_parameters,
                           parameter_out_dir=self.sw_param_dir if write_parameters else None,
                           plot_annotation_performance=self.args.plot_annotation_performance,
-                          duplicates=self.duplicates, pre_failed_queries=pre_failed_queries, aligned_gl_seqs=self.aligned_gl_seqs, vs_info=self.vs_info, msa_vs_info=self.msa_vs_info)
+                          duplicates=self.duplicates, pre_failed_queries=pre_failed_queries, aligned_gl_seqs=self.aligned_gl_seqs, vs_info=self.vs_info, msa_vs_info=self.msa_vs_info,
+                          input_duplicates=self.input_duplicates)
 
         cache_path = self.sw_cache_path(find_any=require_cachefile)
         cachefname = cache_path + ('.yaml' if self.args.sw_cachefname is None else utils.getsuffix(self.args.sw_cachefname))  # use yaml, unless csv was explicitly set on the command line
@@ -258,8 +267,9 @@ class PartitionDriver(object):
 
     # ----------------------------------------------------------------------------------------
     def set_vsearch_info(self, get_annotations=False):  # NOTE setting match:mismatch to optimized values from sw (i.e. 5:-4) results in much worse shm indel performance, so we leave it at the vsearch defaults ('2:-4')
-        seqs = {sfo['unique_ids'][0] : sfo['seqs'][0] for sfo in self.input_info.values()}
-        self.vs_info = utils.run_vsearch('search', seqs, self.args.workdir + '/vsearch', threshold=0.3, glfo=self.glfo, print_time=True, vsearch_binary=self.args.vsearch_binary, get_annotations=get_annotations, no_indels=self.args.no_indels)
+        skip_uids = set() if self.input_duplicates is None else set(u for dupes in self.input_duplicates.values() for u in dupes)
+        seqs = {sfo['unique_ids'][0] : sfo['seqs'][0] for sfo in self.input_info.values() if sfo['unique_ids'][0] not in skip_uids}
+        self.vs_info = utils.run_vsearch('search', seqs, self.args.workdir + '/vsearch', threshold=0.3, glfo=self.glfo, print_time=True, vsearch_binary=self.args.vsearch_binary, get_annotations=get_annotations, no_indels=self.args.no_indels, duplicates=self.input_duplicates)
 
     # ----------------------------------------------------------------------------------------
     def set_msa_info(self, debug=False):  # NOTE not running this for args.simultaneous_true_clonal_seqs any more, but i'm leaving the stuff in here for that arg in case I change my mind later
@@ -603,10 +613,11 @@ class PartitionDriver(object):
                 if 'unique_ids' not in reader.fieldnames:
                     raise Exception('not an annotation file: %s' % outfname)
                 annotation_list = list(reader)
-        elif utils.getsuffix(outfname) == '.yaml':  # new way
+        elif utils.getsuffix(outfname) in ['.yaml', '.npz']:  # new way
             # NOTE replaces <self.glfo>, which is definitely what we want (that's the point of putting glfo in the yaml file), but it's still different behavior than if reading a csv
             assert self.glfo is None  # make sure bin/partis successfully figured out that we would be reading the glfo from the yaml output file
-            self.glfo, annotation_list, cpath = utils.read_yaml_output(outfname, n_max_queries=self.args.n_max_queries, dont_add_implicit_info=True, seed_unique_id=self.args.seed_unique_id)  # add implicit info below, so we can skip some of 'em
+            read_fcn = utils.read_yaml_output if utils.getsuffix(outfname) == '.yaml' else utils.read_npz_output
+            self.glfo, annotation_list, cpath = read_fcn(outfname, n_max_queries=self.args.n_max_queries, dont_add_implicit_info=True, seed_unique_id=self.args.seed_unique_id)  # add implicit info below, so we can skip some of 'em
         else:
             raise Exception('unhandled annotation file suffix %s' % outfname)
 
@@ -752,11 +763,13 @@ class PartitionDriver(object):
     # ----------------------------------------------------------------------------------------
     def prepare_next_iteration(self, cpath, initial_nseqs):
         last_n_procs = self.n_proc_list[-1]
-        next_n_procs = last_n_procs
 
         factor = 1.3
-        if self.shall_we_reduce_n_procs(last_n_procs):
-            next_n_procs = int(next_n_procs / float(factor))
+        next_n_procs = self.choose_n_procs(last_n_procs, len(cpath.bmx()), factor)
+        if next_n_procs is None:  # no usable bcrham timing info, so fall back to the hard-coded thresholds
+            next_n_procs = last_n_procs
+            if self.shall_we_reduce_n_procs(last_n_procs):
+                next_n_procs = int(next_n_procs / float(factor))
 
         def time_to_remove_some_seqs(n_proc_threshold):
             return len(self.n_proc_list) >= n_proc_threshold or next_n_procs == 1
@@ -774,6 +787,68 @@ class PartitionDriver(object):
 
         return next_n_procs, cpath
 
+    # ----------------------------------------------------------------------------------------
+    def record_step_cost(self, n_procs, n_clusters, n_clusters_after):  # record measured cost info for the clustering step we just ran (on <n_clusters> clusters with <n_procs> procs, leaving <n_clusters_after>)
+        cfo = {'n_procs' : n_procs, 'n_clusters' : n_clusters, 'n_clusters_after' : n_clusters_after, 'time' : self.timing_info[-1]['total'], 'calcd' : None}
+        if self.bcrham_proc_info is not None and all('calcd' in p and 'time' in p and None not in [p['calcd'].get('vtb'), p['calcd'].get('fwd'), p['time'].get('bcrham')] for p in self.bcrham_proc_info):  # if we lost some stdout, just don't use this step for the model
+            cfo['calcd'] = [p['calcd']['vtb'] + p['calcd']['fwd'] for p in self.bcrham_proc_info]
+            cfo['proc_times'] = [p['time']['bcrham'] for p in self.bcrham_proc_info]
+            cfo['cache_logprobs'] = max(p.get('read-cache', {}).get('logprobs') or 0 for p in self.bcrham_proc_info)  # all the procs read the same cache file, so these should all be the same
+        self.step_cost_info.append(cfo)
+
+    # ----------------------------------------------------------------------------------------
+    def fit_step_cost_model(self):  # fit a simple model to the measured step costs (see predict_step_cost())
+        steps = [c for c in self.step_cost_info if c['calcd'] is not None and sum(c['calcd']) > 0]
+        if len(steps) == 0:
+            return None
+        time_per_calc = sum(t for c in steps for t in c['proc_times']) / float(sum(n for c in steps for n in c['calcd']))
+        overhead = numpy.median([max(0., c['time'] - max(c['proc_times'])) for c in steps])  # time outside of bcrham (writing input, reading output, waiting for procs to start)
+        last = steps[-1]  # calc density and merge ratio change a lot (clusters get bigger, and merge less), so only use the most recent step
+        n_calcd, n_cached = float(sum(last['calcd'])), last['cache_logprobs']
+        n_needed = 0.5 * (n_calcd + math.sqrt(n_calcd**2 + 4 * n_calcd * n_cached))  # calcs the last step would've needed with an empty cache, i.e. solve n_calcd = n_needed * (1 - cache hit rate) with hit rate n_cached / (n_cached + n_needed)
+        return {
+            'overhead' : overhead,
+            'time_per_calc' : time_per_calc,
+            'calc_density' : n_needed * last['n_procs'] / float(last['n_clusters'])**2,  # calcs needed per pair of clusters in the same proc (before accounting for the cache)
+            'imbalance' : max(last['calcd']) / (n_calcd / len(last['calcd'])),  # step time is set by the slowest proc
+            'merge_frac' : max(0., 1. - last['n_clusters_after'] / float(last['n_clusters'])) * last['n_procs'],  # fraction of clusters that get merged away in a step, times n procs (since clusters can only merge with others in the same proc, this should go roughly as 1 / n procs)
+            'cache_logprobs' : n_cached + n_calcd,  # new logprobs get merged into the cache file after each step
+        }
+
+    # ----------------------------------------------------------------------------------------
+    def predict_step_cost(self, model, n_procs, n_clusters, n_cached):  # return predicted time and total number of calcs for a step with <n_procs> procs on <n_clusters> clusters, when there's <n_cached> logprobs in the cache
+        n_needed = model['calc_density'] * n_clusters**2 / n_procs  # summed over procs, each of which has (n_clusters / n_procs)^2 pairs
+        n_calcs = n_needed**2 / (n_cached + n_needed) if n_needed > 0 else 0.  # the cache covers a fraction n_cached / (n_cached + n_needed) of them
+        return model['overhead'] + model['time_per_calc'] * model['imbalance'] * n_calcs / n_procs, n_calcs
+
+    # ----------------------------------------------------------------------------------------
+    def predict_total_time(self, model, n_procs, n_clusters, factor):  # predicted time for the next step with <n_procs>, plus all the steps after it, assuming those reduce n procs by <factor> each time until we get to one proc
+        total_time, n_cached = 0., model['cache_logprobs']
+        while True:
+            step_time, n_calcs = self.predict_step_cost(model, n_procs, n_clusters, n_cached)
+            total_time += step_time
+            if n_procs == 1:
+                return total_time
+            n_cached += n_calcs
+            n_clusters = max(1., n_clusters * (1. - min(1., model['merge_frac'] / n_procs)))
+            n_procs = max(1, min(int(n_procs / float(factor)), int(n_clusters)))
+
+    # ----------------------------------------------------------------------------------------
+    def choose_n_procs(self, last_n_procs, n_clusters, factor):  # choose the number of procs for the next step that minimizes the predicted total time of the remaining steps (returns None if we don't have a model, i.e. no timing info from bcrham)
+        model = self.fit_step_cost_model()
+        if model is None:
+            return None
+        candidates = [n for n in range(1, min(self.args.n_procs, n_clusters) + 1) if self.n_proc_list.count(n) < max(4, n)]  # don't use any n procs more than a few times, so we're sure to finish even if the model is off (1 is always ok, since it's the last step)
+        total_times = {n : self.predict_total_time(model, n, n_clusters, factor) for n in candidates}
+        next_n_procs = min(candidates, key=lambda n: total_times[n])  # ties go to fewer procs
+        default_n_procs = max(1, int(last_n_procs / float(factor)))  # what we'd do if we just reduced by <factor>
+        if default_n_procs not in total_times:
+            total_times[default_n_procs] = self.predict_total_time(model, default_n_procs, n_clusters, factor)
+        print('        n procs %d --> %d: predicted time for remaining steps %.1fs (next step %.1fs), vs %.1fs with %d procs   fit: overhead %.1fs  %.2gs/calc  %.2g calcs/cluster pair  %.2f imbalance  %.2f merged fraction  %d cached logprobs'
+              % (last_n_procs, next_n_procs, total_times[next_n_procs], self.predict_step_cost(model, next_n_procs, n_clusters, model['cache_logprobs'])[0], total_times[default_n_procs], default_n_procs,
+                 model['overhead'], model['time_per_calc'], model['calc_density'], model['imbalance'], model['merge_frac'] / last_n_procs, model['cache_logprobs']))
+        return next_n_procs
+
     # ----------------------------------------------------------------------------------------
     def get_n_calculated_per_process(self):
         assert self.bcrham_proc_info is not None
@@ -799,36 +874,38 @@ class PartitionDriver(object):
             print('merging shared clusters')
             cpath.print_partitions()
 
-        # find every pair of clusters that has some overlap
-        cluster_groups = []
+        # use a disjoint set forest over cluster indices to find the groups of clusters that are connected by shared uids (single pass over uids, rather than comparing every pair of clusters)
+        parents = list(range(len(partition)))
+        def find_root(iclust):
+            while parents[iclust] != iclust:
+                parents[iclust] = parents[parents[iclust]]  # path halving
+                iclust = parents[iclust]
+            return iclust
+        first_clusters = {}  # index of first cluster in which we saw each uid
         if debug:
             print(' making cluster_groups')
-        for iclust in range(len(partition)):
-            for jclust in range(iclust + 1, len(partition)):
-                if len(set(partition[iclust]) & set(partition[jclust])) > 0:
-                    if debug:
-                        print('  %d %d' % (iclust, jclust))
-                    cluster_groups.append(set([iclust, jclust]))
-
-        # merge these pairs of clusters into groups
-        while True:
-            no_more_merges = True
-            for cp1, cp2 in itertools.combinations(cluster_groups, 2):
-                if len(cp1 & cp2) > 0:
+        for iclust, cluster in enumerate(partition):
+            for uid in cluster:
+                if uid not in first_clusters:
+                    first_clusters[uid] = iclust
+                    continue
+                iroot, jroot = find_root(first_clusters[uid]), find_root(iclust)
+                if iroot != jroot:
                     if debug:
-                        print('  merging %s and %s' % (cp1, cp2))
-                    cluster_groups.append(cp1 | cp2)
-                    cluster_groups.remove(cp1)
-                    cluster_groups.remove(cp2)
-                    no_more_merges = False
-                    break  # we've modified it now, so we have to go back and remake the iterator
-            if no_more_merges:
-                break
+                        print('  %d %d' % (first_clusters[uid], iclust))
+                    parents[max(iroot, jroot)] = min(iroot, jroot)
+        root_groups = OrderedDict()
+        for iclust in range(len(partition)):
+            root_groups.setdefault(find_root(iclust), []).append(iclust)
+        cluster_groups = [g for g in root_groups.values() if len(g) > 1]
+        if debug:
+            for cgroup in cluster_groups:
+                print('  merging %s' % ' '.join(str(i) for i in cgroup))
 
         # actually merge the groups of clusters
         new_clusters = []
         for cgroup in cluster_groups:
-            new_clusters.append(list(set([uid for iclust in cgroup for uid in partition[iclust]])))
+            new_clusters.append(list(OrderedDict.fromkeys(uid for iclust in cgroup for uid in partition[iclust])))  # remove duplicates, but keep the order
         if debug:
             print(' removing')
         for iclust in sorted([i for cgroup in cluster_groups for i in cgroup], reverse=True):
@@ -936,8 +1013,10 @@ class PartitionDriver(object):
                 print('  reducing n procs to number of clusters: %d --> %d' % (n_procs, len(cpath.bmx())))
                 n_procs = len(cpath.bmx())
             print('%s%d clusters with %d proc%s%s' % ('' if self.print_status else '  ', len(cpath.bmx()), n_procs, utils.plural(n_procs), '\n' if self.print_status else ''), end=' ')  # NOTE that a.t.m. i_best and i_best_minus_x are usually the same, since we're usually not calculating log probs of partitions (well, we're trying to avoid calculating any extra log probs, which means we usually don't know the log prob of the entire partition)
+            n_clusters_before = len(cpath.bmx())
             cpath, _, _ = self.run_hmm('forward', self.sub_param_dir, n_procs=n_procs, partition=cpath.bmx(), shuffle_input=True)  # note that this annihilates the old <cpath>, which is a memory optimization (but we write all of them to the cpath progress dir)
             self.n_proc_list.append(n_procs)
+            self.record_step_cost(n_procs, n_clusters_before, len(cpath.bmx()))
             if self.are_we_finished_clustering(n_procs, cpath):
                 break
             n_procs, cpath = self.prepare_next_iteration(cpath, initial_nseqs)
@@ -1090,19 +1169,20 @@ class PartitionDriver(object):
 
     # ----------------------------------------------------------------------------------------
     def get_cached_hmm_naive_seqs(self, queries=None):
-        # would be nice to merge this with self.read_hmm_cachefile()
         expected_queries = self.sw_info['queries'] if queries is None else queries
+        expected_query_set = set(expected_queries)
         cached_naive_seqs = {}
-        with open(self.hmm_cachefname) as cachefile:
-            reader = csv.DictReader(cachefile)
-            for line in reader:
-                if ':' in line['unique_ids']:  # if it's a cache file left over from a previous partitioning, there'll be clusters in it, too
-                    continue
-                if self.args.persistent_cachefname is not None and line['unique_ids'] not in expected_queries:  # probably can only happen if self.args.persistent_cachefname is set, and it's slow on huge samples
-                    continue
-                cached_naive_seqs[line['unique_ids']] = line['naive_seq']
-                if len(cached_naive_seqs) == len(expected_queries):  # already got everybody
-                    break
+        self.update_hmm_cache()
+        if self.hmm_cache is None:
+            raise Exception('hmm cache file %s doesn\'t exist' % self.hmm_cachefname)
+        for ustr, line in self.hmm_cache.items():
+            if ':' in ustr:  # if it's a cache file left over from a previous partitioning, there'll be clusters in it, too
+                continue
+            if self.args.persistent_cachefname is not None and ustr not in expected_query_set:  # probably can only happen if self.args.persistent_cachefname is set
+                continue
+            cached_naive_seqs[ustr] = line['naive_seq']
+            if len(cached_naive_seqs) == len(expected_queries):  # already got everybody
+                break
 
         if set(cached_naive_seqs) != set(expected_queries):  # can happen if hmm can't find a path for a sequence for which sw *did* have an annotation (but in that case the annotation is almost certainly garbage)
             extra = set(cached_naive_seqs) - set(expected_queries)
@@ -1200,8 +1280,7 @@ class PartitionDriver(object):
         cmd_str += ' --outfile ' + csv_outfname
         cmd_str += ' --locus ' + self.args.locus
         cmd_str += ' --random-seed ' + str(self.args.random_seed)
-        if n_procs > 1:  # only cache vals for sequence sets with newly-calculated vals (initial cache file is copied to each subdir)
-            cmd_str += ' --only-cache-new-vals'
+        cmd_str += ' --only-cache-new-vals'  # only cache vals for sequence sets with newly-calculated vals (all procs read the main cache file, and we then append the new vals to it)
 
         if self.args.dont_rescale_emissions:
             cmd_str += ' --dont-rescale-emissions'
@@ -1209,8 +1288,8 @@ class PartitionDriver(object):
             if self.args.cache_naive_hfracs:
                 cmd_str += ' --cache-naive-hfracs'
             if os.path.exists(self.hmm_cachefname):
-                cmd_str += ' --input-cachefname ' + self.hmm_cachefname
-            cmd_str += ' --output-cachefname ' + self.hmm_cachefname
+                cmd_str += ' --input-cachefname ' + self.hmm_cachefname  # NOTE execute() doesn't switch this one to the subdir
+            cmd_str += ' --output-cachefname ' + (self.hmm_cachefname if n_procs > 1 else self.new_hmm_cachefname)
             if precache_all_naive_seqs:
                 cmd_str += ' --cache-naive-seqs'
             else:  # actually partitioning
@@ -1298,6 +1377,8 @@ class PartitionDriver(object):
         def get_cmd_str(iproc):  # all this does at this point is replace workdir with sub-workdir in hmm input, output, and cache file arguments
             strlist = cmd_str.split()
             for istr in range(len(strlist)):
+                if istr > 0 and strlist[istr - 1] == '--input-cachefname':  # every proc reads the main cache file
+                    continue
                 if strlist[istr] == self.hmm_infname or strlist[istr] == self.hmm_cachefname or strlist[istr] == self.hmm_outfname:
                     strlist[istr] = strlist[istr].replace(self.args.workdir, self.subworkdir(iproc, n_procs))
             return ' '.join(strlist)
@@ -1581,17 +1662,38 @@ class PartitionDriver(object):
 
         return cpath, annotations, hmm_failures
 
+    # ----------------------------------------------------------------------------------------
+    def update_hmm_cache(self):  # add to self.hmm_cache any lines that've been appended to self.hmm_cachefname since the last time we read it
+        if not os.path.exists(self.hmm_cachefname):
+            self.hmm_cache, self.hmm_cache_pos = None, None
+            return
+        fstat = os.stat(self.hmm_cachefname)
+        if self.hmm_cache is None or fstat.st_ino != self.hmm_cache_pos['inode'] or fstat.st_size < self.hmm_cache_pos['offset']:  # first time, or it's been replaced/truncated rather than appended to, so start over
+            self.hmm_cache, self.hmm_cache_pos = OrderedDict(), {'inode' : fstat.st_ino, 'offset' : 0, 'fieldnames' : None}
+        with open(self.hmm_cachefname, 'rb') as cachefile:
+            cachefile.seek(self.hmm_cache_pos['offset'])
+            newbytes = cachefile.read()
+        newbytes = newbytes[ : newbytes.rfind(b'\n') + 1]  # leave any partial final line for next time
+        self.hmm_cache_pos['offset'] += len(newbytes)
+        lines = newbytes.decode('utf-8').splitlines()
+        if self.hmm_cache_pos['fieldnames'] is None and len(lines) > 0:
+            self.hmm_cache_pos['fieldnames'] = next(csv.reader(lines[:1]))
+            lines = lines[1:]
+        for line in csv.DictReader(lines, fieldnames=self.hmm_cache_pos['fieldnames']):
+            if line['unique_ids'] == 'unique_ids':  # extra header line
+                continue
+            self.hmm_cache[line['unique_ids']] = line  # if there's more than one line for the same uids, the later one wins
+
     # ----------------------------------------------------------------------------------------
     def read_hmm_cachefile(self):
-        # would be nice to merge this with self.get_cached_hmm_naive_seqs()
         cachefo = {}
-        if not os.path.exists(self.hmm_cachefname):
+        self.update_hmm_cache()
+        if self.hmm_cache is None:
             return cachefo
-        with open(self.hmm_cachefname) as cachefile:
-            reader = csv.DictReader(cachefile)
-            for line in reader:
-                utils.process_input_line(line)
-                cachefo[':'.join(line['unique_ids'])] = line
+        for line in self.hmm_cache.values():
+            line = dict(line)  # don't modify the lines in the index
+            utils.process_input_line(line)
+            cachefo[':'.join(line['unique_ids'])] = line
         return cachefo
 
     # ----------------------------------------------------------------------------------------
@@ -1804,12 +1906,6 @@ class PartitionDriver(object):
             return open(self.subworkdir(siproc, n_procs) + '/' + os.path.basename(infname), mode)
         def get_writer(sub_outfile):
             return csv.DictWriter(sub_outfile, reader.fieldnames, delimiter=str(' '))
-        def copy_cache_files(n_procs):
-            cmdfos = [{'cmd_str' : 'cp ' + self.hmm_cachefname + ' ' + self.subworkdir(iproc, n_procs) + '/',
-                       'workdir' : self.subworkdir(iproc, n_procs),
-                       'outfname' : self.subworkdir(iproc, n_procs) + '/' + os.path.basename(self.hmm_cachefname)}
-                      for iproc in range(n_procs)]
-            utils.run_cmds(cmdfos)
 
         # initialize output/cache files
         for iproc in range(n_procs):
@@ -1817,32 +1913,61 @@ class PartitionDriver(object):
             sub_outfile = get_sub_outfile(iproc, utils.csv_wmode())
             get_writer(sub_outfile).writeheader()
             sub_outfile.close()  # can't leave 'em all open the whole time 'cause python has the thoroughly unreasonable idea that one oughtn't to have thousands of files open at once
-        if self.current_action == 'partition' and os.path.exists(self.hmm_cachefname):  # copy cachefile to this subdir (first clause is just for so when we're getting cluster annotations we don't copy over the cache files)
-            copy_cache_files(n_procs)
 
+        # first deal with the seeded clusters
+        seed_lines = [[] for _ in range(n_procs)]  # seed info lines for each proc
         seed_clusters_to_write = list(seeded_clusters.keys())  # the keys in <seeded_clusters> that we still need to write
         for iproc in range(n_procs):
-            sub_outfile = get_sub_outfile(iproc, utils.csv_wmode('a'))
-            writer = get_writer(sub_outfile)
-
-            # first deal with the seeded clusters
             if separate_seeded_clusters:  # write the seed info line to each file
                 if len(seed_clusters_to_write) > 0:
                     if iproc < n_procs - 1:  # if we're not on the last proc, pop off and write the first one
-                        writer.writerow(seeded_clusters[seed_clusters_to_write.pop(0)])
+                        seed_lines[iproc].append(seeded_clusters[seed_clusters_to_write.pop(0)])
                     else:
                         while len(seed_clusters_to_write) > 0:  # keep adding 'em until we run out
-                            writer.writerow(seeded_clusters[seed_clusters_to_write.pop(0)])
+                            seed_lines[iproc].append(seeded_clusters[seed_clusters_to_write.pop(0)])
                 else:  # if we don't have any more that we *need* to write (i.e. that have other seqs in them), just write the shortest one (which will frequently be a singleton)
-                    writer.writerow(seeded_clusters[smallest_seed_cluster_str])
+                    seed_lines[iproc].append(seeded_clusters[smallest_seed_cluster_str])
 
-            # then loop over the non-seeded clusters
-            for iquery in range(len(info)):
-                if iquery % n_procs != iproc:
-                    continue
-                writer.writerow(info[iquery])
+        # then divide up the non-seeded clusters
+        proc_lines = self.assign_lines_to_procs(info, seed_lines, n_procs)
+
+        for iproc in range(n_procs):
+            sub_outfile = get_sub_outfile(iproc, utils.csv_wmode('a'))
+            writer = get_writer(sub_outfile)
+            for line in seed_lines[iproc] + proc_lines[iproc]:
+                writer.writerow(line)
             sub_outfile.close()
 
+    # ----------------------------------------------------------------------------------------
+    def estimate_bcrham_costs(self, lines, n_procs):  # rough estimate of the relative amount of bcrham work we'll need for each line in <lines> (bcrham input file lines, i.e. clusters) when they're split among <n_procs> procs
+        if self.current_action != 'partition':  # one viterbi calculation per cluster, which scales with the number of seqs
+            return [l['names'].count(':') + 1 for l in lines]
+        self.update_hmm_cache()
+        cdr3_counts = Counter(l['cdr3_length'] for l in lines)
+        costs = []
+        for line in lines:
+            csize = line['names'].count(':') + 1
+            cached = self.hmm_cache is not None and line['names'] in self.hmm_cache and self.hmm_cache[line['names']]['logprob'] != ''
+            cost = 0 if cached else csize  # forward calculation for the cluster itself (unless it's in the cache)
+            cost += csize * (cdr3_counts[line['cdr3_length']] - 1) / float(n_procs)  # candidate merges: we only compare to clusters with the same cdr3 length, of which on average 1/n_procs will be in the same proc (and each merge calculation scales with the number of seqs in both clusters)
+            costs.append(cost)
+        return costs
+
+    # ----------------------------------------------------------------------------------------
+    def assign_lines_to_procs(self, lines, seed_lines, n_procs):  # give each line (in their existing, i.e. shuffled, order) to whichever proc has the least estimated work so far, so we don't end up with one proc getting all the big clusters (if all the costs are equal this is the same as round robin)
+        costs = self.estimate_bcrham_costs(lines + [l for slines in seed_lines for l in slines], n_procs)  # seed lines are already assigned, but we need their costs for the initial loads
+        proc_loads, icost = [], len(lines)
+        for iproc in range(n_procs):
+            proc_loads.append((sum(costs[icost : icost + len(seed_lines[iproc])]), iproc))
+            icost += len(seed_lines[iproc])
+        heapq.heapify(proc_loads)
+        proc_lines = [[] for _ in range(n_procs)]
+        for line, cost in zip(lines, costs):
+            load, iproc = heapq.heappop(proc_loads)
+            proc_lines[iproc].append(line)
+            heapq.heappush(proc_loads, (load + cost, iproc))
+        return proc_lines
+
     # ----------------------------------------------------------------------------------------
     def merge_subprocess_files(self, fname, n_procs, include_outfile=False):
         subfnames = []
@@ -1853,62 +1978,72 @@ class PartitionDriver(object):
         self.merge_files(subfnames, fname, dereplicate=False)
 
     # ----------------------------------------------------------------------------------------
-    def merge_files(self, infnames, outfname, dereplicate):
-        """ 
-        Merge <infnames> into <outfname>.
+    def merge_files(self, infnames, outfname, dereplicate, max_run_bytes=2**26):
+        """
+        Merge <infnames> into <outfname>, streaming through each file once (so we only ever have one line in memory [or, if <dereplicate> is set, up to <max_run_bytes> of lines]).
         NOTE that <outfname> is overwritten with the zero-length file if it exists, otherwise it is created.
         Some of <infnames> may not exist.
+        If <dereplicate> is set, we remove exact duplicate lines (and the output lines are sorted), i.e. like 'sort | uniq': we write sorted runs of at most <max_run_bytes> to temporary files, then merge the runs and skip adjacent duplicates.
         """
-        # check_call(['wc', ] + [fn for fn in infnames if fn != outfname])
-        # if os.path.exists(outfname):
-        #     check_call(['wc', outfname])
-        # else:
-        #     print '  outfname d.n.e.'
-
-        header = ''
-        outfile = None
-        one_real_file = False
-        if outfname not in infnames or not os.path.exists(outfname):  # if it *is* in <infnames> we assume we can just tack the other infnames onto the end of it and use <outfname>'s header
-            outfile = open(outfname, utils.csv_wmode())
-        for fname in infnames:
-            if not os.path.exists(fname) or os.stat(fname).st_size == 0:
-                continue
-            one_real_file = True
-            with open(fname) as headfile:
-                reader = csv.DictReader(headfile)
-                header = ','.join(reader.fieldnames)
-                if outfile is not None:
-                    writer = csv.DictWriter(outfile, reader.fieldnames)
-                    writer.writeheader()
-            break  # kinda weird to do it this way, but we just need one of the infiles to get the header info (and some may be zero length)
-        if outfile is not None:
-            outfile.close()
-        if not one_real_file:
+        # ----------------------------------------------------------------------------------------
+        def iter_lines(fnames):  # yield the non-header lines from each of <fnames>
+            for fname in fnames:
+                if fname not in real_fnames:
+                    continue
+                with open(fname, newline='') as infile:
+                    for line in infile:
+                        if line.rstrip('\r\n') == header:
+                            continue
+                        yield line if line.endswith('\n') else line + '\n'
+        # ----------------------------------------------------------------------------------------
+        append = outfname in infnames and os.path.exists(outfname)  # if it *is* in <infnames> we assume we can just tack the other infnames onto the end of it and use <outfname>'s header
+        if not append:
+            open(outfname, utils.csv_wmode()).close()
+        real_fnames = [fn for fn in infnames if os.path.exists(fn) and os.stat(fn).st_size > 0]
+        if len(real_fnames) == 0:
             # print '    nothing to merge into %s' % outfname
             return
-
+        with open(real_fnames[0], newline='') as headfile:  # we just need one of the infiles to get the header info (and some may be zero length)
+            header_line = headfile.readline()
+        header = header_line.rstrip('\r\n')
         assert header != ''
 
         non_out_infnames = [fn for fn in infnames if fn != outfname]
         if len(non_out_infnames) == 0:
             raise Exception('merge_files() called with <infnames> consisting only of <outfname>')
-        cmd = 'cat ' + ' '.join(non_out_infnames) + ' | grep -v \'' + header + '\''
-        cmd += ' >>' + outfname
-        try:
-            check_call(cmd, shell=True)
-        except CalledProcessError:
-            pass
-            # print '    nothing to merge into %s' % outfname
-            # raise Exception('only read headers from %s', ' '.join([fn for fn in infnames if fn != outfname]))
 
-        if dereplicate:
+        if dereplicate:  # have to rewrite <outfname> (if we're appending to it) since there may be duplicates between it and the other files
             tmpfname = outfname + '.tmp'
-            check_call('echo ' + header + ' >' + tmpfname, shell=True)
-            check_call('grep -v \'' + header + '\' ' + outfname + ' | sort | uniq >>' + tmpfname, shell=True)  # NOTE there can be multiple lines with the same uid string, but this is ok -- the c++ handles it
-            check_call(['mv', tmpfname, outfname])
+            run_fnames, run, run_bytes = [], [], 0
+            for line in iter_lines(([outfname] if append else []) + non_out_infnames):
+                run.append(line)
+                run_bytes += len(line)
+                if run_bytes > max_run_bytes:  # write this run to disk (the last one stays in memory)
+                    run_fnames.append('%s.run-%d' % (outfname, len(run_fnames)))
+                    with open(run_fnames[-1], 'w', newline='') as runfile:
+                        runfile.writelines(sorted(run))
+                    run, run_bytes = [], 0
+            runfiles = [open(fn, newline='') for fn in run_fnames]
+            with open(tmpfname, 'w', newline='') as tmpfile:
+                tmpfile.write(header_line)
+                previous_line = None
+                for line in heapq.merge(sorted(run), *runfiles):  # NOTE there can be multiple (different) lines with the same uid string, but this is ok -- the c++ handles it
+                    if line != previous_line:
+                        tmpfile.write(line)
+                    previous_line = line
+            for rfile, rfname in zip(runfiles, run_fnames):
+                rfile.close()
+                os.remove(rfname)
+            os.rename(tmpfname, outfname)
+        else:
+            with open(outfname, 'a' if append else 'w', newline='') as outfile:
+                if not append:
+                    outfile.write(header_line)
+                for line in iter_lines(non_out_infnames):
+                    outfile.write(line)
 
         for infname in infnames:
-            if infname != outfname:
+            if infname != outfname and os.path.exists(infname):
                 os.remove(infname)
 
     # ----------------------------------------------------------------------------------------
@@ -1918,6 +2053,8 @@ class PartitionDriver(object):
         if self.current_action == 'partition':  # merge partitions from several files
             if n_procs > 1:
                 self.merge_subprocess_files(self.hmm_cachefname, n_procs, include_outfile=True)  # sub cache files only have new info
+            else:
+                self.merge_files([self.hmm_cachefname, self.new_hmm_cachefname], self.hmm_cachefname, dereplicate=False)  # same for the single-proc one
 
             if not precache_all_naive_seqs:
                 if n_procs == 1:
@@ -1951,6 +2088,7 @@ class PartitionDriver(object):
         start = time.time()
 
         from .hmmwriter import HmmWriter
+        from . import paramutils
         hmm_dir = parameter_dir + '/hmms'
         utils.prep_dir(hmm_dir, '*.yaml')
         # hmglfo = copy.deepcopy(self.glfo)  # it might be better to not modify self.glfo here, but there's way too many potential downstream effects to change it at this point
@@ -1959,18 +2097,35 @@ class PartitionDriver(object):
         if self.args.debug:
             print('to %s' % parameter_dir + '/hmms', end=' ')
 
-        if multiprocessing.cpu_count() * utils.memory_usage_fraction() > 0.8:  # already using a lot of memory, so don't to call multiprocessing, which will duplicate all the memory for each process
-            for region in utils.regions:
-                for gene in self.glfo['seqs'][region]:
-                    writer = HmmWriter(parameter_dir, hmm_dir, gene, self.glfo, self.args)
-                    writer.write()
-        else:
-            def write_single_hmm(gene):
-                writer = HmmWriter(parameter_dir, hmm_dir, gene, self.glfo, self.args)
+        genes = [g for r in utils.regions for g in self.glfo['seqs'][r]]
+        ptables = paramutils.get_parameter_tables(parameter_dir, snapshot_dir=self.args.parameter_snapshot_dir)
+        ptables.read_hmm_tables(genes)  # read all the parameter files once here, rather than once for each gene (and before forking, so the subprocs share them read-only)
+
+        # ----------------------------------------------------------------------------------------
+        def write_gene_hmms(gene_list):
+            for gene in gene_list:
+                writer = HmmWriter(parameter_dir, hmm_dir, gene, self.glfo, self.args, ptables=ptables)
                 writer.write()
-            procs = [multiprocessing.Process(target=write_single_hmm, args=(gene,))
-                     for region in utils.regions for gene in self.glfo['seqs'][region]]
-            utils.run_proc_functions(procs)  # uses all the cores (should only be for a little bit, though)
+
+        # ----------------------------------------------------------------------------------------
+        n_procs = min(len(genes), utils.auto_n_procs())
+        if n_procs < 2 or multiprocessing.cpu_count() * utils.memory_usage_fraction() > 0.8:  # already using a lot of memory, so don't to call multiprocessing, which will duplicate all the memory for each process
+            write_gene_hmms(genes)
+        else:  # a fixed number of procs, each of which writes a list of genes (rather than one proc per gene), with genes assigned to the least-loaded proc, longest first (hmm size and writing time are ~proportional to germline length)
+            gene_lists = [[] for _ in range(n_procs)]
+            loads = [(0, iproc) for iproc in range(n_procs)]  # heap of (total germline length, proc index)
+            for gene in sorted(genes, key=lambda g: len(self.glfo['seqs'][utils.get_region(g)][g]), reverse=True):
+                load, iproc = heapq.heappop(loads)
+                gene_lists[iproc].append(gene)
+                heapq.heappush(loads, (load + len(self.glfo['seqs'][utils.get_region(gene)][gene]), iproc))
+            procs = [multiprocessing.Process(target=write_gene_hmms, args=(glist,)) for glist in gene_lists]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+            failed_procs = [i for i, p in enumerate(procs) if p.exitcode != 0]
+            if len(failed_procs) > 0:
+                raise Exception('%d hmm writing proc%s failed (exit codes %s) when writing genes: %s' % (len(failed_procs), utils.plural(len(failed_procs)), ' '.join(str(procs[i].exitcode) for i in failed_procs), ' '.join(g for i in failed_procs for g in gene_lists[i])))
 
         print('(%.1f sec)' % (time.time()-start))
         sys.stdout.flush()
@@ -1994,7 +2149,7 @@ class PartitionDriver(object):
 
         combo = {}
         combo['seqs'] = [self.sw_info[name]['seqs'][0] for name in query_names]
-        combo['mut_freq'] = numpy.mean([utils.hamming_fraction(self.sw_info[name]['naive_seq'], self.sw_info[name]['seqs'][0]) for name in query_names])
+        combo['mut_freq'] = numpy.mean([self.sw_info[name]['mut_freqs'][0] for name in query_names])  # already calculated (as the naive/mature hamming fraction) when implicit info was added
         cdr3_lengths = [self.sw_info[name]['cdr3_length'] for name in query_names]
         if cdr3_lengths.count(cdr3_lengths[0]) != len(cdr3_lengths):
             uids_and_lengths = {q : self.sw_info[q]['cdr3_length'] for q in query_names}
@@ -2055,6 +2210,7 @@ class PartitionDriver(object):
                     'unique_ids' : ':'.join([qn for qn in query_name_list]),
                     'naive_seq' : self.get_padded_true_naive_seq(query_name_list[0])  # NOTE just using the first one... but a.t.m. I think I'll only run this fcn the first time through when they're all singletons, anyway
                 })
+        self.hmm_cache = None  # rewrote the file, so any index we had is wrong
 
     # ----------------------------------------------------------------------------------------
     def write_to_single_input_file(self, fname, nsets, parameter_dir, shuffle_input=False):
@@ -2457,7 +2613,7 @@ class PartitionDriver(object):
                 cpath.write(outfname, self.args.is_data, partition_lines=partition_lines)  # don't need to pass in reco_info/true_partition since we passed them when we got the partition lines
             annotation_fname = outfname if cpath is None else self.args.cluster_annotation_fname
             utils.write_annotations(annotation_fname, self.glfo, annotation_list, headers, failed_queries=failed_queries)
-        elif utils.getsuffix(outfname) == '.yaml':
-            utils.write_annotations(outfname, self.glfo, annotation_list, headers, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=self.args.write_full_yaml_output, dont_write_git_info=self.args.dont_write_git_info)
+        elif utils.getsuffix(outfname) in ['.yaml', '.npz']:
+            utils.write_annotations(outfname, self.glfo, annotation_list, headers, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=self.args.write_full_yaml_output, dont_write_git_info=self.args.dont_write_git_info, write_index=self.args.write_output_index)
         else:
             raise Exception('unhandled annotation file suffix %s' % outfname)
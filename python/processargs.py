@@ -304,12 +304,12 @@ def process(args):
             print('%s --batch-options contains \'-e\' or \'-o\', but we add these automatically since we need to be able to parse each job\'s stdout and stderr. You can control the directory under which they\'re written with --workdir (which is currently %s).' % (utils.color('red', 'warning'), args.workdir))
 
     if args.outfname is not None and not args.presto_output and not args.airr_output and not args.generate_trees:
-        if utils.getsuffix(args.outfname) not in ['.csv', '.yaml']:
+        if utils.getsuffix(args.outfname) not in ['.csv', '.yaml', '.npz']:
             raise Exception('unhandled --outfname suffix %s' % utils.getsuffix(args.outfname))
-        if utils.getsuffix(args.outfname) != '.yaml':
+        if utils.getsuffix(args.outfname) == '.csv':
             print('  %s --outfname uses deprecated file format %s. This will still mostly work ok, but the new default .yaml format doesn\'t have to do all the string conversions by hand (so is less buggy), and includes annotations, partitions, and germline info in the same file (so you don\'t get crashes or inconsistent results if you don\'t keep track of what germline info goes with what output file).' % (utils.color('yellow', 'note:'), utils.getsuffix(args.outfname)))
-        if args.action in ['view-annotations', 'view-partitions'] and utils.getsuffix(args.outfname) == '.yaml':
-            raise Exception('have to use \'view-output\' action to view .yaml output files')
+        if args.action in ['view-annotations', 'view-partitions'] and utils.getsuffix(args.outfname) in ['.yaml', '.npz']:
+            raise Exception('have to use \'view-output\' action to view %s output files' % utils.getsuffix(args.outfname))
 
     if args.presto_output:
         if args.outfname is None:
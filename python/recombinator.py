@@ -47,6 +47,8 @@ class Recombinator(object):
         self.reco_parameter_dir = utils.parameter_type_subdir(self.args, self.args.reco_parameter_dir) if self.args.reco_parameter_dir is not None else None  # only used if not rearranging from scratch
         self.shm_parameter_dir = utils.parameter_type_subdir(self.args, self.args.shm_parameter_dir) if self.args.shm_parameter_dir is not None else None  # only used if not mutating from scratch
         print('    reco params: %s     shm params: %s' % (utils.non_none([self.reco_parameter_dir, 'scratch']), utils.non_none([self.shm_parameter_dir, 'scratch'])))
+        for pdir in [d for d in [self.reco_parameter_dir, self.shm_parameter_dir] if d is not None]:  # parse the whole parameter dirs now (or read them from the snapshot) so we don't have to re-parse anything for each event
+            paramutils.get_parameter_tables(pdir, read_all=True, snapshot_dir=self.args.parameter_snapshot_dir, debug=self.args.debug)
 
         self.index_keys = {}  # this is kind of hackey, but I suspect indexing my huge table of freqs with a tuple is better than a dict
         self.mute_models = {}
@@ -111,20 +113,18 @@ class Recombinator(object):
         insertion_content_probs = {}
         for bound in utils.boundaries:
             insertion_content_probs[bound] = {}
-            with open(self.reco_parameter_dir + '/' + bound + '_insertion_content.csv', 'r') as icfile:
-                reader = csv.DictReader(icfile)
-                total = 0
-                for line in reader:
-                    insertion_content_probs[bound][line[bound + '_insertion_content']] = int(line['count'])
-                    total += int(line['count'])
-                if total > 0:
-                    for nuke in utils.nukes:
-                        if nuke not in insertion_content_probs[bound]:
-                            print('    %s not in insertion content probs, adding with zero' % nuke)
-                            insertion_content_probs[bound][nuke] = 0
-                        insertion_content_probs[bound][nuke] /= float(total)
-                else:  # i think this will only happen for light chain (i.e. when one of the bounds has all-zero counts)
-                    insertion_content_probs[bound] = default_content()
+            total = 0
+            for line in paramutils.read_csv_rows(self.reco_parameter_dir, bound + '_insertion_content.csv'):
+                insertion_content_probs[bound][line[bound + '_insertion_content']] = int(line['count'])
+                total += int(line['count'])
+            if total > 0:
+                for nuke in utils.nukes:
+                    if nuke not in insertion_content_probs[bound]:
+                        print('    %s not in insertion content probs, adding with zero' % nuke)
+                        insertion_content_probs[bound][nuke] = 0
+                    insertion_content_probs[bound][nuke] /= float(total)
+            else:  # i think this will only happen for light chain (i.e. when one of the bounds has all-zero counts)
+                insertion_content_probs[bound] = default_content()
 
             assert utils.is_normed(insertion_content_probs[bound])
 
@@ -241,30 +241,28 @@ class Recombinator(object):
         version_freq_table = {}
         n_skipped_gene, n_skipped_cdr3, n_used = 0., 0., 0.
         cdr3_counts = {}
-        with open(self.reco_parameter_dir + '/' + utils.get_parameter_fname('all', 'r')) as infile:
-            in_data = csv.DictReader(infile)
-            total = 0.0
-            for line in in_data:  # NOTE do *not* assume the file is sorted
-                if any(line[region + '_gene'] not in self.glfo['seqs'][region] for region in utils.regions):
-                    n_skipped_gene += float(line['count'])
-                    continue
-                if self.args.allowed_cdr3_lengths is not None and int(line['cdr3_length']) not in self.args.allowed_cdr3_lengths:
-                    n_skipped_cdr3 += float(line['count'])  #  NOTE this isn't really right if we're also skipping genes above, but whatever (well it's not really wrong, but it'd be different if we did it before the gene skipping rather than after)
-                    continue
-                total += float(line['count'])
-                index = self.freqtable_index(line)
-                assert index not in version_freq_table
-                version_freq_table[index] = float(line['count'])
-                n_used += float(line['count'])
-                if self.args.allowed_cdr3_lengths is not None:  # maybe it's worth printing what the final cdr3 length breakdown is? (so it's obvious if e.g. you asked for 27, 30, 33 but only got 33)
-                    if int(line['cdr3_length']) not in cdr3_counts:
-                        cdr3_counts[int(line['cdr3_length'])] = 0
-                    cdr3_counts[int(line['cdr3_length'])] += float(line['count'])
-            if n_skipped_gene > 0:
-                print('    skipped %.0f / %.0f (%.3f) vdj freq counts with genes not in glfo (used %.0f)' % (n_skipped_gene, n_skipped_gene + n_used, n_skipped_gene / (n_skipped_gene + n_used), n_used))
-            if n_skipped_cdr3 > 0:
-                print('    skipped %.0f / %.0f (%.3f) vdj freq counts with cdr3 lengths not among [%s] (used %.0f)' % (n_skipped_cdr3, n_skipped_cdr3 + n_used, n_skipped_cdr3 / (n_skipped_cdr3 + n_used), ' '.join(str(c) for c in self.args.allowed_cdr3_lengths), n_used))
-                print('       final cdr3 lengths: %s' % '   '.join(('%d: %.0f'%(l, cdr3_counts[l])) for l in sorted(cdr3_counts)))
+        total = 0.0
+        for line in paramutils.read_csv_rows(self.reco_parameter_dir, utils.get_parameter_fname('all', 'r')):  # NOTE do *not* assume the file is sorted
+            if any(line[region + '_gene'] not in self.glfo['seqs'][region] for region in utils.regions):
+                n_skipped_gene += float(line['count'])
+                continue
+            if self.args.allowed_cdr3_lengths is not None and int(line['cdr3_length']) not in self.args.allowed_cdr3_lengths:
+                n_skipped_cdr3 += float(line['count'])  #  NOTE this isn't really right if we're also skipping genes above, but whatever (well it's not really wrong, but it'd be different if we did it before the gene skipping rather than after)
+                continue
+            total += float(line['count'])
+            index = self.freqtable_index(line)
+            assert index not in version_freq_table
+            version_freq_table[index] = float(line['count'])
+            n_used += float(line['count'])
+            if self.args.allowed_cdr3_lengths is not None:  # maybe it's worth printing what the final cdr3 length breakdown is? (so it's obvious if e.g. you asked for 27, 30, 33 but only got 33)
+                if int(line['cdr3_length']) not in cdr3_counts:
+                    cdr3_counts[int(line['cdr3_length'])] = 0
+                cdr3_counts[int(line['cdr3_length'])] += float(line['count'])
+        if n_skipped_gene > 0:
+            print('    skipped %.0f / %.0f (%.3f) vdj freq counts with genes not in glfo (used %.0f)' % (n_skipped_gene, n_skipped_gene + n_used, n_skipped_gene / (n_skipped_gene + n_used), n_used))
+        if n_skipped_cdr3 > 0:
+            print('    skipped %.0f / %.0f (%.3f) vdj freq counts with cdr3 lengths not among [%s] (used %.0f)' % (n_skipped_cdr3, n_skipped_cdr3 + n_used, n_skipped_cdr3 / (n_skipped_cdr3 + n_used), ' '.join(str(c) for c in self.args.allowed_cdr3_lengths), n_used))
+            print('       final cdr3 lengths: %s' % '   '.join(('%d: %.0f'%(l, cdr3_counts[l])) for l in sorted(cdr3_counts)))
 
         if len(version_freq_table) == 0:
             raise Exception('didn\'t find any gene combinations in %s' % self.reco_parameter_dir + '/' + utils.get_parameter_fname('all', 'r'))
@@ -194,6 +194,21 @@ def post_process(input_info, reco_info, args, infname, found_seed, is_data, ilin
             print('  --n-random-queries: keeping %d / %d sequences from input file (removed %d%s)' % (len(input_info), len(input_info) + len(uids_to_remove), len(uids_to_remove),
                                                                                                       (' and specifically kept %s' % ' '.join(included_queries)) if len(included_queries) > 0 else ''))
 
+# ----------------------------------------------------------------------------------------
+def get_identical_input_uids(input_info, uids=None):  # group uids whose input seqs are exactly identical: returns {first uid: [later uids with the same seq]} (only includes groups with at least one duplicate)
+    # NOTE this is only exact identity of the raw input seq, so it's a strict subset of what waterer.remove_duplicate_sequences() collapses (which happens after framework insertion trimming), i.e. it's always safe to run sw on only the first uid in each group
+    first_uids, dup_uids = {}, OrderedDict()
+    for uid in (input_info if uids is None else uids):
+        seq = input_info[uid]['seqs'][0]
+        if seq not in first_uids:
+            first_uids[seq] = uid
+            continue
+        kuid = first_uids[seq]
+        if kuid not in dup_uids:
+            dup_uids[kuid] = []
+        dup_uids[kuid].append(uid)
+    return dup_uids
+
 # ----------------------------------------------------------------------------------------
 def get_seqfile_info(x, is_data=False):
     raise Exception('renamed and changed returned vals (see below)')
@@ -203,12 +218,16 @@ def read_sequence_file(infname, is_data, n_max_queries=-1, args=None, simglfo=No
     # NOTE renamed this from get_seqfile_info() since I'm changing the return values, but I don't want to update the calls everywhere (e.g. in compareutils)
     yaml_glfo = None
     suffix = utils.getsuffix(infname)
+    if suffix in utils.compression_modules:  # only handle compressed fasta/fastq
+        suffix = utils.fastx_suffix(infname)
+        if suffix not in ['.fa', '.fasta', '.fq', '.fastq']:
+            raise Exception('compressed input files must be fasta or fastq, but got \'%s\'' % infname)
     if suffix in delimit_info:
         seqfile = open(infname)  # closes on function exit. no, this isn't the best way to do this
         reader = csv.DictReader(seqfile, delimiter=delimit_info[suffix])
     elif suffix in ['.fa', '.fasta', '.fq', '.fastq', '.fastx']:
         add_info = args is not None and args.name_column is not None and 'fasta-info-index' in args.name_column
-        reader = utils.read_fastx(infname, name_key='unique_ids', seq_key='input_seqs', add_info=add_info, sanitize_uids=True, n_max_queries=n_max_queries,  # NOTE don't use istarstop kw arg here, 'cause it fucks with the istartstop treatment in the loop below
+        reader = utils.iter_fastx(infname, name_key='unique_ids', seq_key='input_seqs', add_info=add_info, sanitize_uids=True, n_max_queries=n_max_queries,  # NOTE don't use istarstop kw arg here, 'cause it fucks with the istartstop treatment in the loop below (but since it's a generator we stop reading the file when the loop below breaks)
                                   queries=(args.queries if (args is not None and not args.abbreviate) else None), sanitize_seqs=args.sanitize_input_seqs)  # NOTE also can't filter on args.queries here if we're also translating
     elif suffix == '.yaml':
         yaml_glfo, reader, _ = utils.read_yaml_output(infname, n_max_queries=n_max_queries, synth_single_seqs=True, dont_add_implicit_info=True)  # not really sure that long term I want to synthesize single seq lines, but for backwards compatibility it's nice a.t.m.
@@ -390,7 +390,7 @@ def get_dendro_tree(treestr=None, treefname=None, taxon_namespace=None, schema='
         if taxon_namespace is not None:
             print('     and taxon namespace:  %s' % ' '.join([t.label for t in taxon_namespace]))
     # dendropy doesn't make taxons for internal nodes by default, so it puts the label for internal nodes in node.label instead of node.taxon.label, but it crashes if it gets duplicate labels, so you can't just always turn off internal node taxon suppression
-    dtree = dendropy.Tree.get_from_string(treestr, schema, taxon_namespace=taxon_namespace, suppress_internal_node_taxa=(ignore_existing_internal_node_labels or suppress_internal_node_taxa), preserve_underscores=True, rooting='force-rooted')  # make sure the tree is rooted, to avoid nodes disappearing in remove_dummy_branches() (and proably other places as well)
+    dtree = dendropy.Tree.get_from_string(treestr, schema, taxon_namespace=taxon_namespace, suppress_internal_node_taxa=(ignore_existing_internal_node_labels or suppress_internal_node_taxa), preserve_underscores=True, rooting='force-rooted')  # make sure the tree is rooted, to avoid nodes disappearing when rerooting (and proably other places as well)
     if dtree.seed_node.edge_length is not None and dtree.seed_node.edge_length > 0 and not no_warn:
         # this would be easy to fix, but i think it only happens from simulation trees from treegenerator UPDATE ok also happens for trees from the linearham paper
         print('  %s seed/root node has non-zero edge length (i.e. there\'s a branch above it)' % utils.color('red', 'warning'))
@@ -1180,72 +1180,68 @@ def node_mtpy(multifo, node):  # number of reads/contigs/whatever (depending on
         return 1
     return multifo[node.taxon.label]
 
+# ----------------------------------------------------------------------------------------
+def get_tree_arrays(dtree):  # compact array representation of <dtree>: list of nodes in preorder (so parents always come before their children), plus arrays with the index of each node's parent (-1 for root) and the length of the branch to its parent (0 for root and for edges with length None)
+    nodes = list(dtree.preorder_node_iter())
+    inodes = {id(n) : i for i, n in enumerate(nodes)}
+    parents = numpy.array([-1 if n.parent_node is None else inodes[id(n.parent_node)] for n in nodes], dtype=int)
+    blens = numpy.array([0. if n.parent_node is None or n.edge.length is None else n.edge.length for n in nodes], dtype=float)
+    return nodes, parents, blens
+
 # ----------------------------------------------------------------------------------------
 # copied from https://github.com/nextstrain/augur/blob/master/base/scores.py
 # also see explanation here https://photos.app.goo.gl/gtjQziD8BLATQivR6
-def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, debug=False):
+def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, n_tau_lengths=10, debug=False):
     """
-    traverses <dtree> in postorder and preorder to calculate the up and downstream tree length exponentially weighted by distance, then adds them as LBI (and divides as LBR)
+    passes over <dtree> in postorder and preorder to calculate the up and downstream tree length exponentially weighted by distance, then adds them as LBI (and divides as LBR)
+    works on the parent index/branch length arrays from get_tree_arrays() (so <dtree> isn't modified), rather than adding dummy branches to the tree: the long branch above the root and the multiplicity nubs below each node are instead accounted for directly in the arrays
     use_old_multiplicity_method: insert multiplicity into integrals (below), which is equivalent to adding N-1 branches between the node and its parent
     new version: add N-1 dummy branches of length <tau> from the node
     """
     # NOTE: it's not N kids that matters, it's N kids that look like you
-    getmulti = node_mtpy if use_old_multiplicity_method else lambda x, y: 1
 
     if debug:
         print('    setting %s values with tau %.4f' % (' and '.join(metrics_to_calc), tau))
 
-    initial_labels = set([n.taxon.label for n in dtree.preorder_node_iter()])
-    dtree, dummy_labels = get_tree_with_dummy_branches(dtree, tau, add_dummy_multiplicity_nubs=not use_old_multiplicity_method, multifo=multifo)  # this returns a new dtree, but the old tree is a subtree of the new one (or at least its collection of nodes are), and these nodes get modified by the process (hence the reversal fcn below)
-
-    # calculate clock length (i.e. for each node, the distance to that node's parent)
-    for node in dtree.postorder_node_iter():  # postorder vs preorder doesn't matter, but I have to choose one
-        if node.parent_node is None:  # root node
-            node.clock_length = 0.
-        for child in node.child_node_iter():
-            child.clock_length = child.distance_from_root() - node.distance_from_root()
-
-    # lbi is the sum of <node.down_polarizer> (downward message from <node>'s parent) and its children's up_polarizers (upward messages)
-
-    # traverse the tree in postorder (children first) to calculate message to parents (i.e. node.up_polarizer)
-    for node in dtree.postorder_node_iter():
-        node.down_polarizer = 0  # used for <node>'s lbi (this probabably shouldn't be initialized here, since it gets reset in the next loop [at least I think they all do])
-        node.up_polarizer = 0  # used for <node>'s parent's lbi (but not <node>'s lbi)
-        for child in node.child_node_iter():
-            node.up_polarizer += child.up_polarizer
-        bl = node.clock_length / tau
-        node.up_polarizer *= numpy.exp(-bl)  # sum of child <up_polarizer>s weighted by an exponential decayed by the distance to <node>'s parent
-        node.up_polarizer += getmulti(multifo, node) * tau * (1 - numpy.exp(-bl))  # add the actual contribution (to <node>'s parent's lbi) of <node>: zero if the two are very close, increasing toward asymptote of <tau> for distances near 1/tau (integral from 0 to l of decaying exponential)
-
-    # traverse the tree in preorder (parents first) to calculate message to children (i.e. child1.down_polarizer)
-    for node in dtree.preorder_internal_node_iter():
-        for child1 in node.child_node_iter():  # calculate down_polarizer for each of <node>'s children
-            child1.down_polarizer = node.down_polarizer  # first sum <node>'s down_polarizer...
-            for child2 in node.child_node_iter():  # and the *up* polarizers of any other children of <node>
-                if child1 != child2:
-                    child1.down_polarizer += child2.up_polarizer  # add the contribution of <child2> to its parent's (<node>'s) lbi (i.e. <child2>'s contribution to the lbi of its *siblings*)
-            bl = child1.clock_length / tau
-            child1.down_polarizer *= numpy.exp(-bl)  # and decay the previous sum by distance between <child1> and its parent (<node>)
-            child1.down_polarizer += getmulti(multifo, child1) * tau * (1 - numpy.exp(-bl))  # add contribution of <child1> to its own lbi: zero if it's very close to <node>, increasing to max of <tau> (integral from 0 to l of decaying exponential)
-
+    nodes, parents, blens = get_tree_arrays(dtree)
+    blens[0] = n_tau_lengths * tau  # dummy branch above root (i.e. from a dummy root node with zero down polarizer and no other children)
+    mtpys = [node_mtpy(multifo, n) for n in nodes]
+    if use_old_multiplicity_method:
+        weights, n_nubs = mtpys, [0 for _ in nodes]
+    else:
+        weights, n_nubs = [1 for _ in nodes], [max(0, m - 1) for m in mtpys]  # each node gets N-1 dummy leaf branches of length <tau> (none for zero multiplicity)
+    expvals = numpy.exp(-blens / tau)  # decay over the branch between each node and its parent
+    contribs = tau * (1 - expvals)  # contribution of each node to its parent's lbi (and to its own): zero if the two are very close, increasing toward asymptote of <tau> for distances near 1/tau (integral from 0 to l of decaying exponential)
+    nub_polarizer = tau * (1 - numpy.exp(-1.))  # up polarizer of a multiplicity nub (a leaf at distance <tau> from its parent)
+
+    # lbi is the sum of <down_polarizers> (downward message from each node's parent) and its children's <up_polarizers> (upward messages)
+    exps, contribs, parents = expvals.tolist(), contribs.tolist(), parents.tolist()  # plain lists are a lot faster than numpy arrays for element-wise access
+    child_sums = [k * nub_polarizer for k in n_nubs]  # sum of up polarizers of each node's children
+    up_polarizers = [0. for _ in nodes]  # used for each node's parent's lbi (but not its own lbi)
+    for inode in range(len(nodes) - 1, -1, -1):  # reversed preorder, i.e. children before parents
+        up_polarizers[inode] = child_sums[inode] * exps[inode] + weights[inode] * contribs[inode]  # sum of child up polarizers weighted by an exponential decayed by the distance to the node's parent, plus the node's own contribution
+        if parents[inode] >= 0:
+            child_sums[parents[inode]] += up_polarizers[inode]
+
+    down_polarizers = [0. for _ in nodes]  # used for each node's own lbi
+    for inode in range(len(nodes)):  # preorder (parents first)
+        ipar = parents[inode]
+        dsum = 0. if ipar < 0 else down_polarizers[ipar] + child_sums[ipar] - up_polarizers[inode]  # parent's down polarizer plus the up polarizers of any other children of the parent (i.e. the siblings' contributions to the parent's lbi)
+        down_polarizers[inode] = dsum * exps[inode] + weights[inode] * contribs[inode]  # decay by distance to parent, and add the node's contribution to its own lbi
+
+    down_polarizers, child_sums = numpy.array(down_polarizers), numpy.array(child_sums)
+    total_length = float(numpy.sum(blens)) + tau * sum(n_nubs)
+    lbvals = {'lbi' : down_polarizers + child_sums,
+              'lbr' : numpy.divide(child_sums, down_polarizers, out=child_sums.copy(), where=down_polarizers > 0.),  # nodes with zero down polarizer keep the undivided child sum. It might make more sense to not include the branch between the node and its parent in either the numerator or denominator (here it's included in the denominator), but this way I don't have to change any of the calculations above
+              'lbf' : child_sums * 100. / total_length}
+    lbvals['lbr'][0] = 0.  # root
     returnfo = {m : {} for m in metrics_to_calc}
-    # go over all nodes and calculate lb metrics (can be done in any order)
-    total_length = dtree.length()
-    for node in dtree.postorder_node_iter():
-        vals = {'lbi' : node.down_polarizer, 'lbr' : 0., 'lbf' : 0.}
-        for child in node.child_node_iter():
-            for mtmp in vals:
-                vals[mtmp] += child.up_polarizer
-        if node.down_polarizer > 0.:
-            vals['lbr'] /= node.down_polarizer  # it might make more sense to not include the branch between <node> and its parent in either the numerator or denominator (here it's included in the denominator), but this way I don't have to change any of the calculations above
-        vals['lbf'] *= 100. / total_length
-
-        if utils.dummy_str in node.taxon.label:
-            continue
-        if node is dtree.seed_node or node.parent_node is dtree.seed_node:  # second clause is only because of dummy root addition (well, and if we are adding dummy root the first clause doesn't do anything)
-            vals['lbr'] = 0.
-        for metric in metrics_to_calc:
-            mval = float(vals[metric])
+    for metric in metrics_to_calc:
+        mvals = lbvals[metric].tolist()
+        for inode, node in enumerate(nodes):
+            if utils.dummy_str in node.taxon.label:
+                continue
+            mval = mvals[inode]
             if metric == 'lbi' and not dont_normalize:
                 assert seq_len is not None
                 mval = normalize_lb_val(metric, mval, tau, seq_len)
@@ -1253,17 +1249,18 @@ def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=Fals
 
     if debug:
         # ----------------------------------------------------------------------------------------
-        def lbs(node, mtr):
-            lstr = '%8.3f' % returnfo[mtr][node.taxon.label]
+        def lbs(inode, mtr):
+            label = nodes[inode].taxon.label
+            lstr = '%8.3f' % returnfo[mtr][label]
             if mtr == 'lbr':
-                lstr += ' = %-5.3f / %-5.3f' % (returnfo[mtr][node.taxon.label] * node.down_polarizer, node.down_polarizer)
+                lstr += ' = %-5.3f / %-5.3f' % (returnfo[mtr][label] * down_polarizers[inode], down_polarizers[inode])
             elif mtr == 'lbf':
-                lstr += ' = %-5.3f / %-5.3f' % (returnfo[mtr][node.taxon.label] * total_length, total_length)
+                lstr += ' = %-5.3f / %-5.3f' % (returnfo[mtr][label] * total_length, total_length)
             return lstr
         # ----------------------------------------------------------------------------------------
-        max_width = str(max([len(n.taxon.label) for n in dtree.postorder_node_iter()]))
+        max_width = str(max([len(n.taxon.label) for n in nodes]))
         print(('   %s      %s      multi') % (utils.wfmt('node', max_width), ''.join('%s'%utils.wfmt(m, 24 if m in ['lbr', 'lbf'] else 9, jfmt='-') for m in metrics_to_calc))) #, 16*' ' if 'lbr' in metrics_to_calc else '')
-        for node in dtree.preorder_node_iter():
+        for inode, node in enumerate(nodes):
             if utils.dummy_str in node.taxon.label:
                 continue
             multi_str = ''
@@ -1271,110 +1268,11 @@ def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=Fals
                 multi_str = str(node_mtpy(multifo, node))
                 if node_mtpy(multifo, node) > 1:
                     multi_str = utils.color('blue', multi_str, width=3)
-            lbstrs = [lbs(node, m) for m in metrics_to_calc]
+            lbstrs = [lbs(inode, m) for m in metrics_to_calc]
             print(('    %' + max_width + 's  %s    %3s') % (node.taxon.label, ''.join(lbstrs), multi_str))
 
-    # this is maybe time consuming, but I want to leave the tree that was passed in as unmodified as I can (especially since I have to run this fcn twice for lbi/lbr since they need different tau values)
-    for node in dtree.postorder_node_iter():
-        delattr(node, 'clock_length')
-        delattr(node, 'up_polarizer')
-        delattr(node, 'down_polarizer')
-
-    remove_dummy_branches(dtree, initial_labels, dummy_labels)
-
     return returnfo
 
-# ----------------------------------------------------------------------------------------
-def get_tree_with_dummy_branches(old_dtree, tau, n_tau_lengths=10, add_dummy_leaves=False, add_dummy_multiplicity_nubs=False, multifo=None, debug=False): # add long branches above root and/or below each leaf, since otherwise we're assuming that (e.g.) leaf node fitness is zero
-    # commenting this since I'm pretty sure I've fixed it, but not removing it since if a similar problem surfaces with dummy branch addition, deep copying is an easy way out
-    # zero_length_edges = [e for e in old_dtree.preorder_edge_iter() if e.length == 0 and not e.head_node.is_leaf()]
-    # if len(zero_length_edges) > 0:  # rerooting to remove dummy branches screws up the tree in some cases with zero length branches (see comment in that fcn)
-    #     old_dtree = copy.deepcopy(old_dtree)  # could maybe do this by default, but it'll probably be really slow on large trees (at least iterating through the trees is; although I suppose maybe deepcopy is smater than that)
-    #     print '    %s found %d zero length branches in tree, so deep copying before adding dummy branches (this is probably ok ish, but in general it\'s a bad idea to have zero length branches in your trees): %s' % (utils.color('yellow', 'warning'), len(zero_length_edges), ' '.join([e.head_node.taxon.label for e in zero_length_edges]))
-
-    dummy_edge_length = n_tau_lengths * tau
-
-    dummy_labels = []
-
-    new_root_taxon = dendropy.Taxon(utils.dummy_str + '-root')
-    old_dtree.taxon_namespace.add_taxon(new_root_taxon)
-    new_root_node = dendropy.Node(taxon=new_root_taxon)
-    new_dtree = dendropy.Tree(seed_node=new_root_node, taxon_namespace=old_dtree.taxon_namespace, is_rooted=True)
-    dummy_labels.append(new_root_node.taxon.label)
-
-    # then add the entire old tree under this new tree
-    new_root_node.add_child(old_dtree.seed_node)
-    for edge in new_root_node.child_edge_iter():
-        edge.length = dummy_edge_length
-
-    if add_dummy_leaves:  # add dummy child branches to each leaf
-        tns = new_dtree.taxon_namespace
-        for lnode in new_dtree.leaf_node_iter():
-            new_label = '%s-%s' % (utils.dummy_str, lnode.taxon.label)
-            tns.add_taxon(dendropy.Taxon(new_label))
-            new_child_node = lnode.new_child(taxon=tns.get_taxon(new_label), edge_length=dummy_edge_length)
-            dummy_labels.append(new_child_node.taxon.label)
-
-    if add_dummy_multiplicity_nubs:  # new way of incorporating multiplicity: add N-1 dummy branches from the node
-        tns = new_dtree.taxon_namespace
-        for mnode in list(new_dtree.preorder_node_iter()):  # list() is because we're adding nodes as we iterate
-            for idum in range(1, node_mtpy(multifo, mnode)):
-                new_label = '%s-multi-%d-%s' % (utils.dummy_str, idum, mnode.taxon.label)
-                tns.add_taxon(dendropy.Taxon(new_label))
-                new_child_node = mnode.new_child(taxon=tns.get_taxon(new_label), edge_length=tau)
-                dummy_labels.append(new_child_node.taxon.label)
-
-    # TODO commenting this because it gets triggered way too much, but I'm not actually sure that I can really just ignore the problem (but maybe I can)
-    # zero_len_edge_nodes = [e.head_node for n in new_dtree.preorder_node_iter() for e in n.child_edge_iter() if e.length == 0 and not e.head_node.is_leaf()]  # zero len edges above leaves are fine, since leaves don't count for lbr
-    # if len(zero_len_edge_nodes) > 0:
-    #     print '    %s found %d zero length internal edges in tree, which means lb ratio may mis-categorize branches: %s' % (utils.color('red', 'warning'), len(zero_len_edge_nodes), ' '.join([n.taxon.label for n in zero_len_edge_nodes]))
-    #     # for node in zero_len_edge_nodes:  # we don't really want to modify the tree this drastically here (and a.t.m. this causes a crash later on), but I'm leaving it as a placeholder for how to remove zero length edges
-    #     #     collapse_nodes(new_dtree, node.taxon.label, node.parent_node.taxon.label)  # keep the child, since it can be a leaf
-    #     # print utils.pad_lines(get_ascii_tree(dendro_tree=new_dtree))
-
-    new_dtree.update_bipartitions(suppress_unifurcations=False)  # not sure if I need this? (suppress_unifurcations is because otherwise it removes the branch between the old and new root nodes)
-
-    if debug:
-        print('    added dummy branches to tree:')
-        print(get_ascii_tree(dendro_tree=new_dtree, extra_str='      ', width=350))
-
-    return new_dtree, dummy_labels
-
-# ----------------------------------------------------------------------------------------
-def remove_dummy_branches(dtree, initial_labels, dummy_labels, add_dummy_leaves=False, debug=False):
-    # if add_dummy_leaves:
-    #     print 'UPDATE ok maybe it\'s fine now (since i\'m adding the dummy nubs), but i\'m not checking it'
-    #     raise Exception('not implemented (shouldn\'t be too hard, but a.t.m. I don\'t think I\'ll need it)')
-
-    if len(dtree.seed_node.child_nodes()) != 1:
-        print('  %s root node has more than one child when removing dummy branches: %s' % (utils.color('yellow', 'warning'), ' '.join([n.taxon.label for n in dtree.seed_node.child_nodes()])))
-    new_root_node = dtree.seed_node.child_nodes()[0]
-    if debug:
-        print('  rerooting at %s' % new_root_node.taxon.label)
-        print('            current children: %s' % ' '.join([n.taxon.label for n in new_root_node.child_node_iter()]))
-    # NOTE if the new root has a child separated by a zero-length edge, this reroot call for some reason deletes that child from the tree (both with and without suppress_unifurcations set). After messing around a bunch to try to fix it, the message I'm taking is just that zero length branches (and unifurcations) are a bad idea and I should just forbid them
-    # UPDATE I think I was just missing the suppress_unifurcations=False in update_bipartitions(), but leaving these comments here in case there was another problem
-    # UPDATE actually the reroot still seems to eat a node sometimes if the tree is unrooted (so adding the extra reroot above)
-    # UPDATE this is more or less expectd, from dendropy's perspective; see https://github.com/jeetsukumaran/DendroPy/issues/118
-    assert dtree.is_rooted  # make sure it's rooted, to avoid unifurcations getting suppressed (even with the arg set to false)
-    dtree.reroot_at_node(new_root_node, suppress_unifurcations=False)  # reroot at old root node
-    if debug:
-        print('       children after reroot: %s' % ' '.join([n.taxon.label for n in new_root_node.child_node_iter()]))
-    dtree.prune_taxa_with_labels(dummy_labels, suppress_unifurcations=False)
-    dtree.purge_taxon_namespace()  # I'm sure there's a good reason the previous line doesn't do this
-    dtree.update_bipartitions(suppress_unifurcations=False)
-    if debug:
-        print('        children after purge: %s' % ' '.join([n.taxon.label for n in new_root_node.child_node_iter()]))
-
-    final_labels = set([n.taxon.label for n in dtree.preorder_node_iter()])
-    if initial_labels != final_labels:  # this was only happening with a zero-length node hanging off root (see above), which probably won't happen any more since I'm now removing zero length (non-leaf) branches in bcr-phylo simulator.py
-        print('    %s nodes after dummy branch addition and removal not the same as before:' % utils.color('red', 'error'))
-        print('       missing: %s' % ' '.join(initial_labels - final_labels))
-        print('       extra:   %s' % ' '.join(final_labels - initial_labels))
-        print('       tree:')
-        print(utils.pad_lines(get_ascii_tree(dendro_tree=dtree, width=400)))
-        assert False  # i think it's better to crash at this point, i think i have it working reliably
-
 # ----------------------------------------------------------------------------------------
 def get_aa_tree(dtree, annotation, extra_str=None, iclust=None, nuc_mutations=None, aa_mutations=None, quiet=False, debug=False):
     very_different_frac = 0.5
@@ -1607,8 +1505,9 @@ def calculate_lb_values(dtree, tau, metrics_to_calc=None, dont_normalize=False,
     multifo = None
     if annotation is not None:
         multifo = {}  # NOTE now that I'm always doing this, it might make sense to rearrange things a bit, but i don't want to look at it right now
+        uid_iseqs = {u : i for i, u in enumerate(annotation['unique_ids'])}
         for node in dtree.postorder_node_iter():
-            multifo[node.taxon.label] = utils.get_multiplicity(annotation, uid=node.taxon.label) if node.taxon.label in annotation['unique_ids'] else 1  # if it's not in there, it could be from wonky names from lonr.r, also could be from FastTree tree where we don't get inferred intermediate sequences
+            multifo[node.taxon.label] = utils.get_multiplicity(annotation, iseq=uid_iseqs[node.taxon.label]) if node.taxon.label in uid_iseqs else 1  # if it's not in there, it could be from wonky names from lonr.r, also could be from FastTree tree where we don't get inferred intermediate sequences
 
     treestr = dtree.as_string(schema='newick')  # get this before the dummy branch stuff to make more sure it isn't modified
     normstr = 'unnormalized' if dont_normalize else 'normalized'
@@ -3189,7 +3088,15 @@ def combine_selection_metrics(antn_pairs, fake_pntns, mpfo_lists, mtpys, plotdir
         if ttdbg:
             h_min, l_min = [min(local_hdist_aa(acseqs[i], mseq) for acseqs in all_chosen_seqs) for i, mseq in enumerate(mfseqs(mfo))]
             print('        %d %d %s' % (h_min, l_min, utils.color('red', 'x') if sum([h_min, l_min]) < hdist else ''))
-        return any(sum(local_hdist_aa(cseq, mseq) for mseq, cseq in zip(mfseqs(mfo), acseqs)) < hdist for acseqs in all_chosen_seqs)
+        total_dists = numpy.zeros(len(all_chosen_seqs), dtype=int)
+        for ich, mseq in enumerate(mfseqs(mfo)):  # for each chain, get the distances to all the chosen seqs at once
+            cseqs = [acseqs[ich] for acseqs in all_chosen_seqs]
+            chain_dists = numpy.array([max(len(cseq), len(mseq)) for cseq in cseqs])  # different-length seqs get the max length (as in local_hdist_aa())
+            same_len = [i for i, cseq in enumerate(cseqs) if len(cseq) == len(mseq)]
+            if len(same_len) > 0:
+                chain_dists[same_len] = utils.hamming_distance_matrix([mseq], [cseqs[i] for i in same_len], amino_acid=True)[0]
+            total_dists += chain_dists
+        return bool((total_dists < hdist).any())
     # ----------------------------------------------------------------------------------------
     def add_unobs_seq(stype, metric_pairs, chosen_mfos, all_chosen_seqs, imtp, tdbg=False):
         # get the consfo: first see if we observed the cons/naive seq (i.e. if there's any observed seqs with zero cdist)
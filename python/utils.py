@@ -19,6 +19,7 @@ from collections import OrderedDict
 import csv
 import subprocess
 import multiprocessing
+import threading
 import copy
 import traceback
 import json
@@ -27,7 +28,11 @@ import collections
 import operator
 import yaml
 import six
+from six.moves import queue
 import hashlib
+import gzip
+import bz2
+import io
 from io import open
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -780,6 +785,8 @@ minimal_linekeys = [r+'_gene' for r in regions] + [b+'_insertion' for b in bound
 implicit_linekeys = set(['naive_seq', 'cdr3_length', 'codon_positions', 'lengths', 'regional_bounds', 'invalid', 'indel_reversed_seqs'] + \
                         [r + '_gl_seq' for r in regions] + \
                         ['mut_freqs', 'n_mutations'] + functional_columns + [r + '_qr_seqs' for r in regions] + ['aligned_' + r + '_seqs' for r in regions])
+# subset of <implicit_linekeys> that only depend on the rearrangement event, and are added by add_germline_implicit_info()
+germline_implicit_linekeys = set(['lengths', 'codon_positions', 'cdr3_length', 'naive_seq', 'regional_bounds'] + [r + '_gl_seq' for r in regions])
 
 extra_annotation_headers = [  # you can specify additional columns (that you want written to csv) on the command line from among these choices (in addition to <annotation_headers>)
     'cdr3_seqs',
@@ -2361,10 +2368,32 @@ def print_cons_seq_dbg(seqfos, cons_seq, aa=False, align=False, tie_resolver_seq
         color_mutants(cons_seq, tie_resolver_seq, align=align, amino_acid=aa, print_result=True, only_print_seq=True, seq_label=' '*len(' consensus '),
                       post_str='    tie resolver%s'%('' if tie_resolver_label is None else (' (%s)'%tie_resolver_label)), extra_str=extra_str, print_n_snps=True)
 
+# ----------------------------------------------------------------------------------------
+# count (weighted by multiplicity) each chunk (base/aa/codon, depending on alphabet and <codon_len>) at each chunk position in <aligned_seqfos>, skipping chunks with any gap chars
+# returns sorted list of observed chunks, and (weighted, unweighted) count matrices of shape (n chunks, n positions)
+def get_chunk_counts(aligned_seqfos, codon_len=1):
+    assert codon_len <= 7  # we pack each chunk into one 64 bit int
+    seq_len = get_single_entry(list(set([len(s['seq']) for s in aligned_seqfos])))
+    n_pos = int(math.ceil(seq_len / float(codon_len)))
+    padstr = '\0' * (n_pos * codon_len - seq_len)  # pad any partial chunk at the end with a char that sorts before everything else (so e.g. 'AC' still sorts before 'ACG')
+    seq_arr = numpy.frombuffer(''.join(s['seq'] + padstr for s in aligned_seqfos).encode('latin-1'), dtype=numpy.uint8).reshape(len(aligned_seqfos), n_pos, codon_len)
+    codes = numpy.zeros((len(aligned_seqfos), n_pos), dtype=numpy.int64)
+    for ichar in range(codon_len):
+        codes = codes * 256 + seq_arr[:, :, ichar]
+    not_gap = ~numpy.isin(seq_arr, [ord(g) for g in gap_chars]).any(axis=2)
+    weights = numpy.array([sfo['multiplicity'] if 'multiplicity' in sfo else 1 for sfo in aligned_seqfos], dtype=float)
+    iseqs, iposs = numpy.nonzero(not_gap)
+    uniq_codes, ichunks = numpy.unique(codes[iseqs, iposs], return_inverse=True)
+    flat_indices = ichunks.reshape(-1) * n_pos + iposs
+    wcounts = numpy.bincount(flat_indices, weights=weights[iseqs], minlength=len(uniq_codes) * n_pos).reshape(len(uniq_codes), n_pos)
+    ocounts = numpy.bincount(flat_indices, minlength=len(uniq_codes) * n_pos).reshape(len(uniq_codes), n_pos)
+    chunks = [bytes(bytearray((int(c) >> (8 * (codon_len - 1 - i))) & 255 for i in range(codon_len))).decode('latin-1').rstrip('\0') for c in uniq_codes]
+    return chunks, wcounts, ocounts
+
 # ----------------------------------------------------------------------------------------
 # return consensus of either aligned or unaligned sequences, in chunks of length <codon_len>, with tied positions *not* ambiguous but instead chosen as the alphabetically first character[s]
 # if doing a nuc cons seq with codon_len=3, and <aa_ref_seq> is set, we look for the most common nuc codon *only* among those that code for the aa that appears at that position in <aa_ref_seq>
-def cons_seq(aligned_seqfos=None, unaligned_seqfos=None, aa=False, codon_len=1, aa_ref_seq=None, extra_str='', debug=False):  # should maybe call it "chunk" rather than "codon", but if len is 3 it's a codon
+def cons_seq(aligned_seqfos=None, unaligned_seqfos=None, aa=False, codon_len=1, aa_ref_seq=None, return_freqs=False, extra_str='', debug=False):  # should maybe call it "chunk" rather than "codon", but if len is 3 it's a codon
     if aligned_seqfos is not None:
         assert unaligned_seqfos is None
         seqfos = aligned_seqfos
@@ -2388,40 +2417,29 @@ def cons_seq(aligned_seqfos=None, unaligned_seqfos=None, aa=False, codon_len=1,
 
     if debug:
         print('%staking consensus of %d seqs with len %d in chunks of len %d' % (extra_str, len(seqfos), seq_len, codon_len))
+    chunks, wcounts, ocounts = get_chunk_counts(seqfos, codon_len=codon_len)  # if there's a partial codon at the end, it'll just stay as partial here, which seems fine (we could pad with pad_nuc_seq() if we wanted)
+    allowed = ocounts > 0  # chunks that we observed at each position (i.e. candidates for the cons seq)
+    if aa_ref_seq is not None:  # (try to) remove any that don't code for the residue in aa_ref_seq
+        chunk_aas = numpy.array([ltranslate(c) for c in chunks], dtype=object)
+        aa_match = allowed & (chunk_aas[:, None] == numpy.array(list(aa_ref_seq[ : wcounts.shape[1]]), dtype=object)[None, :])
+        any_match = aa_match.any(axis=0)  # if none match, we just have to keep all of them (this should be rare)
+        removed = allowed & ~aa_match & any_match[None, :]
+        allowed = numpy.where(any_match[None, :], aa_match, allowed)
+    masked_counts = numpy.where(allowed, wcounts, -numpy.inf)
+    ibests = numpy.argmax(masked_counts, axis=0) if len(chunks) > 0 else numpy.zeros(wcounts.shape[1], dtype=int)  # <chunks> is sorted, so if there's more than one tied for most this takes the first one alphabetically (arbitrary, but at least repeatable)
+    observed = allowed.any(axis=0)
+    cseq = [chunks[ib] if obs else gap_chars[0] for ib, obs in zip(ibests, observed)]  # gap char if every sequence has a gap char here
+
+    if debug:
+        def cval(val): return int(val) if val == int(val) else val
         dbgfo = []
-        all_counts = {}  # keep track of usage of each codon/base/aa over full sequence for sorting of dbg info at end
-    cseq = []
-    for ipos in range(0, seq_len, codon_len):
-        pos_counts = {}
-        for sfo in seqfos:
-            mtpy = sfo['multiplicity'] if 'multiplicity' in sfo else 1
-            chnk = sfo['seq'][ipos : ipos + codon_len]  # if there's a partial codon at the end, it'll just stay as partial here, which seems fine (we could pad with pad_nuc_seq() if we wanted)
-            if any(g in chnk for g in gap_chars):  # ok i probably shouldn't just skip them, but whatever
-                continue
-            if chnk not in pos_counts:
-                pos_counts[chnk] = 0
-            pos_counts[chnk] += mtpy
-            if debug:
-                if chnk not in all_counts:
-                    all_counts[chnk] = 0
-                all_counts[chnk] += mtpy
-        if len(pos_counts) == 0:  # every sequence has a gap char here
-            cseq.append(gap_chars[0])
-            continue
-        srt_chunks = sorted(list(pos_counts.items()), key=operator.itemgetter(1), reverse=True)
-        if aa_ref_seq is not None:  # (try to) remove any that don't code for the residue in aa_ref_seq
-            aa_match_chunks = [c for c, _ in srt_chunks if ltranslate(c) == aa_ref_seq[ipos // 3]]
-            if debug > 1: removed_chunks = []  # arg
-            if len(aa_match_chunks) > 0:  # if none match, we just have to keep all of them (this should be rare)
-                if debug > 1:
-                    removed_chunks = [c for c, _ in srt_chunks if c not in aa_match_chunks]
-                srt_chunks = [(c, n) for c, n in srt_chunks if c in aa_match_chunks]
-        n_max = srt_chunks[0][1]
-        best_chunks = [c for c, n in srt_chunks if n == n_max]
-        if debug:
-            # print '      %3d  %s  %s' % (ipos, '  '.join('%s %d'%(color('red' if c in best_chunks and len(best_chunks) > 1 else None, c), n) for c, n in srt_chunks), '(removed %s)'%' '.join(removed_chunks) if aa_ref_seq is not None and debug>1 and len(removed_chunks)>0 else '')
-            dbgfo.append({'best' : best_chunks, 'cnts' : pos_counts, 'rmd' : removed_chunks if aa_ref_seq is not None and debug>1 else []})
-        cseq.append(sorted(best_chunks)[0])  # if there's more than one tied for most, take the first sorted alphabetically (arbitrary, but at least repeatable)
+        for ipos in range(wcounts.shape[1]):
+            n_max = masked_counts[ibests[ipos], ipos]
+            dbgfo.append({'best' : [chunks[i] for i in numpy.flatnonzero(allowed[:, ipos] & (masked_counts[:, ipos] == n_max))] if observed[ipos] else [],
+                          'cnts' : {chunks[i] : cval(wcounts[i, ipos]) for i in numpy.flatnonzero(ocounts[:, ipos] > 0)},
+                          'rmd' : [chunks[i] for i in numpy.flatnonzero(removed[:, ipos])] if aa_ref_seq is not None and debug > 1 else []})
+        chunk_totals = {chunks[i] : cval(wcounts[i].sum()) for i in range(len(chunks))}  # usage of each codon/base/aa over full sequence, for sorting of dbg info at end
+        all_counts = OrderedDict((c, chunk_totals[c]) for c in OrderedDict.fromkeys(sfo['seq'][ipos : ipos + codon_len] for ipos in range(0, seq_len, codon_len) for sfo in seqfos) if c in chunk_totals)  # (in order of first appearance, so ties are printed in the same order as always)
 
     if debug:
         prlen = max(4, codon_len) if debug > 1 else codon_len
@@ -2441,6 +2459,11 @@ def cons_seq(aligned_seqfos=None, unaligned_seqfos=None, aa=False, codon_len=1,
     if debug:
         print_cons_seq_dbg(seqfos, cseq, aa=aa, align=aligned_seqfos is None, extra_str='  '+extra_str, dont_print_cons_seq=True)
 
+    if return_freqs:  # also return per-position (weighted) frequencies of each observed chunk, as a list of {chunk : freq} (empty dict for all-gap positions)
+        totals = wcounts.sum(axis=0)
+        freqs = [{chunks[i] : wcounts[i, ipos] / totals[ipos] for i in numpy.flatnonzero(ocounts[:, ipos] > 0)} if totals[ipos] > 0 else {} for ipos in range(wcounts.shape[1])]
+        return cseq, freqs
+
     return cseq
 
 # ----------------------------------------------------------------------------------------
@@ -3317,21 +3340,8 @@ def check_per_seq_lengths(line, bkey='unique_ids'):  # maybe there's something l
             raise Exception('per seq line keys \'%s\' %d and \'%s\' %d not the same length' % (bkey, blen, tkey, len(line[tkey])))
 
 # ----------------------------------------------------------------------------------------
-def add_implicit_info(glfo, line, aligned_gl_seqs=None, check_line_keys=False, reset_indel_genes=False):  # should turn on <check_line_keys> for a bit if you change anything
-    from . import indelutils
+def add_germline_implicit_info(glfo, line):  # add the implicit info that only depends on the rearrangement event (i.e. not on the mature sequences, apart from checking their length) [i.e. <germline_implicit_linekeys>]
     from . import glutils
-    """ Add to <line> a bunch of things that are initially only implicit. """
-    if line['v_gene'] == '':
-        raise Exception('can\'t add implicit info to line with failed annotation:\n%s' % (''.join(['  %+20s  %s\n' % (k, v) for k, v in line.items()])))
-
-    if check_line_keys:
-        initial_keys = set(line)
-        # first make sure there aren't any unauthorized keys
-        if len(initial_keys - all_linekeys) > 0:
-            raise Exception('unexpected keys: \'%s\'' % '\' \''.join(initial_keys - all_linekeys))
-        # then keep track of the keys we got to start with
-        pre_existing_implicit_info = {ek : copy.deepcopy(line[ek]) for ek in implicit_linekeys if ek in line}
-
     for region in regions:  # backwards compatibility with old simulation files should be removed when you're no longer running on them
         if line[region + '_gene'] not in glfo['seqs'][region]:
             alternate_name = glutils.convert_to_duplicate_name(glfo, line[region + '_gene'])
@@ -3378,6 +3388,24 @@ def add_implicit_info(glfo, line, aligned_gl_seqs=None, check_line_keys=False, r
     end['j'] = start['j'] + len(line['j_gl_seq'])
     line['regional_bounds'] = {r : (start[r], end[r]) for r in regions}
 
+# ----------------------------------------------------------------------------------------
+def add_implicit_info(glfo, line, aligned_gl_seqs=None, check_line_keys=False, reset_indel_genes=False):  # should turn on <check_line_keys> for a bit if you change anything
+    from . import indelutils
+    """ Add to <line> a bunch of things that are initially only implicit. """
+    if line['v_gene'] == '':
+        raise Exception('can\'t add implicit info to line with failed annotation:\n%s' % (''.join(['  %+20s  %s\n' % (k, v) for k, v in line.items()])))
+
+    if check_line_keys:
+        initial_keys = set(line)
+        # first make sure there aren't any unauthorized keys
+        if len(initial_keys - all_linekeys) > 0:
+            raise Exception('unexpected keys: \'%s\'' % '\' \''.join(initial_keys - all_linekeys))
+        # then keep track of the keys we got to start with
+        pre_existing_implicit_info = {ek : copy.deepcopy(line[ek]) for ek in implicit_linekeys if ek in line}
+
+    add_germline_implicit_info(glfo, line)
+    start, end = {r : line['regional_bounds'][r][0] for r in regions}, {r : line['regional_bounds'][r][1] for r in regions}
+
     try:
         indelutils.deal_with_indel_stuff(line, reset_indel_genes=reset_indel_genes)
     except indelutils.IndelfoReconstructionError:  # I don't like this here, but see note in the one place it can be raised
@@ -3393,9 +3421,9 @@ def add_implicit_info(glfo, line, aligned_gl_seqs=None, check_line_keys=False, r
 
     add_functional_info(glfo['locus'], line, input_codon_positions)
 
-    hfracfo = [hamming_fraction(line['naive_seq'], mature_seq, also_return_distance=True) for mature_seq in line['seqs']]
-    line['mut_freqs'] = [hfrac for hfrac, _ in hfracfo]
-    line['n_mutations'] = [n_mutations for _, n_mutations in hfracfo]
+    hfracs, hdists = hamming_fraction_matrix([line['naive_seq']], line['seqs'], also_return_distance=True)
+    line['mut_freqs'] = hfracs[0].tolist()  # tolist() converts to python types
+    line['n_mutations'] = hdists[0].tolist()
 
     # set validity (alignment addition [below] can also set invalid)  # it would be nice to clean up this checking stuff
     line['invalid'] = False
@@ -3432,6 +3460,106 @@ def add_implicit_info(glfo, line, aligned_gl_seqs=None, check_line_keys=False, r
             else:
                 assert ikey in new_keys  # only really checks the logic of the previous few lines
 
+# ----------------------------------------------------------------------------------------
+class LazyAnnotation(dict):  # annotation <line> that waits to add its implicit info until somebody asks for an implicit key, so e.g. reading lots of annotations of which you only need a few keys is fast
+    # NOTE the info comes from the same add_implicit_info() [or, if only germline keys are asked for, add_germline_implicit_info()] that we'd otherwise call right after reading, but:
+    #   - we add all of it as soon as anybody modifies, iterates over, or copies the line (so they see the same thing as with the regular, eager, adding)
+    #   - any exceptions from adding the info happen on first access, rather than during reading
+    #   - in-place modification of a non-implicit value (e.g. line['seqs'][0] = ...) won't trigger adding the implicit info first
+    #   - copying or pickling gives you a regular dict
+    #   - implicit keys that were already in the line (e.g. 'naive_seq' from a yaml output file) are returned as they are, rather than being recalculated
+    def __init__(self, line, glfo, aligned_gl_seqs=None, reset_indel_genes=False):
+        dict.__init__(self, line)
+        self.implicit_kwargs = {'aligned_gl_seqs' : aligned_gl_seqs, 'reset_indel_genes' : reset_indel_genes}
+        self.glfo = glfo  # set to None once we've added all the implicit info
+        self.added_germline_info = False
+
+    # ----------------------------------------------------------------------------------------
+    def add_info(self, key=None):  # if <key> is set, only add what we need for <key>
+        if self.glfo is None or (key is not None and key not in implicit_linekeys):
+            return
+        glfo = self.glfo
+        self.glfo = None  # have to unset it before calling the add fcns, since otherwise they'll end up calling this fcn when they set keys
+        if key in germline_implicit_linekeys:
+            if not self.added_germline_info:
+                add_germline_implicit_info(glfo, self)
+                self.added_germline_info = True
+            self.glfo = glfo
+        else:
+            add_implicit_info(glfo, self, **self.implicit_kwargs)
+
+    # ----------------------------------------------------------------------------------------
+    def __missing__(self, key):  # only called by dict.__getitem__(), i.e. if <key> isn't already there
+        self.add_info(key)
+        if not dict.__contains__(self, key):
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self.add_info(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        if not dict.__contains__(self, key):
+            self.add_info(key)
+        return dict.__contains__(self, key)
+
+    def __reduce__(self):  # for copy, deepcopy, and pickle
+        self.add_info()
+        return (dict, (dict(self), ))
+
+    # ----------------------------------------------------------------------------------------
+    # anything else that needs the whole line adds all the implicit info first
+    def keys(self):
+        self.add_info()
+        return dict.keys(self)
+    def values(self):
+        self.add_info()
+        return dict.values(self)
+    def items(self):
+        self.add_info()
+        return dict.items(self)
+    def __iter__(self):
+        self.add_info()
+        return dict.__iter__(self)
+    def __len__(self):
+        self.add_info()
+        return dict.__len__(self)
+    def __repr__(self):
+        self.add_info()
+        return dict.__repr__(self)
+    def __eq__(self, other):
+        self.add_info()
+        return dict.__eq__(self, other)
+    def __ne__(self, other):
+        self.add_info()
+        return dict.__ne__(self, other)
+    def copy(self):
+        self.add_info()
+        return dict(self)
+    def __setitem__(self, key, val):
+        self.add_info()
+        dict.__setitem__(self, key, val)
+    def __delitem__(self, key):
+        self.add_info()
+        dict.__delitem__(self, key)
+    def pop(self, *args):
+        self.add_info()
+        return dict.pop(self, *args)
+    def popitem(self):
+        self.add_info()
+        return dict.popitem(self)
+    def setdefault(self, key, default=None):
+        self.add_info()
+        return dict.setdefault(self, key, default)
+    def update(self, *args, **kwargs):
+        self.add_info()
+        dict.update(self, *args, **kwargs)
+    def clear(self):
+        self.add_info()
+        dict.clear(self)
+
 # ----------------------------------------------------------------------------------------
 def restrict_to_iseqs(line, iseqs_to_keep, glfo, sw_info=None, remove_tree=False):  # could have called it subset_seqs_in_line, or at least i always seem to search for that when i'm trying to find this (or subset_iseqs or subset_to_iseqs)
     # NOTE if you want to return a new one rather than modifying <line>, call get_non_implicit_copy() on <line> as you pass it in
@@ -3746,15 +3874,14 @@ def separate_into_snp_groups(glfo, region, n_max_snps, genelist=None, debug=Fals
     return snp_groups  # NOTE this is a list of lists of dicts, whereas separate_into_allelic_groups() returns a dict of region-keyed dicts
 
 # ----------------------------------------------------------------------------------------
-def read_single_gene_count(indir, gene, expect_zero_counts=False, debug=False):
+def read_single_gene_count(indir, gene, expect_zero_counts=False, ptables=None, debug=False):  # <ptables>: paramutils.ParameterTables for <indir> (by default we use the one that's shared by everybody in this process)
+    from . import paramutils
     region = get_region(gene)
     count = 0
-    with open(indir + '/' + region + '_gene-probs.csv', 'r') as infile:  # NOTE this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
-        reader = csv.DictReader(infile)
-        for line in reader:
-            if line[region + '_gene'] == gene:
-                count = int(line['count'])
-                break
+    for line in paramutils.read_csv_rows(indir, region + '_gene-probs.csv', ptables=ptables):  # NOTE this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
+        if line[region + '_gene'] == gene:
+            count = int(line['count'])
+            break
 
     if count == 0 and not expect_zero_counts:
         print('          %s %s not found in %s_gene-probs.csv, returning zero' % (color('red', 'warning'), gene, region))
@@ -3765,24 +3892,23 @@ def read_single_gene_count(indir, gene, expect_zero_counts=False, debug=False):
     return count
 
 # ----------------------------------------------------------------------------------------
-def read_overall_gene_probs(indir, only_gene=None, normalize=True, expect_zero_counts=False, debug=False):
+def read_overall_gene_probs(indir, only_gene=None, normalize=True, expect_zero_counts=False, ptables=None, debug=False):
     """
     Return the observed counts/probabilities of choosing each gene version.
     If <normalize> then return probabilities
     If <only_gene> is specified, just return the prob/count for that gene  NOTE but don't forget read_single_gene_count() above ^, which I think probably does the same thing
     """
+    from . import paramutils
     counts, probs = {r : {} for r in regions}, {r : {} for r in regions}
     for region in regions:
         total = 0
-        with open(indir + '/' + region + '_gene-probs.csv', 'r') as infile:  # NOTE this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
-            reader = csv.DictReader(infile)
-            for line in reader:
-                line_count = int(line['count'])
-                gene = line[region + '_gene']
-                total += line_count
-                if gene not in counts[region]:
-                    counts[region][gene] = 0
-                counts[region][gene] += line_count
+        for line in paramutils.read_csv_rows(indir, region + '_gene-probs.csv', ptables=ptables):  # NOTE this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
+            line_count = int(line['count'])
+            gene = line[region + '_gene']
+            total += line_count
+            if gene not in counts[region]:
+                counts[region][gene] = 0
+            counts[region][gene] += line_count
         if total < 1:
             raise Exception('less than one count in %s' % indir + '/' + region + '_gene-probs.csv')
         for gene in counts[region]:
@@ -3839,18 +3965,17 @@ def find_replacement_genes(param_dir, min_counts, gene_name=None, debug=False, a
     lists['allele'] = []  # list of genes that are alleles of <gene_name>
     lists['primary_version'] = []  # same primary version as <gene_name>
     lists['all'] = []  # give up and return everything
-    with open(param_dir + '/' + region + '_gene-probs.csv', 'r') as infile:  # NOTE note this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
-        reader = csv.DictReader(infile)
-        for line in reader:
-            gene = line[region + '_gene']
-            count = int(line['count'])
-            vals = {'gene':gene, 'count':count}
-            if all_from_region == '':
-                if are_alleles(gene, gene_name):
-                    lists['allele'].append(vals)
-                if are_same_primary_version(gene, gene_name):
-                    lists['primary_version'].append(vals)
-            lists['all'].append(vals)
+    from . import paramutils
+    for line in paramutils.read_csv_rows(param_dir, region + '_gene-probs.csv'):  # NOTE note this ignores correlations... which I think is actually ok, but it wouldn't hurt to think through it again at some point
+        gene = line[region + '_gene']
+        count = int(line['count'])
+        vals = {'gene':gene, 'count':count}
+        if all_from_region == '':
+            if are_alleles(gene, gene_name):
+                lists['allele'].append(vals)
+            if are_same_primary_version(gene, gene_name):
+                lists['primary_version'].append(vals)
+        lists['all'].append(vals)
 
     if all_from_region != '':
         return [vals['gene'] for vals in lists['all']]
@@ -3925,6 +4050,48 @@ def hamming_fraction(seq1, seq2, extra_bases=None, also_return_distance=False, a
     else:
         return fraction
 
+# ----------------------------------------------------------------------------------------
+def get_char_table(chars):  # boolean lookup table (indexed by ascii code) that's True for the characters in <chars>
+    ctable = numpy.zeros(256, dtype=bool)
+    ctable[[ord(c) for c in chars]] = True
+    return ctable
+hamming_skip_tables = {False : get_char_table(all_ambiguous_bases + gap_chars), True : get_char_table(ambiguous_amino_acids + gap_chars)}  # characters that hamming_distance() skips (keyed by <amino_acid>)
+
+# ----------------------------------------------------------------------------------------
+def encode_seqs(seqs, amino_acid=False):  # encode equal-length <seqs> as a uint8 array with one row per seq, and also return a boolean array that's True at non-ambiguous/non-gap positions (i.e. the ones hamming_distance() counts)
+    if len(seqs) > 0 and any(len(s) != len(seqs[0]) for s in seqs):
+        raise Exception('unequal length sequences (%s) in encode_seqs()' % ' '.join(str(l) for l in sorted(set(len(s) for s in seqs))))
+    seq_array = numpy.frombuffer(''.join(seqs).encode('ascii'), dtype=numpy.uint8).reshape(len(seqs), len(seqs[0]) if len(seqs) > 0 else 0)
+    return seq_array, ~hamming_skip_tables[amino_acid][seq_array]
+
+# ----------------------------------------------------------------------------------------
+def hamming_distance_matrix(seqs1, seqs2=None, amino_acid=False, return_len_excluding_ambig=False):  # matrix of hamming_distance() between each seq in <seqs1> and each in <seqs2> (or among <seqs1>, if <seqs2> is None). For one-vs-many, pass a length-one list for <seqs1>
+    # for each (non-ambiguous) character, the number of positions at which two seqs both have that character is a dot product of one-hot vectors, so we get all the matches with a few matrix multiplications
+    array1, ok1 = encode_seqs(seqs1, amino_acid=amino_acid)
+    array2, ok2 = (array1, ok1) if seqs2 is None else encode_seqs(seqs2, amino_acid=amino_acid)
+    if array1.shape[1] != array2.shape[1]:
+        raise Exception('unequal length sequences (%d vs %d) in hamming distance matrix' % (array1.shape[1], array2.shape[1]))
+    ftype = numpy.float32  # exact for counts below 2^24, and a lot faster than float64 for the matrix multiplication
+    lengths = numpy.dot(ok1.astype(ftype), ok2.T.astype(ftype))  # number of positions at which neither seq is ambiguous
+    n_matches = numpy.zeros(lengths.shape, dtype=ftype)
+    for char in numpy.union1d(array1[ok1], array2[ok2]):
+        n_matches += numpy.dot((array1 == char).astype(ftype), (array2 == char).T.astype(ftype))
+    distances = numpy.rint(lengths - n_matches).astype(numpy.int64)
+    if return_len_excluding_ambig:
+        return distances, numpy.rint(lengths).astype(numpy.int64)
+    else:
+        return distances
+
+# ----------------------------------------------------------------------------------------
+def hamming_fraction_matrix(seqs1, seqs2=None, amino_acid=False, also_return_distance=False):  # matrix version of hamming_fraction() (see hamming_distance_matrix())
+    distances, lengths = hamming_distance_matrix(seqs1, seqs2=seqs2, amino_acid=amino_acid, return_len_excluding_ambig=True)
+    fractions = numpy.zeros(distances.shape)
+    numpy.divide(distances, lengths, out=fractions, where=lengths > 0)
+    if also_return_distance:
+        return fractions, distances
+    else:
+        return fractions
+
 # ----------------------------------------------------------------------------------------
 def get_mut_positions(line):
     hdistfo = [hamming_distance(line['naive_seq'], mature_seq, return_mutated_positions=True) for mature_seq in line['seqs']]
@@ -3949,13 +4116,13 @@ def get_mut_codes(naive_seq, obs_seq, amino_acid=False, debug=False):  # return
 def mean_pairwise_hfrac(seqlist, amino_acid=False):
     if len(seqlist) < 2:
         return 0.
-    return numpy.mean([hamming_fraction(s1, s2, amino_acid=amino_acid) for s1, s2 in itertools.combinations(seqlist, 2)])
+    return numpy.mean(hamming_fraction_matrix(seqlist, amino_acid=amino_acid)[numpy.triu_indices(len(seqlist), k=1)])  # upper triangle is in the same order as itertools.combinations()
 
 # ----------------------------------------------------------------------------------------
 def mean_pairwise_hdist(seqlist, amino_acid=False):
     if len(seqlist) < 2:
         return 0.
-    return numpy.mean([hamming_distance(s1, s2, amino_acid=amino_acid) for s1, s2 in itertools.combinations(seqlist, 2)])
+    return numpy.mean(hamming_distance_matrix(seqlist, amino_acid=amino_acid)[numpy.triu_indices(len(seqlist), k=1)])
 
 # ----------------------------------------------------------------------------------------
 def lev_dist(s1, s2, aa=False):  # NOTE does *not* handle ambiguous characters correctly (also NOTE <aa> has no effect
@@ -5078,14 +5245,40 @@ cmdfo_defaults = {  # None means by default it's absent
     'threads' : None,  # slurm cpus per task
 }
 
+# ----------------------------------------------------------------------------------------
+def start_proc_waiter(iproc, proc, done_queue):  # start a (daemon) thread that blocks until <proc> exits, then puts <iproc> on <done_queue> (so the caller finds out as soon as any of its procs finishes, without having to poll them)
+    def waitfcn():
+        proc.wait()
+        done_queue.put(iproc)
+    wthread = threading.Thread(target=waitfcn)
+    wthread.daemon = True
+    wthread.start()
+
 # ----------------------------------------------------------------------------------------
 # notes:
-#  - set sleep to False if your commands are going to run really really really quickly
+#  - set sleep to False if your commands are going to run really really really quickly (it only staggers the initial launches, we never sleep while waiting for procs to finish)
 #  - unlike everywhere else, <debug> is not a boolean, and is either None (swallow out, print err)), 'print' (print out and err), 'write' (write out and err to file called 'log' in logdir), or 'write:<log file name>' (same as 'write', but you set your own base name)
-#  - if both <n_max_procs> and <proc_limit_str> are set, it uses limit_procs() (i.e. a ps call) to count the total number of <proc_limit_str> running on the machine; whereas if only <n_max_procs> is set, it counts only subprocesses that it is itself running
+#  - if both <n_max_procs> and <proc_limit_str> are set, it uses limit_procs() (i.e. a ps call) to count the total number of <proc_limit_str> running on the machine; whereas if only <n_max_procs> is set, at most <n_max_procs> of <cmdfos> are run at once, with the rest queued until a slot opens up
 #  - debug: can be None (stdout mostly gets ignored), 'print' (printed), 'write' (written to file 'log' in logdir), or 'write:<logfname>' (same, but use <logfname>)
 def run_cmds(cmdfos, shell=False, n_max_tries=None, clean_on_success=False, batch_system=None, batch_options=None, batch_config_fname=None,
              debug=None, ignore_stderr=False, sleep=True, n_max_procs=None, proc_limit_str=None, allow_failure=False):
+    # ----------------------------------------------------------------------------------------
+    def launch(iproc):
+        procs[iproc] = run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)
+        n_tries_list[iproc] += 1
+        start_proc_waiter(iproc, procs[iproc], done_queue)
+    # ----------------------------------------------------------------------------------------
+    def launch_queued():  # start as many queued procs as we have slots for
+        n_started = 0
+        while len(queued_procs) > 0 and n_running + n_started < n_slots:
+            launch(queued_procs.popleft())
+            n_started += 1
+            if sleep:
+                time.sleep(per_proc_sleep_time)
+            if n_max_procs is not None and proc_limit_str is not None:
+                limit_procs(proc_limit_str, n_max_procs)  # machine-wide limit (counting procs with <proc_limit_str> in ps)
+        return n_started
+    # ----------------------------------------------------------------------------------------
     if len(cmdfos) == 0:
         raise Exception('zero length cmdfos')
     if n_max_tries is None:
@@ -5105,29 +5298,24 @@ def run_cmds(cmdfos, shell=False, n_max_tries=None, clean_on_success=False, batc
     if batch_system == 'slurm' and batch_config_fname is not None:
         set_slurm_nodelist(cmdfos, batch_config_fname)
 
-    procs, n_tries_list = [], []
-    for iproc in range(len(cmdfos)):
-        procs += [run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)]
-        n_tries_list.append(1)
-        if sleep:
-            time.sleep(per_proc_sleep_time)
-        if n_max_procs is not None:
-            limit_procs(proc_limit_str, n_max_procs, procs=procs)  # NOTE now that I've added the <procs> arg, I should remove all the places where I'm using the old cmd str method (I mean, it works fine, but it's hackier/laggier, and in cases where several different parent procs are running a log of the same-named subprocs on the same machine, the old way will be wrong [i.e. limit_procs was originally intended as a global machine-wide limit, whereas in this fcn we usually call it wanting to set a specific number of subproces for this process])
+    n_slots = len(cmdfos) if n_max_procs is None or proc_limit_str is not None else n_max_procs  # max number of our procs to have running at once
+    procs, n_tries_list = [None for _ in cmdfos], [0 for _ in cmdfos]  # each proc gets set to None when it finishes
+    queued_procs = collections.deque(range(len(cmdfos)))  # indices of procs that haven't been started yet
+    done_queue = queue.Queue()  # indices of procs that have exited, filled by the waiter threads
+    n_running = 0
+    n_running += launch_queued()
 
     dbgstrs = ['' for _ in procs]
-    while procs.count(None) != len(procs):  # we set each proc to None when it finishes
-        for iproc in range(len(cmdfos)):
-            if procs[iproc] is None:  # already finished
-                continue
-            if procs[iproc].poll() is not None:  # it just finished
-                status, dbgstrs[iproc] = finish_process(iproc, procs, n_tries_list[iproc], cmdfos[iproc], n_max_tries, dbgfo=cmdfos[iproc].get('dbgfo'), batch_system=batch_system, debug=debug, ignore_stderr=ignore_stderr, clean_on_success=clean_on_success, allow_failure=allow_failure)
-                if status == 'restart':
-                    print(dbgstrs[iproc])
-                    procs[iproc] = run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)
-                    n_tries_list[iproc] += 1
+    while n_running > 0:
+        iproc = done_queue.get()  # blocks until one of the procs exits
+        status, dbgstrs[iproc] = finish_process(iproc, procs, n_tries_list[iproc], cmdfos[iproc], n_max_tries, dbgfo=cmdfos[iproc].get('dbgfo'), batch_system=batch_system, debug=debug, ignore_stderr=ignore_stderr, clean_on_success=clean_on_success, allow_failure=allow_failure)
+        if status == 'restart':  # it keeps its slot
+            print(dbgstrs[iproc])
+            launch(iproc)
+        else:
+            n_running -= 1
+            n_running += launch_queued()
         sys.stdout.flush()
-        if sleep:
-            time.sleep(per_proc_sleep_time)
     for dstr in dbgstrs:
         if dstr != '':
             print(dstr)
@@ -5553,6 +5741,17 @@ def build_dummy_reco_info(true_partition):
     chashes = {tkey(tc) : uidhashstr(tkey(tc)) for tc in true_partition}
     return {u : {'reco_id' : chashes[tkey(tc)]} for tc in true_partition for u in tc}
 
+# ----------------------------------------------------------------------------------------
+def partition_contingency_table(partition_a, partition_b):  # sparse contingency table between two partitions: {ia : {ib : n}}, where n is the number of (distinct) uids in both the ia-th cluster of <partition_a> and the ib-th cluster of <partition_b> (only includes nonzero entries, so it's O(number of uids) to build)
+    clids_b = get_cluster_ids(ptn_ids(partition_b), partition_b)
+    ctable = {}
+    for ia, clust_a in enumerate(partition_a):
+        ctable[ia] = {}
+        for uid in set(clust_a):
+            for ib in clids_b.get(uid, []):
+                ctable[ia][ib] = ctable[ia].get(ib, 0) + 1
+    return ctable
+
 # ----------------------------------------------------------------------------------------
 def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None, seed_unique_id=None, dbg_str='', inf_label='inferred', true_label='true', debug=False):
     if seed_unique_id is None:
@@ -5563,21 +5762,16 @@ def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None,
     uids = set([uid for cluster in partition for uid in cluster])
     clids = get_cluster_ids(uids, partition)  # map of {uid : (index of cluster in <partition> in which that uid occurs)} (well, list of indices, in case there's duplicates)
 
-    def get_clonal_fraction(uid, inferred_cluster):
-        """ Return the fraction of seqs in <uid>'s inferred cluster which are really clonal. """
-        n_clonal = 0
-        for tmpid in inferred_cluster:  # NOTE this includes the case where tmpid equal to uid
-            if reco_ids[tmpid] == reco_ids[uid]:
-                n_clonal += 1
-        return float(n_clonal) / len(inferred_cluster)
-
-    def get_fraction_present(inferred_cluster, true_cluster):
-        """ Return the fraction of the true clonemates in <true_cluster> that appear in <inferred_cluster>. """
-        return len(set(inferred_cluster) & set(true_cluster)) / float(len(true_cluster))
+    clonal_counts = {}  # contingency table between inferred clusters and reco ids, i.e. number of uids in each inferred cluster with each reco id (NOTE counts duplicates within a cluster)
+    for iclust, cluster in enumerate(partition):
+        for uid in cluster:
+            tkey = (iclust, reco_ids[uid])
+            clonal_counts[tkey] = clonal_counts.get(tkey, 0) + 1
+    overlaps = partition_contingency_table(partition, true_partition)  # number of uids shared by each inferred and true cluster
 
     mean_clonal_fraction, mean_fraction_present = 0., 0.
     n_uids = 0
-    for true_cluster in true_partition:
+    for itrue, true_cluster in enumerate(true_partition):
         if seed_unique_id is not None and seed_unique_id not in true_cluster:
             continue
         for uid in true_cluster:
@@ -5587,9 +5781,9 @@ def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None,
                 if debug:
                     print('  %s found %s in multiple clusters while calculating ccfs (returning None, None)' % (color('red', 'warning'), uid))
                 return None, None
-            inferred_cluster = partition[clids[uid][0]]  # we only look at the first cluster in which it appears
-            mean_clonal_fraction += get_clonal_fraction(uid, inferred_cluster)
-            mean_fraction_present += get_fraction_present(inferred_cluster, true_cluster)
+            iclust = clids[uid][0]  # we only look at the first cluster in which it appears
+            mean_clonal_fraction += float(clonal_counts[(iclust, reco_ids[uid])]) / len(partition[iclust])  # fraction of seqs in <uid>'s inferred cluster which are really clonal (including <uid>)
+            mean_fraction_present += overlaps[iclust].get(itrue, 0) / float(len(true_cluster))  # fraction of the true clonemates in <true_cluster> that appear in <uid>'s inferred cluster
             n_uids += 1
 
     if n_uids > 1e6:
@@ -5673,19 +5867,14 @@ def pairwise_cluster_metrics(mtstr, inf_ptn, tru_ptn, debug=False):
     # inf_ptn, tru_ptn = [['a'], ['b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n']], [['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n']]
     check_intersection_and_complement(inf_ptn, tru_ptn, a_label='true', b_label='inferred')
     if mtstr == 'pairwise':
-        tp, fp, fn, n_tot = 0, 0, 0, 0
+        def n_pairs(n): return n * (n - 1) // 2
         tru_ids, inf_ids = [id_dict(ptn) for ptn in [tru_ptn, inf_ptn]]
-        for u1, u2 in itertools.combinations(set(u for c in tru_ptn for u in c), 2):
-            is_tru_clonal, is_inf_clonal = [tids[u1] == tids[u2] for tids in [tru_ids, inf_ids]]
-            n_tot += 1
-            if is_tru_clonal and is_inf_clonal:
-                tp += 1
-            elif is_tru_clonal:
-                fn += 1
-            elif is_inf_clonal:
-                fp += 1
-            else:  # singletons
-                pass
+        uids = set(u for c in tru_ptn for u in c)
+        cell_sizes = Counter((tru_ids[u], inf_ids[u]) for u in uids)  # contingency table between true and inferred clusters, so we can count pairs of uids without looping over them
+        tp = sum(n_pairs(n) for n in cell_sizes.values())  # pairs that are together in both
+        fn = sum(n_pairs(n) for n in Counter(tru_ids[u] for u in uids).values()) - tp  # together in true, but not inferred
+        fp = sum(n_pairs(n) for n in Counter(inf_ids[u] for u in uids).values()) - tp  # together in inferred, but not true
+        n_tot = n_pairs(len(uids))
     elif mtstr == 'closeness':
         tp, fp, fn, n_tot = set(), set(), set(), set()
         if debug:
@@ -5765,14 +5954,13 @@ def partition_similarity_matrix(partition_a, partition_b, n_biggest_clusters, is
 
     smatrix = [[float('nan') for _ in b_clusters] for _ in a_clusters]
     dszs, dovlps, dfracs = [], [], []
-    overlap_matrix = [[set(clust_a) & set(clust_b) for clust_b in b_clusters] for clust_a in a_clusters]
+    overlap_counts = partition_contingency_table(a_clusters, b_clusters)
+    skip_overlap_counts = partition_contingency_table(a_clusters, b_skip_clusts) if debug else None
     missing_b_clusts = list(range(len(b_clusters)))  # need to look for any clusters in b that overlapped only with small a clusters (i.e. won't otherwise show up in the debug printout)
     for ia, clust_a in enumerate(a_clusters):
         sub_szs, sub_ovlps, sub_fracs, n_found = [], [], [], 0
-        for ib, clust_b in enumerate(b_clusters):  # first look just in the precalculated overlap matrix
-            n_common = len(overlap_matrix[ia][ib])
-            if n_common == 0:
-                continue
+        for ib in sorted(overlap_counts[ia]):  # first look just in the precalculated overlaps
+            clust_b, n_common = b_clusters[ib], overlap_counts[ia][ib]
             ifrac = float(n_common) / norm_factor(clust_a, clust_b)
             smatrix[ia][ib] = float('nan') if ifrac==0 else ifrac  # nan gives you transparent/empty color
             if debug:
@@ -5781,13 +5969,12 @@ def partition_similarity_matrix(partition_a, partition_b, n_biggest_clusters, is
                 if ib in missing_b_clusts:
                     missing_b_clusts.remove(ib)
         if debug and n_found < len(clust_a):  # if we didn't find any with overlap, look in smaller clusters (I think doing this when debug isn't set would be annoyingly slow. This fcn is meant to plot a summary of the largest clusters on potentially large repertoires, if you want really comprehensive info, just set debug)
-            for bclst in b_skip_clusts:
-                ncm = len(set(clust_a) & set(bclst))
-                if ncm > 0:
-                    n_found += ncm
-                    incr_clust(len(bclst), ncm, float(ncm) / norm_factor(clust_a, bclst))
-                sub_szs = sorted(sub_szs, reverse=True)
-                sub_ovlps = sorted(sub_ovlps, reverse=True)
+            for ib in sorted(skip_overlap_counts[ia]):
+                bclst, ncm = b_skip_clusts[ib], skip_overlap_counts[ia][ib]
+                n_found += ncm
+                incr_clust(len(bclst), ncm, float(ncm) / norm_factor(clust_a, bclst))
+            sub_szs = sorted(sub_szs, reverse=True)
+            sub_ovlps = sorted(sub_ovlps, reverse=True)
             if n_found != len(clust_a):
                 print('  %s couldn\'t find %d / %d uids' % (wrnstr(), len(clust_a) - n_found, len(clust_a)))
         if debug:
@@ -6437,10 +6624,27 @@ def read_seqfos(fname):  # queries=None, n_max_queries=-1, istartstop=None, ftyp
     return seqfos
 
 # ----------------------------------------------------------------------------------------
-# if <look_for_tuples> is set, look for uids that are actually string-converted python tuples, and add each entry in the tuple as a duplicate sequence. Can also pass in a list <tuple_info> if you need to do more with the info afterwards (this is to handle gctree writing fasta files with broken names; see usage also in datascripts/meta/taraki-XXX)
-def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_infostrs=False, sanitize_uids=False, sanitize_seqs=False, queries=None, n_max_queries=-1, istartstop=None, ftype=None, n_random_queries=None, look_for_tuples=False, tuple_info=None):
+compression_modules = {'.gz' : gzip, '.bz2' : bz2}
+
+# ----------------------------------------------------------------------------------------
+def fastx_suffix(fname):  # suffix of <fname> ignoring any compression suffix (e.g. '.fa' for 'seqs.fa.gz')
+    suffix = getsuffix(fname)
+    if suffix in compression_modules:
+        suffix = getsuffix(fname[ : -len(suffix)])
+    return suffix
+
+# ----------------------------------------------------------------------------------------
+def open_fastx(fname, block_size=2**20):  # open <fname> for reading in text mode, with reads from disk in blocks of <block_size> bytes, and decompressing if it has a compression suffix
+    suffix = getsuffix(fname)
+    if suffix in compression_modules:
+        return io.TextIOWrapper(io.BufferedReader(compression_modules[suffix].open(fname, 'rb'), buffer_size=block_size))
+    return open(fname, buffering=block_size)
+
+# ----------------------------------------------------------------------------------------
+# generator version of read_fastx() (i.e. yields each seqfo as soon as it's read, so we don't need to hold the whole file in memory, and we stop reading once we have all the ones we need)
+def iter_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_infostrs=False, sanitize_uids=False, sanitize_seqs=False, queries=None, n_max_queries=-1, istartstop=None, ftype=None):
     if ftype is None:
-        suffix = getsuffix(fname)
+        suffix = fastx_suffix(fname)
         if suffix == '.fa' or suffix == '.fasta':
             ftype = 'fa'
         elif suffix == '.fq' or suffix == '.fastq':
@@ -6448,21 +6652,20 @@ def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_
         else:
             raise Exception('unhandled file type: %s' % suffix)
 
-    finfo = []
     iline = -1  # index of the query/seq that we're currently reading in the fasta
-    n_fasta_queries = 0  # number of queries so far added to <finfo> (I guess I could just use len(finfo) at this point)
+    n_fasta_queries = 0  # number of queries so far yielded
     missing_queries = set(queries) if queries is not None else None
     already_printed_forbidden_character_warning, already_printed_warn_char_warning = False, False
-    with open(fname) as fastafile:
-        startpos = None
+    with open_fastx(fname) as fastafile:
+        flines = iter(fastafile)
+        nextheadline = None  # when reading fasta seq lines we only know we're done when we get to the next header line, so we have to keep it for the next time through
         while True:
-            if startpos is not None:  # rewind since the last time through we had to look to see when the next header line appeared
-                fastafile.seek(startpos)
-            headline = fastafile.readline()
+            headline = next(flines, '') if nextheadline is None else nextheadline
+            nextheadline = None
             if not headline:
                 break
             if headline.strip() == '':  # skip a blank line
-                headline = fastafile.readline()
+                headline = next(flines, '')
 
             if ftype == 'fa':
                 if headline[0] != '>':
@@ -6470,27 +6673,22 @@ def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_
                 headline = headline.lstrip('>')
 
                 seqlines = []
-                nextline = fastafile.readline()
-                while True:
-                    if not nextline:
-                        break
+                for nextline in flines:
                     if nextline[0] == '>':
+                        nextheadline = nextline
                         break
-                    else:
-                        startpos = fastafile.tell()  # i.e. very line that doesn't begin with '>' increments <startpos>
                     seqlines.append(nextline)
-                    nextline = fastafile.readline()
                 seqline = ''.join([l.strip() for l in seqlines]) if len(seqlines) > 0 else None
             elif ftype == 'fq':
                 if headline[0] != '@':
                     raise Exception('invalid fastq header line in %s:\n    %s' % (fname, headline))
                 headline = headline.lstrip('@')
 
-                seqline = fastafile.readline()  # NOTE .fq with multi-line entries isn't supported, since delimiter characters are allowed to occur within the quality string
-                plusline = fastafile.readline().strip()
+                seqline = next(flines, '')  # NOTE .fq with multi-line entries isn't supported, since delimiter characters are allowed to occur within the quality string
+                plusline = next(flines, '').strip()
                 if plusline[0] != '+':
                     raise Exception('invalid fastq quality header in %s:\n    %s' % (fname, plusline))
-                qualityline = fastafile.readline()
+                qualityline = next(flines, '')
             else:
                 raise Exception('unhandled ftype %s' % ftype)
 
@@ -6502,7 +6700,7 @@ def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_
                 if iline < istartstop[0]:
                     continue
                 elif iline >= istartstop[1]:
-                    continue
+                    break
 
             if dont_split_infostrs:  # if this is set, we let the calling fcn handle all the infostr parsing (e.g. for imgt germline fasta files)
                 infostrs = headline
@@ -6539,13 +6737,18 @@ def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_
                 if any(c not in alphabet for c in seqfo[seq_key]):
                     unexpected_chars = set([ch for ch in seqfo[seq_key] if ch not in alphabet])
                     raise Exception('unexpected character%s %s (not among %s) in input sequence with id %s:\n  %s' % (plural(len(unexpected_chars)), ', '.join([('\'%s\'' % ch) for ch in unexpected_chars]), alphabet, seqfo[name_key], seqfo[seq_key]))
-            finfo.append(seqfo)
+            yield seqfo
 
             n_fasta_queries += 1
             if n_max_queries > 0 and n_fasta_queries >= n_max_queries:
                 break
             if queries is not None and len(missing_queries) == 0:
                 break
+
+# ----------------------------------------------------------------------------------------
+# if <look_for_tuples> is set, look for uids that are actually string-converted python tuples, and add each entry in the tuple as a duplicate sequence. Can also pass in a list <tuple_info> if you need to do more with the info afterwards (this is to handle gctree writing fasta files with broken names; see usage also in datascripts/meta/taraki-XXX)
+def read_fastx(fname, name_key='name', seq_key='seq', add_info=True, dont_split_infostrs=False, sanitize_uids=False, sanitize_seqs=False, queries=None, n_max_queries=-1, istartstop=None, ftype=None, n_random_queries=None, look_for_tuples=False, tuple_info=None):
+    finfo = list(iter_fastx(fname, name_key=name_key, seq_key=seq_key, add_info=add_info, dont_split_infostrs=dont_split_infostrs, sanitize_uids=sanitize_uids, sanitize_seqs=sanitize_seqs, queries=queries, n_max_queries=n_max_queries, istartstop=istartstop, ftype=ftype))
     if n_max_queries > 0:
         print('    stopped after reading %d sequences from %s' % (n_max_queries, fname))
     if queries is not None:
@@ -6682,7 +6885,7 @@ def read_vsearch_cluster_file(fname):
     return partition
 
 # ----------------------------------------------------------------------------------------
-def read_vsearch_search_file(fname, userfields, seqdict, glfo, region, get_annotations=False, debug=False):
+def read_vsearch_search_file(fname, userfields, seqdict, glfo, region, get_annotations=False, duplicates=None, debug=False):
     from . import indelutils
     def get_mutation_info(query, matchfo, indelfo):
         tmpgl = glfo['seqs'][region][matchfo['gene']][matchfo['glbounds'][0] : matchfo['glbounds'][1]]
@@ -6724,6 +6927,8 @@ def read_vsearch_search_file(fname, userfields, seqdict, glfo, region, get_annot
     gene_counts = {}
     for query in query_info:
         counts_per_match = 1. / len(query_info[query])  # e.g. if there's four matches with the same score, give 'em each 0.25 counts
+        if duplicates is not None and query in duplicates:
+            counts_per_match *= 1 + len(duplicates[query])
         for qinfo in query_info[query]:
             if qinfo['gene'] not in gene_counts:
                 gene_counts[qinfo['gene']] = 0.
@@ -6767,6 +6972,12 @@ def read_vsearch_search_file(fname, userfields, seqdict, glfo, region, get_annot
                 'indelfo' : combined_indelfo,
             }
 
+    if duplicates is not None:
+        for query in list(annotations):
+            for dquery in duplicates.get(query, []):
+                annotations[dquery] = copy.deepcopy(annotations[query])
+        failed_queries += [d for q in failed_queries for d in duplicates.get(q, [])]
+
     return {'gene-counts' : gene_counts, 'annotations' : annotations, 'failures' : failed_queries}
 
 # ----------------------------------------------------------------------------------------
@@ -6788,7 +6999,7 @@ def run_vsearch_with_duplicate_uids(action, seqlist, workdir, threshold, **kwarg
 
 # ----------------------------------------------------------------------------------------
 # NOTE use the previous fcn if you expect duplicate uids
-def run_vsearch(action, seqdict, workdir, threshold, match_mismatch='2:-4', gap_open=None, no_indels=False, minseqlength=None, consensus_fname=None, msa_fname=None, glfo=None, print_time=False, vsearch_binary=None, get_annotations=False, expect_failure=False, extra_str='  vsearch:'):
+def run_vsearch(action, seqdict, workdir, threshold, match_mismatch='2:-4', gap_open=None, no_indels=False, minseqlength=None, consensus_fname=None, msa_fname=None, glfo=None, print_time=False, vsearch_binary=None, get_annotations=False, expect_failure=False, extra_str='  vsearch:', duplicates=None):  # <duplicates>: {uid : [uids with seqs identical to uid's that aren't in <seqdict>]}, i.e. we weight gene counts accordingly and copy annotations/failures to them (only used for 'search')
     from . import clusterpath
     from . import glutils
     # note: '2:-4' is the default vsearch match:mismatch, but I'm setting it here in case vsearch changes it in the future
@@ -6878,11 +7089,11 @@ def run_vsearch(action, seqdict, workdir, threshold, match_mismatch='2:-4', gap_
     run_cmds(cmdfos)
 
     # read output
-    n_seqs = len(seqdict)
+    n_seqs = len(seqdict) + (0 if duplicates is None else sum(len(d) for d in duplicates.values()))
     if action == 'cluster':
         returnfo = read_vsearch_cluster_file(outfname)
     elif action == 'search':
-        returnfo = read_vsearch_search_file(outfname, userfields, seqdict, glfo, region, get_annotations=get_annotations)
+        returnfo = read_vsearch_search_file(outfname, userfields, seqdict, glfo, region, get_annotations=get_annotations, duplicates=duplicates)
         glutils.remove_glfo_files(dbdir, glfo['locus'])
         succ_frac = sum(returnfo['gene-counts'].values()) / float(n_seqs)
         if succ_frac < expected_success_fraction and not expect_failure:
@@ -7071,10 +7282,12 @@ def write_empty_annotations(fname, locus):
     write_annotations(fname, glutils.get_empty_glfo(locus), [], annotation_headers)
 
 # ----------------------------------------------------------------------------------------
-def write_annotations(fname, glfo, annotation_list, headers, synth_single_seqs=False, failed_queries=None, partition_lines=None, use_pyyaml=False, dont_write_git_info=False):
+def write_annotations(fname, glfo, annotation_list, headers, synth_single_seqs=False, failed_queries=None, partition_lines=None, use_pyyaml=False, dont_write_git_info=False, write_index=False):
     from . import clusterpath
     if os.path.exists(fname):
         os.remove(fname)
+        if os.path.exists(get_yaml_index_fname(fname)):  # remove any old index, since it'd be out of date
+            os.remove(get_yaml_index_fname(fname))
     elif not os.path.exists(os.path.dirname(os.path.abspath(fname))):
         os.makedirs(os.path.dirname(os.path.abspath(fname)))
 
@@ -7084,7 +7297,11 @@ def write_annotations(fname, glfo, annotation_list, headers, synth_single_seqs=F
     elif getsuffix(fname) == '.yaml':
         if partition_lines is None:
             partition_lines = clusterpath.ClusterPath(partition=get_partition_from_annotation_list(annotation_list)).get_partition_lines()
-        write_yaml_output(fname, headers, glfo=glfo, annotation_list=annotation_list, synth_single_seqs=synth_single_seqs, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=use_pyyaml, dont_write_git_info=dont_write_git_info)
+        write_yaml_output(fname, headers, glfo=glfo, annotation_list=annotation_list, synth_single_seqs=synth_single_seqs, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=use_pyyaml, dont_write_git_info=dont_write_git_info, write_index=write_index)
+    elif getsuffix(fname) == '.npz':
+        if partition_lines is None:
+            partition_lines = clusterpath.ClusterPath(partition=get_partition_from_annotation_list(annotation_list)).get_partition_lines()
+        write_npz_output(fname, headers, glfo=glfo, annotation_list=annotation_list, failed_queries=failed_queries, partition_lines=partition_lines, dont_write_git_info=dont_write_git_info)
     else:
         raise Exception('unhandled file extension \'%s\' on %s' % (getsuffix(fname), fname))
 
@@ -7123,7 +7340,7 @@ def get_yamlfo_for_output(line, headers, glfo=None):
     return yamlfo
 
 # ----------------------------------------------------------------------------------------
-def write_yaml_output(fname, headers, glfo=None, annotation_list=None, synth_single_seqs=False, failed_queries=None, partition_lines=None, use_pyyaml=False, dont_write_git_info=False):
+def write_yaml_output(fname, headers, glfo=None, annotation_list=None, synth_single_seqs=False, failed_queries=None, partition_lines=None, use_pyyaml=False, dont_write_git_info=False, write_index=False):
     # ----------------------------------------------------------------------------------------
     def check_ids():  # really just want to check that there's *some* overlap between the partitions and annotations. It's normal that there's annotations for only some uids in the partition, but if there is a partition, at least some of its uids should be in the annotations (usually the uids with annotations is a strict subset, but sometimes there might be annotations for uids from somewhere else)
         ptnids = set(u for p in partition_lines for c in p['partition'] for u in c)
@@ -7145,34 +7362,162 @@ def write_yaml_output(fname, headers, glfo=None, annotation_list=None, synth_sin
                 'germline-info' : glfo,
                 'partitions' : partition_lines,
                 'events' : yaml_annotations}
-    if use_pyyaml:  # slower, but easier to read by hand for debugging (use this instead of the json version to make more human-readable files)
+    if use_pyyaml:  # slower, but easier to read by hand for debugging (use this instead of the json version to make more human-readable files) NOTE can't write an index for these
         with open(fname, 'w') as yamlfile:
             yaml.dump(yamldata, yamlfile, width=400, Dumper=Dumper, default_flow_style=False, allow_unicode=False)  # set <allow_unicode> to false so the file isn't cluttered up with !!python.unicode stuff
+    elif write_index:
+        write_indexed_json_yaml(fname, yamldata)
     else:  # way tf faster than full yaml (only lost information is ordering in ordered dicts, but that's only per-gene support and germline info, neither of whose order we care much about)
         jsdump(fname, yamldata) #, sort_keys=True, indent=4)
 
 # ----------------------------------------------------------------------------------------
-def parse_yaml_annotations(glfo, yamlfo, n_max_queries, synth_single_seqs, dont_add_implicit_info):
-    annotation_list = []
-    n_queries_read = 0
-    for line in yamlfo['events']:
-        if not line['invalid']:
-            transfer_indel_reversed_seqs(line)
-            if 'all_matches' in line and isinstance(line['all_matches'], dict):  # it used to be per-family, but then I realized it should be per-sequence, so any old cache files lying around have it as per-family
-                line['all_matches'] = [line['all_matches']]  # also, yes, it makes me VERY ANGRY that this needs to be here, but i just ran into a couple of these old files and otherwise they cause crashes
-            if not dont_add_implicit_info:  # it's kind of slow, although most of the time you probably want all the extra info
-                add_implicit_info(glfo, line)  # don't use the germline info in <yamlfo>, in case we decide we want to modify it in the calling fcn
-        if synth_single_seqs and len(line['unique_ids']) > 1:
-            for iseq in range(len(line['unique_ids'])):
-                annotation_list.append(synthesize_single_seq_line(line, iseq))
-        else:
-            annotation_list.append(line)
+def get_npz_column(vals):  # encode the values <vals> of one annotation key (one entry per event) as numpy arrays for write_npz_output()
+    # returns the column type and a dict of arrays: 'scalar' for per-event str/bool/int/float values, 'per-seq' for lists of such values (flattened, with a separate array of list lengths), or 'json' (json string for each event) for anything else
+    # ----------------------------------------------------------------------------------------
+    def homogeneous_array(tvals):  # numpy array of <tvals> if they're all the same simple type (and numpy can represent them exactly), otherwise None
+        if len(tvals) == 0 or len(set(type(v) for v in tvals)) != 1 or type(tvals[0]) not in (str, bool, int, float):
+            return None
+        try:
+            tarray = numpy.array(tvals)
+        except OverflowError:  # ints too big for int64
+            return None
+        return tarray if tarray.dtype.kind in 'biufU' else None
+    # ----------------------------------------------------------------------------------------
+    tarray = homogeneous_array(vals)
+    if tarray is not None:
+        return 'scalar', {'' : tarray}
+    if all(isinstance(v, list) for v in vals):
+        tarray = homogeneous_array([x for v in vals for x in v])
+        if tarray is not None:
+            return 'per-seq', {'' : tarray, '.lengths' : numpy.array([len(v) for v in vals], dtype=numpy.int64)}
+    return 'json', {'' : numpy.array([json.dumps(v) for v in vals])}
 
-        n_queries_read += len(line['unique_ids'])
-        if n_max_queries > 0 and n_queries_read >= n_max_queries:
-            break
+# ----------------------------------------------------------------------------------------
+def write_npz_output(fname, headers, glfo=None, annotation_list=None, failed_queries=None, partition_lines=None, dont_write_git_info=False):  # columnar binary version of write_yaml_output(): each annotation key is stored as a separate array (or arrays), so it's much faster to read and write, and you can read only some of the columns
+    if annotation_list is None:
+        annotation_list = []
+    if partition_lines is None:
+        partition_lines = []
+    events = [get_yamlfo_for_output(l, headers, glfo=glfo) for l in annotation_list]
+    if failed_queries is not None:
+        events += failed_queries
+    column_keys = []  # keys in the order we first see them
+    for evt in events:
+        column_keys += [k for k in evt if k not in column_keys]
+    arrays = {'__version-info__' : numpy.array(json.dumps({'partis-npz' : 0.1, 'partis-git' : '' if dont_write_git_info else get_version_info()})),
+              '__germline-info__' : numpy.array(json.dumps(glfo)),
+              '__partitions__' : numpy.array(json.dumps(partition_lines))}
+    colinfo = OrderedDict()
+    for key in column_keys:
+        present = numpy.array([key in e for e in events], dtype=bool)
+        ctype, carrays = get_npz_column([e[key] for e in events if key in e])
+        colinfo[key] = {'type' : ctype, 'all-present' : bool(present.all())}
+        if not present.all():  # e.g. failed queries only have a few keys
+            carrays['.present'] = present
+        for sfx, tarray in carrays.items():
+            arrays[key + sfx] = tarray
+    arrays['__columns__'] = numpy.array(json.dumps({'n-events' : len(events), 'columns' : colinfo}))
+    with open(fname, 'wb') as npzfile:
+        numpy.savez(npzfile, **arrays)  # don't compress, since the point is speed
+
+# ----------------------------------------------------------------------------------------
+def read_npz_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, columns=None, debug=False):  # read output written by write_npz_output() (same return values as read_yaml_output())
+    # if <columns> is set, we only read those annotation keys (plus unique_ids and invalid), and don't add implicit info (since it needs most of the keys)
+    from . import clusterpath
+    with numpy.load(fname) as npzfo:  # NOTE arrays are only read from the file when they're accessed
+        if debug:
+            print('  read npz version %s from %s' % (json.loads(str(npzfo['__version-info__']))['partis-npz'], fname))
+        glfo = json.loads(str(npzfo['__germline-info__']))
+        partition_lines = json.loads(str(npzfo['__partitions__']))
+        annotation_list = None
+        if not skip_annotations:
+            colfo = json.loads(str(npzfo['__columns__']))
+            keys_to_read = list(colfo['columns'])
+            if columns is not None:
+                missing_cols = [c for c in columns if c not in colfo['columns']]
+                if len(missing_cols) > 0:
+                    print('  %s requested column%s not in %s: %s' % (wrnstr(), plural(len(missing_cols)), fname, ' '.join(missing_cols)))
+                keys_to_read = [k for k in keys_to_read if k in ['unique_ids', 'invalid'] or k in columns]
+            n_events = colfo['n-events']
+            if n_max_queries > 0:  # only decode as many events as we need
+                uid_lengths = numpy.ones(n_events, dtype=numpy.int64) if colfo['columns']['unique_ids']['type'] == 'scalar' else npzfo['unique_ids.lengths']
+                n_events = min(n_events, int(numpy.searchsorted(numpy.cumsum(uid_lengths), n_max_queries)) + 1)
+            annotation_list = [{} for _ in range(n_events)]
+            for key in keys_to_read:
+                cfo = colfo['columns'][key]
+                ievents = range(n_events) if cfo['all-present'] else [i for i in numpy.flatnonzero(npzfo[key + '.present']) if i < n_events]
+                if cfo['type'] == 'per-seq':
+                    lengths = npzfo[key + '.lengths'][:len(ievents)]
+                    flatvals = npzfo[key][:int(lengths.sum())].tolist()
+                    istarts = numpy.concatenate([[0], numpy.cumsum(lengths)]).tolist()
+                    vals = [flatvals[istarts[i] : istarts[i + 1]] for i in range(len(ievents))]
+                else:
+                    vals = npzfo[key][:len(ievents)].tolist()
+                    if cfo['type'] == 'json':
+                        vals = [json.loads(v) for v in vals]
+                for ievt, val in zip(ievents, vals):
+                    annotation_list[ievt][key] = val
+            for line in annotation_list:
+                if columns is None:
+                    process_yaml_annotation(glfo, line, dont_add_implicit_info=dont_add_implicit_info)
+                elif not line['invalid'] and 'input_seqs' in line and 'indel_reversed_seqs' in line:
+                    transfer_indel_reversed_seqs(line)
+            if synth_single_seqs:
+                annotation_list = [synthesize_single_seq_line(l, iseq) if len(l['unique_ids']) > 1 else l for l in annotation_list for iseq in range(len(l['unique_ids']) if len(l['unique_ids']) > 1 else 1)]
+            for line in annotation_list:
+                add_per_seq_keys(line)
 
-    return annotation_list
+    if cpath is None:
+        cpath = clusterpath.ClusterPath(seed_unique_id=seed_unique_id)
+    if len(partition_lines) > 0:
+        cpath.readlines(partition_lines)
+
+    return glfo, annotation_list, cpath
+
+# ----------------------------------------------------------------------------------------
+def get_yaml_index_fname(fname):
+    return replace_suffix(fname, '-index.json')
+
+# ----------------------------------------------------------------------------------------
+def write_indexed_json_yaml(fname, yamldata):  # write <yamldata> to <fname> exactly as jsdump() would, but also write an index file (alongside it) with the byte offset of each top-level value and each event, so later we can seek straight to the events we need
+    idxfo = {'partis-yaml-index' : 0.2, 'offsets' : {}, 'events' : [], 'clusters' : {}, 'uids' : {}}  # 'offsets' and 'events' are [offset, length] pairs; 'clusters' and 'uids' map from ':'.join(unique_ids) and from each uid to the list of indices in 'events' that contain it
+    with open(fname, 'w') as jfile:
+        offset = 0
+        def jwrite(tstr):  # NOTE json.dumps() escapes non-ascii by default, so string length is the same as byte length
+            nonlocal offset
+            jfile.write(tstr)
+            offset += len(tstr)
+        for ikey, (key, val) in enumerate(yamldata.items()):
+            jwrite('%s%s: ' % ('{' if ikey == 0 else ', ', json.dumps(key)))
+            if key == 'events':
+                jwrite('[')
+                for ievt, evt in enumerate(val):
+                    if ievt > 0:
+                        jwrite(', ')
+                    evtstr = json.dumps(evt)
+                    idxfo['events'].append([offset, len(evtstr)])
+                    idxfo['clusters'].setdefault(':'.join(evt['unique_ids']), []).append(ievt)
+                    for uid in evt['unique_ids']:
+                        idxfo['uids'].setdefault(uid, []).append(ievt)
+                    jwrite(evtstr)
+                jwrite(']')
+            else:
+                valstr = json.dumps(val)
+                idxfo['offsets'][key] = [offset, len(valstr)]
+                jwrite(valstr)
+        jwrite('}')
+    idxfo['file-size'] = offset
+    idxfo['file-mtime'] = os.path.getmtime(fname)  # has to be after the file is closed
+    jsdump(get_yaml_index_fname(fname), idxfo)
+
+# ----------------------------------------------------------------------------------------
+def process_yaml_annotation(glfo, line, dont_add_implicit_info=False):  # per-event processing that has to happen after reading an annotation from a yaml/json output file
+    if not line['invalid']:
+        transfer_indel_reversed_seqs(line)
+        if 'all_matches' in line and isinstance(line['all_matches'], dict):  # it used to be per-family, but then I realized it should be per-sequence, so any old cache files lying around have it as per-family
+            line['all_matches'] = [line['all_matches']]  # also, yes, it makes me VERY ANGRY that this needs to be here, but i just ran into a couple of these old files and otherwise they cause crashes
+        if not dont_add_implicit_info:  # it's kind of slow, although most of the time you probably want all the extra info
+            add_implicit_info(glfo, line)  # don't use the germline info in <yamlfo>, in case we decide we want to modify it in the calling fcn
 
 # ----------------------------------------------------------------------------------------
 def read_cpath(fname, n_max_queries=-1, seed_unique_id=None, skip_annotations=False):
@@ -7180,9 +7525,16 @@ def read_cpath(fname, n_max_queries=-1, seed_unique_id=None, skip_annotations=Fa
     return cpath
 
 # ----------------------------------------------------------------------------------------
-def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, glfo=None, glfo_dir=None, locus=None, skip_failed_queries=False, is_partition_file=False, debug=False):
+def get_lazy_annotations(glfo, annotation_list):  # wrap each (valid) annotation in a LazyAnnotation (ok, they don't have to be valid, but we never add implicit info to invalid ones)
+    return [LazyAnnotation(l, glfo) if not l.get('invalid', False) else l for l in annotation_list]
+
+# ----------------------------------------------------------------------------------------
+def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, lazy_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, glfo=None, glfo_dir=None, locus=None, skip_failed_queries=False, is_partition_file=False, columns=None, debug=False):  # <columns> is only used for .npz files
     from . import clusterpath
     from . import glutils
+    return_lazy = lazy_implicit_info and not dont_add_implicit_info and getsuffix(fname) != '.csv'  # if set, read them without implicit info, then wrap them in LazyAnnotations at the end (old-style csv files always get the info added right away)
+    if return_lazy:
+        dont_add_implicit_info = True
     annotation_list = None
 
     if getsuffix(fname) == '.csv':
@@ -7213,6 +7565,9 @@ def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_impli
     elif getsuffix(fname) == '.yaml':  # NOTE this replaces any <glfo> that was passed (well, only within the local name table of this fcn, unless the calling fcn replaces it themselves, since we return this glfo)
         glfo, annotation_list, cpath = read_yaml_output(fname, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs,
                                                         dont_add_implicit_info=dont_add_implicit_info, seed_unique_id=seed_unique_id, cpath=cpath, skip_annotations=skip_annotations, debug=debug)
+    elif getsuffix(fname) == '.npz':
+        glfo, annotation_list, cpath = read_npz_output(fname, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs, dont_add_implicit_info=dont_add_implicit_info,
+                                                       seed_unique_id=seed_unique_id, cpath=cpath, skip_annotations=skip_annotations, columns=columns, debug=debug)
     else:
         raise Exception('unhandled file extension \'%s\' on %s' % (getsuffix(fname), fname))
 
@@ -7235,6 +7590,8 @@ def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_impli
     if annotation_list is not None:
         for antn in annotation_list:
             add_per_seq_keys(antn)
+        if return_lazy:
+            annotation_list = get_lazy_annotations(glfo, annotation_list)
 
     return glfo, annotation_list, cpath  # NOTE if you want a dict of annotations, use utils.get_annotation_dict() above
 
@@ -7270,29 +7627,218 @@ def read_json_yaml(fname):  # try to read <fname> as json (since it's faster), o
     return yamlfo
 
 # ----------------------------------------------------------------------------------------
-def read_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, debug=False):
-    from . import clusterpath
-    yamlfo = read_json_yaml(fname)
-    if isinstance(yamlfo, list):
-        raise Exception('read list of seqfos from file, instead of the expected standard yaml output with germline-info, annotations, and partitions. Run read_seqfos() instead: %s' % fname)
+def iter_json_yaml(fname, list_keys=('partitions', 'events'), chunk_size=2**20):  # iterate over the top-level entries of a yaml output file (which is usually actually json), without reading the whole thing into memory
+    # yields (key, val) for each top-level key, except for keys in <list_keys>, for which we yield (key, item) for each item in the list (so e.g. we only ever have one event in memory)
+    # NOTE only json is streamed: if it's real (pyyaml) yaml we fall back to reading the whole file
+    decoder = json.JSONDecoder()
+    with open(fname) as yamlfile:
+        buf, pos, eof = '', 0, False
+        # ----------------------------------------------------------------------------------------
+        def readmore(min_size=chunk_size):
+            nonlocal buf, pos, eof
+            if pos > 0:  # drop the part we've already parsed
+                buf, pos = buf[pos:], 0
+            newstr = yamlfile.read(max(chunk_size, min_size))
+            eof = len(newstr) == 0
+            buf += newstr
+        # ----------------------------------------------------------------------------------------
+        def skipws():  # skip whitespace, then return the next character (or None at end of file)
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                readmore()
+                if eof:
+                    return None
+        # ----------------------------------------------------------------------------------------
+        def expect(char):
+            nonlocal pos
+            if skipws() != char:
+                raise Exception('expected \'%s\' at char %d but got \'%s\' while reading %s' % (char, pos, buf[pos : pos + 20], fname))
+            pos += 1
+        # ----------------------------------------------------------------------------------------
+        def decode():  # decode the next json value, reading more of the file until it's all in <buf>
+            nonlocal pos
+            skipws()
+            while True:
+                try:
+                    val, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:  # if it ends right at the end of <buf> it could be a number that continues in the next chunk
+                        pos = end
+                        return val
+                except ValueError:
+                    if eof:
+                        raise
+                readmore(min_size=2 * len(buf))  # double the read size each time, so huge entries don't need lots of retries
+        # ----------------------------------------------------------------------------------------
+        firstchar = skipws()
+        if firstchar != '{':  # not a json dict, so either a real (pyyaml) yaml file or a list of seqfos
+            yamlfile.seek(0)
+            yamlfo = json.load(yamlfile) if firstchar == '[' else yaml.load(yamlfile, Loader=Loader)
+            if isinstance(yamlfo, list):
+                raise Exception('read list of seqfos from file, instead of the expected standard yaml output with germline-info, annotations, and partitions. Run read_seqfos() instead: %s' % fname)
+            for key, val in yamlfo.items():  # pyyaml sorts the keys, so make sure the non-list ones (e.g. germline info) come first
+                if key not in list_keys:
+                    yield key, val
+            for key in [k for k in list_keys if k in yamlfo]:
+                for item in yamlfo[key]:
+                    yield key, item
+            return
+        pos += 1
+        while skipws() != '}':
+            key = decode()
+            expect(':')
+            if key in list_keys and skipws() == '[':
+                pos += 1
+                while skipws() != ']':
+                    yield key, decode()
+                    if skipws() == ',':
+                        pos += 1
+                pos += 1
+            else:
+                yield key, decode()
+            if skipws() == ',':
+                pos += 1
+
+# ----------------------------------------------------------------------------------------
+def iter_yaml_annotations(fname, glfo=None, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=True, headerfo=None):  # yield annotations one at a time from yaml output file <fname>, so memory use doesn't scale with the size of the file
+    # NOTE by default we *don't* add implicit info (since the point is to be fast) -- if you need it for only some annotations, call add_implicit_info() on those ones yourself (using glfo from the file, e.g. from read_yaml_output() with skip_annotations=True)
+    # if <headerfo> is set, we fill it with the file's non-event info ('germline-info', 'version-info', and a list of 'partitions' lines), and keep reading past <n_max_queries> til we've seen the partitions
+    def process(line):
+        process_yaml_annotation(glfo, line, dont_add_implicit_info=dont_add_implicit_info)
+        lines = [synthesize_single_seq_line(line, iseq) for iseq in range(len(line['unique_ids']))] if synth_single_seqs and len(line['unique_ids']) > 1 else [line]
+        for tline in lines:
+            add_per_seq_keys(tline)
+        return lines
+    n_queries_read, found_partitions = 0, False
+    waiting_events = []  # events that come before the germline info (only in older files), which have to wait til we've got glfo if we're adding implicit info
+    for key, val in iter_json_yaml(fname):
+        if key == 'events':
+            if n_max_queries > 0 and n_queries_read >= n_max_queries:
+                if headerfo is None or found_partitions:  # partitions come before events in files we write, so we're done (but keep going if we haven't seen them yet, in case it's an older file with different ordering)
+                    break
+                continue
+            n_queries_read += len(val['unique_ids'])
+            if glfo is None and not dont_add_implicit_info:
+                waiting_events.append(val)
+                continue
+            for tline in process(val):
+                yield tline
+            continue
+        if key == 'germline-info' and glfo is None:  # germline info comes before the events in files we write, which is good since we need it to add implicit info
+            glfo = val
+            for wline in waiting_events:
+                for tline in process(wline):
+                    yield tline
+            waiting_events = []
+        if key == 'partitions':
+            found_partitions = True
+        if headerfo is not None:
+            if key == 'partitions':
+                headerfo.setdefault('partitions', []).append(val)
+            else:
+                headerfo[key] = val
+    for wline in waiting_events:  # no germline info in the file, so this'll crash if it needs it (same as it always has)
+        for tline in process(wline):
+            yield tline
+
+# ----------------------------------------------------------------------------------------
+def iter_yaml_partition_lines(fname, headerfo=None):  # yield partition lines one at a time from yaml output file <fname>, stopping (in files we write) before reading any of the events (if <headerfo> is set, we fill it with the other non-event info, e.g. 'germline-info')
+    found_partitions = False
+    for key, val in iter_json_yaml(fname):
+        if key == 'partitions':
+            found_partitions = True
+            yield val
+        elif key == 'events':
+            if found_partitions:
+                break
+        elif headerfo is not None:
+            headerfo[key] = val
+
+# ----------------------------------------------------------------------------------------
+def read_yaml_index(fname, debug=False):  # read the index file for yaml output file <fname> written by write_indexed_json_yaml(), returning None if it doesn't exist or is out of date
+    idxfname = get_yaml_index_fname(fname)
+    if not os.path.exists(idxfname):
+        return None
+    idxfo = read_json_yaml(idxfname)
+    if idxfo['file-size'] != os.path.getsize(fname):
+        print('  %s index file size %d doesn\'t match output file size %d, so ignoring index %s' % (wrnstr(), idxfo['file-size'], os.path.getsize(fname), idxfname))
+        return None
+    if idxfo.get('file-mtime') != os.path.getmtime(fname):  # size alone doesn't catch a rewrite of the same length (index files from before we stored the mtime also get ignored)
+        print('  %s index file modification time %s doesn\'t match output file modification time %s, so ignoring index %s' % (wrnstr(), idxfo.get('file-mtime'), os.path.getmtime(fname), idxfname))
+        return None
     if debug:
-        print('  read yaml version %s from %s' % (yamlfo['version-info']['partis-yaml'], fname))
+        print('  read index for %d events from %s' % (len(idxfo['events']), idxfname))
+    return idxfo
 
-    glfo = yamlfo['germline-info']  # it would probably be good to run the glfo through the checks that glutils.read_glfo() does, but on the other hand since we're reading from our own yaml file, those have almost certainly already been done
+# ----------------------------------------------------------------------------------------
+def read_indexed_yaml_annotations(fname, idxfo, ievents, glfo=None, dont_add_implicit_info=False):  # use the byte offsets in <idxfo> to read only the events at indices <ievents> from <fname>
+    with open(fname, 'rb') as yamlfile:
+        def readval(offset, length):
+            yamlfile.seek(offset)
+            return json.loads(yamlfile.read(length).decode())
+        if glfo is None:
+            glfo = readval(*idxfo['offsets']['germline-info'])
+        annotation_list = []
+        for ievt in sorted(set(ievents)):  # go through the file in order
+            line = readval(*idxfo['events'][ievt])
+            process_yaml_annotation(glfo, line, dont_add_implicit_info=dont_add_implicit_info)
+            add_per_seq_keys(line)
+            annotation_list.append(line)
+    return annotation_list
+
+# ----------------------------------------------------------------------------------------
+def read_selected_yaml_annotations(fname, keep_fcn, idx_ievents_fcn, glfo=None, dont_add_implicit_info=False, n_max_to_keep=None):  # return annotations from <fname> for which <keep_fcn(line)> is True, using the index file if it exists (and <idx_ievents_fcn(idxfo)> to get the event indices from it), otherwise streaming through the whole file (or until we've found <n_max_to_keep>)
+    idxfo = read_yaml_index(fname)
+    if idxfo is not None:
+        return read_indexed_yaml_annotations(fname, idxfo, idx_ievents_fcn(idxfo), glfo=glfo, dont_add_implicit_info=dont_add_implicit_info)
+    annotation_list = []
+    for key, val in iter_json_yaml(fname):  # NOTE only adds implicit info to the annotations we keep
+        if key == 'germline-info' and glfo is None:
+            glfo = val
+        if key != 'events' or not keep_fcn(val):
+            continue
+        process_yaml_annotation(glfo, val, dont_add_implicit_info=dont_add_implicit_info)
+        add_per_seq_keys(val)
+        annotation_list.append(val)
+        if n_max_to_keep is not None and len(annotation_list) >= n_max_to_keep:
+            break
+    return annotation_list
 
+# ----------------------------------------------------------------------------------------
+def read_yaml_annotations_for_clusters(fname, clusters, glfo=None, dont_add_implicit_info=False):  # read annotations for the clusters in <clusters> (list of lists of uids) from yaml output file <fname>, and return them in a dict keyed by ':'.join(uids)
+    cluster_keys = set(':'.join(c) for c in clusters)
+    annotation_list = read_selected_yaml_annotations(fname, lambda l: ':'.join(l['unique_ids']) in cluster_keys, lambda ifo: [i for k in cluster_keys for i in ifo['clusters'].get(k, [])], glfo=glfo, dont_add_implicit_info=dont_add_implicit_info, n_max_to_keep=len(cluster_keys))
+    return OrderedDict((':'.join(l['unique_ids']), l) for l in annotation_list)
+
+# ----------------------------------------------------------------------------------------
+def read_yaml_annotations_for_uids(fname, uids, glfo=None, dont_add_implicit_info=False):  # read all annotations from yaml output file <fname> that contain any of the uids in <uids>
+    uids = set(uids)
+    return read_selected_yaml_annotations(fname, lambda l: len(uids & set(l['unique_ids'])) > 0, lambda ifo: [i for u in uids for i in ifo['uids'].get(u, [])], glfo=glfo, dont_add_implicit_info=dont_add_implicit_info)
+
+# ----------------------------------------------------------------------------------------
+def read_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, lazy_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, debug=False):  # if <lazy_implicit_info> is set, we return LazyAnnotations, which only add implicit info if/when it's needed
+    from . import clusterpath
+    headerfo = {}  # read one event at a time (rather than the whole file at once) so we don't need the file contents in memory on top of the annotations
     annotation_list = None
-    if not skip_annotations:  # may not really be worthwhile, but oh well
-        annotation_list = parse_yaml_annotations(glfo, yamlfo, n_max_queries, synth_single_seqs, dont_add_implicit_info)
+    if skip_annotations:
+        partition_lines = list(iter_yaml_partition_lines(fname, headerfo=headerfo))
+    else:
+        annotation_list = list(iter_yaml_annotations(fname, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs, dont_add_implicit_info=dont_add_implicit_info or lazy_implicit_info, headerfo=headerfo))
+        partition_lines = headerfo.get('partitions', [])
+    if 'version-info' in headerfo and debug:
+        print('  read yaml version %s from %s' % (headerfo['version-info']['partis-yaml'], fname))
+    glfo = headerfo.get('germline-info')  # it would probably be good to run the glfo through the checks that glutils.read_glfo() does, but on the other hand since we're reading from our own yaml file, those have almost certainly already been done
 
-    partition_lines = yamlfo['partitions']
     if cpath is None:   # allowing the caller to pass in <cpath> is kind of awkward, but it's used for backward compatibility in clusterpath.readfile()
         cpath = clusterpath.ClusterPath(seed_unique_id=seed_unique_id)  # NOTE I'm not sure if I really want to pass in the seed here -- it should be stored in the file -- but if it's in both places it should be the same. um, should.
     if len(partition_lines) > 0:  # *don't* combine this with the cluster path constructor, since then we won't modify the path passed in the arguments
         cpath.readlines(partition_lines)
 
-    if annotation_list is not None:
-        for antn in annotation_list:
-            add_per_seq_keys(antn)
+    if annotation_list is not None and lazy_implicit_info and not dont_add_implicit_info:
+        annotation_list = get_lazy_annotations(glfo, annotation_list)
 
     return glfo, annotation_list, cpath  # NOTE if you want a dict of annotations, use utils.get_annotation_dict() above
 
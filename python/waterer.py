@@ -13,6 +13,8 @@ from collections import OrderedDict
 import csv
 import numpy
 import traceback
+import json
+import pickle
 
 from . import utils
 from . import glutils
@@ -38,7 +40,7 @@ class Waterer(object):
     """ Run smith-waterman on the query sequences in <infname> """
     def __init__(self, args, glfo, input_info, simglfo, reco_info,
                  count_parameters=False, parameter_out_dir=None, plot_annotation_performance=False,
-                 duplicates=None, pre_failed_queries=None, aligned_gl_seqs=None, vs_info=None, msa_vs_info=None, locus=None):
+                 duplicates=None, pre_failed_queries=None, aligned_gl_seqs=None, vs_info=None, msa_vs_info=None, locus=None, input_duplicates=None):
         self.args = args
         self.input_info = input_info if input_info is not None else OrderedDict()  # NOTE do *not* modify <input_info>, since it's this original input info from partitiondriver
         self.reco_info = reco_info
@@ -48,6 +50,11 @@ class Waterer(object):
         self.simglfo = simglfo
         self.parameter_out_dir = parameter_out_dir
         self.duplicates = {} if duplicates is None else duplicates
+        self.input_duplicates = {} if input_duplicates is None else input_duplicates  # groups of exactly identical input seqs {first uid : [other uids]} (from seqfileopener.get_identical_input_uids()): we only run sw on the first one, then copy its results to the others
+        self.skipped_input_duplicates = {}  # the subset of <self.input_duplicates> that we actually skipped in this run
+        self.persistent_cachefname = None  # file in --persistent-sw-cache-dir for this glfo and these sw parameters (set in read_persistent_cache())
+        self.persistent_cache_hits = set()  # queries whose results we read from the persistent cache (so we don't write them again)
+        self.persistent_cache_version = 'v0'  # increment this if you change anything that changes the sw results for a given seq, so old cache files get ignored
         self.debug = self.args.debug if self.args.sw_debug is None else self.args.sw_debug
         self.aligned_gl_seqs = aligned_gl_seqs
         self.vs_info = vs_info
@@ -99,11 +106,18 @@ class Waterer(object):
         base_infname = 'query-seqs.fa'
         base_outfname = 'query-seqs.sam'
 
+        if len(self.input_duplicates) > 0:
+            self.skip_input_duplicates()
+
+        if self.args.persistent_sw_cache_dir is not None:
+            self.read_persistent_cache()
+
         if self.vs_info is not None or self.msa_vs_info is not None:  # if we're reading a cache file, we should make sure to read the exact same info from there
             self.add_vs_indels()
 
         itry = 0
-        while True:  # if we're not running vsearch, we still gotta run twice to get shm indeld sequences
+        processing_start, self.ig_sw_time = time.time(), 0.
+        while len(self.remaining_queries) > 0:  # if we're not running vsearch, we still gotta run twice to get shm indeld sequences
             mismatches, gap_opens, queries_for_each_proc = self.split_queries(self.args.n_procs)  # NOTE can tell us to run more than <self.args.n_procs> (we run at least one proc for each different mismatch score)
             self.write_input_files(base_infname, queries_for_each_proc)
 
@@ -118,12 +132,120 @@ class Waterer(object):
                 break
             itry += 1
 
+        if self.persistent_cachefname is not None:
+            self.write_persistent_cache()
+
+        if len(self.skipped_input_duplicates) > 0:
+            self.expand_input_duplicates()
+
         self.finalize(cachefname)
         print('    water time: %.1f  (ig-sw %.1f  processing %.1f)' % (time.time() - start, time.time() - processing_start, self.ig_sw_time))
 
+    # ----------------------------------------------------------------------------------------
+    def skip_input_duplicates(self):  # remove all but the first of each group of identical input seqs from <self.remaining_queries>, so sw only sees unique seqs
+        for kuid, duids in self.input_duplicates.items():
+            if kuid not in self.remaining_queries:  # e.g. if it failed in a previous sw run
+                continue
+            duids = [u for u in duids if u in self.remaining_queries]
+            if len(duids) == 0:
+                continue
+            self.skipped_input_duplicates[kuid] = duids
+            self.remaining_queries -= set(duids)
+        n_skipped = sum(len(d) for d in self.skipped_input_duplicates.values())
+        if n_skipped > 0:
+            print('    skipping %d exact duplicate input seq%s (will copy results from the %d seq%s they duplicate)' % (n_skipped, utils.plural(n_skipped), len(self.skipped_input_duplicates), utils.plural(len(self.skipped_input_duplicates))))
+
+    # ----------------------------------------------------------------------------------------
+    def expand_input_duplicates(self):  # copy results for each sw'd seq to its skipped identical seqs, so that afterwards everything looks like we ran sw on all of them (in particular, remove_duplicate_sequences() then collapses them as usual)
+        for kuid, duids in self.skipped_input_duplicates.items():
+            if kuid in self.info['passed-queries']:
+                for duid in duids:
+                    line = copy.deepcopy(self.info[kuid])
+                    line['unique_ids'] = [duid]
+                    line['duplicates'] = [self.duplicates.get(duid, []), ]
+                    if kuid in self.info['indels']:
+                        self.info['indels'][duid] = line['indelfos'][0]  # keep it so self.info[uid]['indelfos'] *is* self.info['indels'][uid] (see convert_qinfo())
+                    self.info['passed-queries'].add(duid)
+                    self.info[duid] = line
+                if kuid in self.kept_unproductive_queries:
+                    self.kept_unproductive_queries |= set(duids)
+            elif kuid in self.skipped_unproductive_queries:
+                self.skipped_unproductive_queries |= set(duids)
+            elif kuid in self.skipped_in_frame_queries:
+                self.skipped_in_frame_queries |= set(duids)
+            else:  # failed, so they'll get added to failed queries in finalize()
+                self.remaining_queries |= set(duids)
+        self.skipped_input_duplicates = {}
+
+    # ----------------------------------------------------------------------------------------
+    def get_persistent_cachefname(self):  # results for a given seq depend only on the germline set and these sw parameters, so we hash them all into the file name (each line in the file is then '<seq hash>\t<json annotation>')
+        glstr = json.dumps({k : v for k, v in self.glfo.items() if k != 'functionalities'}, sort_keys=True)
+        parstr = json.dumps([self.persistent_cache_version, self.vs_info is None, self.match_score, self.gap_open_penalty, self.args.no_indel_gap_open_penalty, self.args.n_max_per_region, self.args.max_vj_mut_freq])
+        return '%s/sw-%s-%s.txt' % (self.args.persistent_sw_cache_dir, self.args.locus, utils.uidhashstr(glstr + parstr, max_len=20))
+
+    # ----------------------------------------------------------------------------------------
+    def read_persistent_cache(self):  # read results for any of <self.remaining_queries> whose seqs were already run (with the same glfo and parameters) in a previous run, so we don't have to run sw on them
+        if self.msa_vs_info is not None:  # msa indel info depends on the other seqs in each family, so results aren't just a function of each seq
+            print('    %s not using --persistent-sw-cache-dir since msa indel info is set' % utils.color('yellow', 'note'))
+            return
+        start = time.time()
+        self.persistent_cachefname = self.get_persistent_cachefname()
+        if not os.path.exists(self.persistent_cachefname):
+            return
+        hash_queries = {}
+        for query in self.remaining_queries:
+            shash = utils.get_hash(self.input_info[query]['seqs'][0])
+            if shash not in hash_queries:
+                hash_queries[shash] = []
+            hash_queries[shash].append(query)
+        with open(self.persistent_cachefname) as cfile:
+            for cline in cfile:
+                if not cline.endswith('\n') or '\t' not in cline:  # incomplete last line, e.g. if another run is still writing to it
+                    continue
+                shash, jstr = cline.split('\t', 1)
+                if shash not in hash_queries:  # either we don't need it, or we already read it (there can be duplicate lines if several runs wrote at once)
+                    continue
+                try:
+                    cached_line = json.loads(jstr)
+                except ValueError:  # shouldn't happen now that we skip incomplete lines, but it'd be silly to crash on a corrupted cache file
+                    continue
+                queries = hash_queries.pop(shash)
+                for iq, query in enumerate(queries):
+                    line = cached_line if iq == len(queries) - 1 else copy.deepcopy(cached_line)  # the last one can use the original
+                    utils.process_yaml_annotation(self.glfo, line, dont_add_implicit_info=True)
+                    del line['indel_reversed_seqs']  # add_implicit_info() needs to set this to the same list as 'seqs' (which remove_framework_insertions() modifies)
+                    line['unique_ids'] = [query]
+                    line['duplicates'] = [self.duplicates.get(query, []), ]
+                    utils.add_implicit_info(self.glfo, line, aligned_gl_seqs=self.aligned_gl_seqs)
+                    self.persistent_cache_hits.add(query)  # even if we skip it below, we don't want to rerun it
+                    if self.skip_query(query, line):
+                        continue
+                    if indelutils.has_indels_line(line, 0):
+                        self.info['indels'][query] = line['indelfos'][0]
+                    self.add_to_info(line)
+        if len(self.persistent_cache_hits) > 0:
+            print('    read %d sw result%s from persistent cache %s (%.1f sec)' % (len(self.persistent_cache_hits), utils.plural(len(self.persistent_cache_hits)), self.persistent_cachefname, time.time() - start))
+
+    # ----------------------------------------------------------------------------------------
+    def write_persistent_cache(self):  # append results for queries that we actually ran through sw (i.e. not the ones we read from the persistent cache)
+        outlines, written_hashes = [], set()
+        for query in [q for q in self.input_info if q in self.info['passed-queries'] and q not in self.persistent_cache_hits]:
+            shash = utils.get_hash(self.input_info[query]['seqs'][0])
+            if shash in written_hashes:
+                continue
+            written_hashes.add(shash)
+            outlines.append('%s\t%s\n' % (shash, json.dumps(utils.get_yamlfo_for_output(self.info[query], utils.sw_cache_headers, glfo=self.glfo))))
+        if len(outlines) == 0:
+            return
+        if not os.path.exists(self.args.persistent_sw_cache_dir):
+            os.makedirs(self.args.persistent_sw_cache_dir)
+        with open(self.persistent_cachefname, 'a') as cfile:  # single write, so concurrent runs don't interleave lines (and a partial line gets skipped when reading)
+            cfile.write(''.join(outlines))
+        print('    wrote %d new sw result%s to persistent cache %s' % (len(outlines), utils.plural(len(outlines)), self.persistent_cachefname))
+
     # ----------------------------------------------------------------------------------------
     def clean_cache(self, cache_path):
-        for suffix in ['.csv', '.yaml']:
+        for suffix in ['.csv', '.yaml', '.pickle']:
             if os.path.exists(cache_path + suffix):
                 print('  removing old sw cache %s%s' % (cache_path, suffix))
                 os.remove(cache_path + suffix)
@@ -138,7 +260,10 @@ class Waterer(object):
             start = time.time()
             print('        reading sw results from %s' % cachefname)
 
-        if utils.getsuffix(cachefname) == '.csv':  # old way
+        binfo = self.read_binary_cachefile(cachefname)
+        if binfo is not None:  # if the binary version is there and up to date, it already has the implicit info, so we don't need to add it
+            self.glfo, reader = binfo
+        elif utils.getsuffix(cachefname) == '.csv':  # old way
             cachebase = utils.getprefix(cachefname)
             if os.path.exists(cachebase + '-glfo'):  # NOTE replaces original <self.glfo>
                 self.glfo = glutils.read_glfo(cachebase + '-glfo', self.args.locus)
@@ -152,7 +277,7 @@ class Waterer(object):
             raise Exception('unhandled sw cache file suffix %s' % cachefname)
 
         for line in reader:  # NOTE failed queries are *not* written to the cache file -- they're assumed to be whatever's in input info that's missing
-            if utils.getsuffix(cachefname) == '.csv':
+            if binfo is None and utils.getsuffix(cachefname) == '.csv':
                 utils.process_input_line(line)
                 for key in [k for k in [r + '_per_gene_support' for r in utils.regions] if k in line]:  # new files shouldn't have this, but I think I need to leave it for reading older files
                     del line[key]
@@ -163,7 +288,8 @@ class Waterer(object):
             else:  # normal operation
                 if uid not in self.input_info:
                     continue
-            utils.add_implicit_info(self.glfo, line, aligned_gl_seqs=self.aligned_gl_seqs)
+            if binfo is None:
+                utils.add_implicit_info(self.glfo, line, aligned_gl_seqs=self.aligned_gl_seqs)
             if indelutils.has_indels_line(line, 0):
                 self.info['indels'][uid] = line['indelfos'][0]
             self.add_to_info(line)
@@ -188,6 +314,47 @@ class Waterer(object):
         # NOTE do _not_ add extra headers here since if they're in the sw cache file I'd have to deal with removing them when I read it
         # NOTE does *not* write failed queries
         utils.write_annotations(cachefname, self.glfo, [self.info[q]for q in self.info['queries']], utils.sw_cache_headers, use_pyyaml=self.args.write_full_yaml_output, dont_write_git_info=self.args.dont_write_git_info)
+        self.write_binary_cachefile(cachefname)
+
+    # ----------------------------------------------------------------------------------------
+    def binary_cachefname(self, cachefname):
+        return utils.getprefix(cachefname) + '.pickle'
+
+    # ----------------------------------------------------------------------------------------
+    def cachefile_signature(self, cachefname):  # if the text cache file gets rewritten, the binary one is out of date
+        return (os.path.getsize(cachefname), os.path.getmtime(cachefname))
+
+    # ----------------------------------------------------------------------------------------
+    def aligned_gl_seqs_hash(self):  # implicit info also depends on the germline info, but that's read from the text cache file, so it's covered by the file signature
+        return utils.get_hash(json.dumps(self.aligned_gl_seqs, sort_keys=True, default=str))
+
+    # ----------------------------------------------------------------------------------------
+    def write_binary_cachefile(self, cachefname):  # binary version of the (text) cache file with the full query dicts (including implicit info), so reading it is much faster than re-adding implicit info
+        bininfo = {
+            'version' : 1,
+            'cachefile-signature' : self.cachefile_signature(cachefname),
+            'aligned-gl-seqs-hash' : self.aligned_gl_seqs_hash(),
+            'glfo' : self.glfo,
+            'lines' : [self.info[q] for q in self.info['queries']],
+        }
+        with open(self.binary_cachefname(cachefname), 'wb') as binfile:
+            pickle.dump(bininfo, binfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # ----------------------------------------------------------------------------------------
+    def read_binary_cachefile(self, cachefname):  # return glfo and list of query dicts from the binary cache file corresponding to <cachefname>, or None if it doesn't exist or is out of date
+        binfname = self.binary_cachefname(cachefname)
+        if not os.path.exists(binfname):
+            return None
+        try:
+            with open(binfname, 'rb') as binfile:
+                bininfo = pickle.load(binfile)
+        except Exception as ex:  # e.g. written by a different python version
+            print('        %s couldn\'t read binary sw cache %s (%s), so reading text cache file' % (utils.color('yellow', 'note'), binfname, ex))
+            return None
+        if bininfo['cachefile-signature'] != self.cachefile_signature(cachefname) or bininfo.get('aligned-gl-seqs-hash') != self.aligned_gl_seqs_hash():  # .get() since version 0 files don't have it
+            print('        %s binary sw cache %s out of date, so reading text cache file' % (utils.color('yellow', 'note'), binfname))
+            return None
+        return bininfo['glfo'], bininfo['lines']
 
     # ----------------------------------------------------------------------------------------
     def finalize(self, cachefname=None, just_read_cachefile=False, ignore_seed_unique_id=False, quiet=False):
@@ -1052,19 +1219,7 @@ class Waterer(object):
             print('      rerun: implicit info adding failed for %s (see above), rerunning' % qname)  # shouldn't be able to happen, so print even if debug isn't set
             return dbgfcn('see above')
 
-        # deal with unproductive rearrangements
-        if not utils.is_functional(line, iseq=0):
-            if self.args.skip_unproductive:
-                if self.debug:
-                    print('      skipping unproductive (%s)' % utils.is_functional_dbg_str(line, iseq=0))
-                self.skipped_unproductive_queries.add(qname)
-                self.remaining_queries.remove(qname)
-                return
-        if self.args.skip_in_frame_rearrangements and line['cdr3_length'] % 3 == 0:  # NOTE *not* the same as line['in_frames'][0] (since here we're caring if the original rearrangement was productive, whereas 'in_frames' depends also on shm indels)
-            if self.debug:
-                print('      skipping in frame rearrangement')
-            self.skipped_in_frame_queries.add(qname)
-            self.remaining_queries.remove(qname)
+        if self.skip_query(qname, line):
             return
 
         kbounds = self.get_kbounds(line, qinfo, best)  # gets the boundaries of the non-best matches from <qinfo>
@@ -1075,6 +1230,22 @@ class Waterer(object):
 
         self.add_to_info(line)
 
+    # ----------------------------------------------------------------------------------------
+    def skip_query(self, qname, line):  # deal with unproductive and in-frame rearrangements: if the args say to skip <qname>, move it from <self.remaining_queries> to the appropriate skipped set and return True
+        if not utils.is_functional(line, iseq=0) and self.args.skip_unproductive:
+            if self.debug:
+                print('      skipping unproductive (%s)' % utils.is_functional_dbg_str(line, iseq=0))
+            self.skipped_unproductive_queries.add(qname)
+            self.remaining_queries.remove(qname)
+            return True
+        if self.args.skip_in_frame_rearrangements and line['cdr3_length'] % 3 == 0:  # NOTE *not* the same as line['in_frames'][0] (since here we're caring if the original rearrangement was productive, whereas 'in_frames' depends also on shm indels)
+            if self.debug:
+                print('      skipping in frame rearrangement')
+            self.skipped_in_frame_queries.add(qname)
+            self.remaining_queries.remove(qname)
+            return True
+        return False
+
     # ----------------------------------------------------------------------------------------
     def get_kbounds(self, line, qinfo, best, debug=False):
         # NOTE